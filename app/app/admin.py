@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import Sum
 from .models import *
+from .engagement import COUNTERS
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
@@ -35,4 +37,25 @@ class MatchAdmin(admin.ModelAdmin):
 
 admin.site.register(ViewHistory)
 admin.site.register(DateInvitation)
-admin.site.register(UserLikeHistory)
\ No newline at end of file
+admin.site.register(UserLikeHistory)
+admin.site.register(Recommendation)
+
+@admin.register(DailyEngagement)
+class DailyEngagementAdmin(admin.ModelAdmin):
+    """Отчет по дневным агрегатам: итоги считаются по отфильтрованным строкам агрегатов"""
+    list_display = ['user', 'day', 'views_received', 'likes_received', 'likes_sent', 'matches']
+    list_select_related = ['user']
+    date_hierarchy = 'day'
+    search_fields = ['user__email']
+    raw_id_fields = ['user']
+    
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None:
+            response.context_data['totals'] = changelist.queryset.aggregate(
+                **{counter: Sum(counter) for counter in COUNTERS}
+            )
+        return response
+
+admin.site.register(RollupWatermark)
\ No newline at end of file
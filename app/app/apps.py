@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class DatingConfig(AppConfig):
+    name = 'app'
+
+    def ready(self):
+        from . import checks  # noqa: F401
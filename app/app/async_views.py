@@ -0,0 +1,200 @@
+import json
+import random
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import InvalidPage, Paginator
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework import exceptions, status
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .authentication import user_cache
+from .buffers import record_views
+from .events import get_broker
+from .deck import get_deck, rank, parse_deck_size, parse_sort
+from .filters import profile_filters
+from .models import Match, User
+from .sampling import asample_pk
+from .serializers import MatchSerializer, SwipeSerializer, UserProfileSerializer
+from .swipes import record_swipe
+
+_jwt = JWTAuthentication()
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    """Ответ в том же виде, что дает JSONRenderer DRF"""
+    return JsonResponse(data, status=status, safe=False, encoder=JSONEncoder,
+                        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+async def authenticate(request):
+    """Пользователь по JWT из заголовка Authorization, как CachedJWTAuthentication"""
+    header = _jwt.get_header(request)
+    raw_token = _jwt.get_raw_token(header) if header else None
+    if raw_token is None:
+        raise exceptions.NotAuthenticated()
+    token = _jwt.get_validated_token(raw_token)
+    user_id = token[jwt_settings.USER_ID_CLAIM]
+    user = await user_cache.aget(user_id)
+    if user is None:
+        stamp = await user_cache.astamp(user_id)
+        user = await User.objects.filter(pk=user_id, is_active=True).afirst()
+        if user is None:
+            raise exceptions.AuthenticationFailed('Пользователь не найден или неактивен')
+        user_cache.set(user, stamp)
+    return user
+
+
+def async_api_view(methods, query_token=False):
+    """Асинхронное представление API: метод, JWT-аутентификация и ошибки в формате DRF.
+
+    CSRF не проверяется - как и во viewset'ах, аутентификация только по токену.
+    С query_token=True токен можно передать параметром ?token= (EventSource
+    в браузере не умеет задавать заголовки).
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return json_response({'detail': f'Метод "{request.method}" не разрешен.'},
+                                     status=status.HTTP_405_METHOD_NOT_ALLOWED)
+            if query_token and 'HTTP_AUTHORIZATION' not in request.META and request.GET.get('token'):
+                request.META['HTTP_AUTHORIZATION'] = f'Bearer {request.GET["token"]}'
+            try:
+                request.user = await authenticate(request)
+            except (InvalidToken, exceptions.APIException) as exc:
+                detail = exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail}
+                response = json_response(detail, status=exc.status_code)
+                response['WWW-Authenticate'] = _jwt.authenticate_header(request)
+                return response
+            return await view(request, *args, **kwargs)
+        # csrf_exempt в Django 4.2 превращает представление в синхронное
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def _serialize(serializer_class, instance, request, many=False):
+    return serializer_class(instance, many=many, context={'request': request}).data
+
+
+@async_api_view(['POST'])
+async def swipe(request):
+    """Свайп с теми же проверками, что у пакетного эндпоинта"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return json_response({'detail': 'Некорректный JSON'}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = SwipeSerializer(data=data)
+    if not serializer.is_valid():
+        return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # Запись с лайками и матчами идет одной транзакцией, а транзакций у асинхронного ORM нет
+    result, code = await sync_to_async(record_swipe)(
+        request.user, serializer.validated_data['to_user'], serializer.validated_data['interaction_type']
+    )
+    return json_response(result, status=code)
+
+
+@async_api_view(['GET'])
+async def deck(request):
+    size = parse_deck_size(request.GET.get('size'))
+    if size is None:
+        return json_response({'detail': 'Некорректный размер пачки'}, status=status.HTTP_400_BAD_REQUEST)
+
+    profiles, next_cursor = await sync_to_async(get_deck)(
+        request.user,
+        profile_filters(request.GET),
+        size,
+        cursor=request.GET.get('cursor'),
+        sort=parse_sort(request.GET.get('sort'))
+    )
+    await sync_to_async(record_views)(request.user, profiles)
+    return json_response({
+        'results': await sync_to_async(_serialize)(UserProfileSerializer, profiles, request, many=True),
+        'next': next_cursor,
+    })
+
+
+@async_api_view(['GET'])
+async def random_profile(request):
+    queryset = User.objects.exclude(pk=request.user.pk).filter(**profile_filters(request.GET))
+    sort = parse_sort(request.GET.get('sort'))
+    top = await sync_to_async(rank)(request.user, queryset, sort, settings.RANKED_TOP_K) if sort else []
+    pk = random.choice(top) if top else await asample_pk(queryset)
+    user = await queryset.filter(pk=pk).afirst() if pk is not None else None
+    if user is None:
+        return json_response({'detail': 'Нет пользователей, соответствующих фильтрам'},
+                             status=status.HTTP_404_NOT_FOUND)
+
+    await sync_to_async(record_views)(request.user, [user])
+    return json_response(await sync_to_async(_serialize)(UserProfileSerializer, user, request))
+
+
+def _page_number(value, count, page_size):
+    """Номер страницы по правилам PageNumberPagination; None - такой страницы нет"""
+    paginator = Paginator(range(count), page_size)
+    if value in PageNumberPagination.last_page_strings:
+        return paginator.num_pages
+    try:
+        return paginator.validate_number(value)
+    except InvalidPage:
+        return None
+
+
+@async_api_view(['GET'])
+async def matches(request):
+    """Матчи пользователя с той же постраничной разбивкой, что у MatchViewSet"""
+    queryset = Match.for_user(request.user).select_related('user1', 'user2')
+    count = await queryset.acount()
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    page = _page_number(request.GET.get('page', 1), count, page_size)
+    if page is None:
+        return json_response({'detail': 'Неправильная страница'}, status=status.HTTP_404_NOT_FOUND)
+
+    offset = (page - 1) * page_size
+    rows = [match async for match in queryset[offset:offset + page_size]]
+    url = request.build_absolute_uri()
+    previous = None
+    if page == 2:
+        previous = remove_query_param(url, 'page')
+    elif page > 2:
+        previous = replace_query_param(url, 'page', page - 1)
+    return json_response({
+        'count': count,
+        'next': replace_query_param(url, 'page', page + 1) if offset + page_size < count else None,
+        'previous': previous,
+        'results': await sync_to_async(_serialize)(MatchSerializer, rows, request, many=True),
+    })
+
+
+@async_api_view(['GET'], query_token=True)
+async def events(request):
+    """Поток событий пользователя (text/event-stream): новые матчи и приглашения.
+
+    После переподключения клиент получает пропущенные события по
+    заголовку Last-Event-ID (или параметру last_event_id).
+    """
+    options = settings.EVENTS
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    stream = get_broker().subscribe(request.user.pk, last_event_id, options['HEARTBEAT'])
+
+    async def body():
+        try:
+            yield f'retry: {options["RETRY_MS"]}\n\n'
+            async for event in stream:
+                yield ': ping\n\n' if event is None else event.encode()
+        finally:
+            await stream.aclose()
+
+    response = StreamingHttpResponse(body(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Отключить буферизацию ответа в nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
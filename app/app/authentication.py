@@ -0,0 +1,142 @@
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import User
+
+
+# Метка живет дольше записей, чтобы не вытеснять их лишний раз
+STAMP_TIMEOUT = 24 * 60 * 60
+
+
+def stamp_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+class UserCache:
+    """Локальный кеш активных пользователей процесса по id.
+
+    Записи живут AUTH_USER_CACHE['TTL'] секунд, самые старые вытесняются
+    после MAX_ENTRIES. Каждая запись помнит метку пользователя из общего
+    кеша (CACHES['default']) и принимается, только пока метка та же:
+    forget_users удаляет метку, и запись отвергается во всех процессах.
+    Метку нужно взять через stamp() до чтения пользователя из БД, тогда
+    изменение между чтением и set() тоже не останется в кеше.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _lookup(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            expires, stamp, user = entry
+            if expires < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+        return stamp, user
+
+    def _check(self, user_id, entry, stamp):
+        if stamp != entry[0]:
+            self.discard(user_id)
+            return None
+        # Копия, чтобы запросы не делили один изменяемый объект
+        return copy.copy(entry[1])
+
+    def get(self, user_id):
+        entry = self._lookup(user_id)
+        if entry is None:
+            return None
+        return self._check(user_id, entry, cache.get(stamp_key(user_id)))
+
+    async def aget(self, user_id):
+        entry = self._lookup(user_id)
+        if entry is None:
+            return None
+        return self._check(user_id, entry, await cache.aget(stamp_key(user_id)))
+
+    def stamp(self, user_id):
+        if not settings.AUTH_USER_CACHE['TTL']:
+            return None
+        cache.add(stamp_key(user_id), uuid.uuid4().hex, STAMP_TIMEOUT)
+        return cache.get(stamp_key(user_id))
+
+    async def astamp(self, user_id):
+        if not settings.AUTH_USER_CACHE['TTL']:
+            return None
+        await cache.aadd(stamp_key(user_id), uuid.uuid4().hex, STAMP_TIMEOUT)
+        return await cache.aget(stamp_key(user_id))
+
+    def set(self, user, stamp):
+        options = settings.AUTH_USER_CACHE
+        if not options['TTL'] or not user.is_active or stamp is None:
+            return
+        with self.lock:
+            self.entries[user.pk] = (time.monotonic() + options['TTL'], stamp, copy.copy(user))
+            self.entries.move_to_end(user.pk)
+            while len(self.entries) > options['MAX_ENTRIES']:
+                self.entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache()
+
+
+def forget_users(user_ids):
+    """Сбрасывает пользователей в user_cache всех процессов"""
+    user_ids = list(user_ids)
+    for user_id in user_ids:
+        user_cache.discard(user_id)
+    cache.delete_many([stamp_key(user_id) for user_id in user_ids])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication, который берет пользователя по id из токена из user_cache.
+
+    Запрос к БД выполняется только при промахе кеша.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = user_cache.get(user_id)
+        if user is None:
+            stamp = user_cache.stamp(user_id)
+            user = super().get_user(validated_token)
+            user_cache.set(user, stamp)
+        elif jwt_settings.CHECK_REVOKE_TOKEN and \
+                validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _discard_cached_user(sender, instance, **kwargs):
+    forget_users([instance.pk])
@@ -0,0 +1,151 @@
+import atexit
+import logging
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import ViewHistory
+
+logger = logging.getLogger(__name__)
+
+
+class ViewHistoryBuffer:
+    """Буфер просмотров с отложенной записью.
+
+    События копятся в памяти процесса и пишутся одним bulk_create, когда
+    набирается batch_size записей или проходит flush_interval секунд.
+    Если очередь дошла до max_size, новые события отбрасываются и
+    учитываются в счетчике dropped; о новых потерях фоновый поток пишет
+    WARNING, а stats() попадает в структурированный лог каждого запроса.
+    """
+
+    def __init__(self, max_size=10000, batch_size=500, flush_interval=2.0, autostart=True):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.autostart = autostart
+        self.dropped = 0
+        self.flushed = 0
+        # dropped на момент последнего предупреждения в лог
+        self._reported_dropped = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._worker = None
+        self._stopping = False
+
+    def record(self, viewer_id, viewed_user_id, viewed_at=None):
+        with self._lock:
+            if len(self._queue) >= self.max_size:
+                self.dropped += 1
+                return False
+            self._queue.append(ViewHistory(
+                viewer_id=viewer_id,
+                viewed_user_id=viewed_user_id,
+                viewed_at=viewed_at or timezone.now()
+            ))
+            if self.autostart and self._worker is None:
+                self._start()
+            if len(self._queue) >= self.batch_size:
+                self._wakeup.notify()
+        return True
+
+    def flush(self):
+        """Записать все накопленные события; возвращает число записанных"""
+        written = 0
+        while True:
+            with self._lock:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            if not batch:
+                return written
+            try:
+                ViewHistory.objects.bulk_create(batch)
+            except Exception:
+                logger.exception('Не удалось записать %s просмотров', len(batch))
+                with self._lock:
+                    self.dropped += len(batch)
+                continue
+            written += len(batch)
+            with self._lock:
+                self.flushed += len(batch)
+
+    def stats(self):
+        with self._lock:
+            return {'depth': len(self._queue), 'dropped': self.dropped, 'flushed': self.flushed}
+
+    def report_drops(self):
+        """WARNING, если с прошлого вызова были отброшенные события; возвращает их число"""
+        stats = self.stats()
+        dropped = stats['dropped'] - self._reported_dropped
+        if dropped:
+            self._reported_dropped = stats['dropped']
+            logger.warning('view_history_buffer отброшено событий: %s %s', dropped, stats)
+        return dropped
+
+    def stop(self):
+        """Остановить фоновый поток и дописать остаток очереди"""
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+            worker = self._worker
+        if worker is not None:
+            worker.join()
+        self.flush()
+
+    def _start(self):
+        self._worker = threading.Thread(target=self._run, name='view-history-buffer', daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._stopping and len(self._queue) < self.batch_size:
+                    self._wakeup.wait(self.flush_interval)
+                stopping = self._stopping
+            if stopping:
+                return
+            try:
+                if self.flush():
+                    logger.debug('view_history_buffer %s', self.stats())
+                self.report_drops()
+            finally:
+                close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_view_history_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            config = settings.VIEW_HISTORY_BUFFER
+            _buffer = ViewHistoryBuffer(
+                max_size=config['MAX_SIZE'],
+                batch_size=config['BATCH_SIZE'],
+                flush_interval=config['FLUSH_INTERVAL']
+            )
+            atexit.register(_buffer.stop)
+        return _buffer
+
+
+def buffer_stats():
+    """stats() буфера процесса или None, если буфер еще не создан"""
+    buffer = _buffer
+    return buffer.stats() if buffer is not None else None
+
+
+def record_views(viewer, viewed_users):
+    """Записать просмотры профилей: через буфер или сразу, если буфер выключен"""
+    if not settings.VIEW_HISTORY_BUFFER['ENABLED']:
+        ViewHistory.objects.bulk_create([
+            ViewHistory(viewer=viewer, viewed_user=viewed_user) for viewed_user in viewed_users
+        ])
+        return
+    buffer = get_view_history_buffer()
+    for viewed_user in viewed_users:
+        buffer.record(viewer.pk, viewed_user.pk)
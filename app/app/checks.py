@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from django.db import connections
+from django.utils import timezone
+
+from .partitions import HISTORY_TABLES, is_partitioned, month_start, partitions, shift_month
+
+REDIS_CACHE = 'django.core.cache.backends.redis.RedisCache'
+REDIS_BROKER = 'app.events.RedisBroker'
+IN_MEMORY_BROKER = 'app.events.InMemoryBroker'
+# Кеши, которые не видны другим процессам
+LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def redis_installed():
+    try:
+        import redis  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@register(Tags.caches)
+def check_redis_cache(app_configs, **kwargs):
+    """Кеш на Redis (REDIS_URL) требует пакета redis и адреса сервера"""
+    errors = []
+    for alias, options in settings.CACHES.items():
+        if options['BACKEND'] != REDIS_CACHE:
+            continue
+        if not redis_installed():
+            errors.append(Error(
+                f'Кеш {alias} использует Redis, но пакет redis не установлен',
+                hint='pip install -r requirements.txt',
+                id='app.E001',
+            ))
+        if not options.get('LOCATION'):
+            errors.append(Error(f'Для кеша {alias} на Redis не задан LOCATION', id='app.E002'))
+    return errors
+
+
+@register()
+def check_events_broker(app_configs, **kwargs):
+    """RedisBroker требует пакета redis и REDIS_URL"""
+    if settings.EVENTS['BROKER'] != REDIS_BROKER:
+        return []
+    errors = []
+    if not redis_installed():
+        errors.append(Error(
+            'EVENTS_BROKER - RedisBroker, но пакет redis не установлен',
+            hint='pip install -r requirements.txt',
+            id='app.E003',
+        ))
+    if not settings.EVENTS['REDIS_URL']:
+        errors.append(Error('Для RedisBroker не задан REDIS_URL', id='app.E004'))
+    return errors
+
+
+@register(deploy=True)
+def check_in_memory_broker(app_configs, **kwargs):
+    """InMemoryBroker доставляет события только подписчикам своего процесса"""
+    if settings.EVENTS['BROKER'] != IN_MEMORY_BROKER:
+        return []
+    return [Warning(
+        'События InMemoryBroker не доходят до подписчиков других воркеров и процессов',
+        hint='При нескольких воркерах или отдельном WSGI-процессе задайте '
+             'EVENTS_BROKER=app.events.RedisBroker и REDIS_URL',
+        id='app.W001',
+    )]
+
+
+@register(Tags.caches, Tags.database)
+def check_replica_pins(app_configs, **kwargs):
+    """Закрепление за основной БД после записи хранится в кеше: с репликой он должен быть общим"""
+    if settings.DATABASE_REPLICA['ALIAS'] is None or settings.CACHES['default']['BACKEND'] not in LOCAL_CACHES:
+        return []
+    return [Error(
+        'Реплика включена, но кеш локальный: запись в одном процессе не закрепит '
+        'пользователя за основной БД в других, и он прочитает устаревшие данные',
+        hint='Задайте REDIS_URL',
+        id='app.E005',
+    )]
+
+
+@register(Tags.database)
+def check_history_partitions(app_configs, databases=None, **kwargs):
+    """Секции истории созданы хотя бы на следующий месяц (migrate, check --database default)"""
+    horizon = shift_month(month_start(timezone.now()), 1)
+    warnings = []
+    for alias in databases or []:
+        connection = connections[alias]
+        for table in HISTORY_TABLES:
+            if not is_partitioned(connection, table):
+                continue
+            last = max(partitions(connection, table), default=None)
+            if last is None or last < horizon:
+                warnings.append(Warning(
+                    f'У {table} нет секции на {horizon:%Y-%m}: новые строки будут копиться в секции DEFAULT',
+                    hint='Запустите python manage.py prune_history',
+                    id='app.W002',
+                ))
+    return warnings
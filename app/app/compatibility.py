@@ -0,0 +1,279 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+_SEPARATORS = re.compile(r'[,;/\n]+')
+# id кандидатов в одном запросе проверки фильтра
+_FILTER_BATCH = 500
+
+
+def tokenize(hobbies):
+    """Разбить текст увлечений на нормализованные токены"""
+    tokens = set()
+    for part in _SEPARATORS.split(hobbies or ''):
+        token = ' '.join(part.split()).casefold().replace('ё', 'е')
+        if token:
+            tokens.add(sys.intern(token))
+    return tokens
+
+
+class HobbyIndex:
+    """Словарь увлечений, обратный индекс и битовые строки пользователей.
+
+    Каждому токену присваивается номер бита, у каждого пользователя есть
+    строка из слов uint64. Сходство по Жаккару считается для всех
+    кандидатов сразу: popcount(a & b) / popcount(a | b).
+    """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.postings = {}
+        self.tokens = {}
+        self.bits = np.zeros((0, 1), dtype=np.uint64)
+        # Номер строки по id пользователя, -1 - пользователя нет в индексе
+        self.row_of = np.full(0, -1, dtype=np.int64)
+        self.user_of = np.zeros(0, dtype=np.int64)
+        self.free_rows = []
+        self.used_rows = 0
+        self.lock = threading.Lock()
+
+    def _token_id(self, token):
+        token_id = self.vocabulary.get(token)
+        if token_id is None:
+            token_id = self.vocabulary[token] = len(self.vocabulary)
+            self.postings[token_id] = set()
+            words = self.bits.shape[1]
+            if token_id >= words * 64:
+                self.bits = np.pad(self.bits, ((0, 0), (0, words)))
+        return token_id
+
+    def _row(self, user_id):
+        if user_id >= len(self.row_of):
+            grown = np.full(max(user_id + 1, len(self.row_of) * 2), -1, dtype=np.int64)
+            grown[:len(self.row_of)] = self.row_of
+            self.row_of = grown
+        row = self.row_of[user_id]
+        if row < 0:
+            if self.free_rows:
+                row = self.free_rows.pop()
+            else:
+                row = self.used_rows
+                self.used_rows += 1
+                if row >= len(self.bits):
+                    self.bits = np.pad(self.bits, ((0, max(row + 1, len(self.bits))), (0, 0)))
+                    self.user_of = np.pad(self.user_of, (0, len(self.bits) - len(self.user_of)))
+            self.row_of[user_id] = row
+            self.user_of[row] = user_id
+        return row
+
+    def update(self, user_id, hobbies):
+        """Переиндексировать одного пользователя после изменения профиля"""
+        with self.lock:
+            token_ids = {self._token_id(token) for token in tokenize(hobbies)}
+            for token_id in self.tokens.get(user_id, set()) - token_ids:
+                self.postings[token_id].discard(user_id)
+            for token_id in token_ids:
+                self.postings[token_id].add(user_id)
+            row = self._row(user_id)
+            self.tokens[user_id] = token_ids
+            self.bits[row] = 0
+            for token_id in token_ids:
+                self.bits[row, token_id // 64] |= np.uint64(1 << (token_id % 64))
+
+    def remove(self, user_id):
+        with self.lock:
+            if user_id not in self.tokens:
+                return
+            for token_id in self.tokens.pop(user_id):
+                self.postings[token_id].discard(user_id)
+            row = self.row_of[user_id]
+            self.bits[row] = 0
+            self.row_of[user_id] = -1
+            self.free_rows.append(row)
+
+    def scores(self, user_id, candidate_ids):
+        """Сходство пользователя с каждым кандидатом, массив той же длины"""
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        result = np.zeros(len(candidate_ids))
+        with self.lock:
+            token_ids = self.tokens.get(user_id)
+            if not token_ids or not len(candidate_ids):
+                return result
+            # Ненулевое сходство только у тех, кто делит хотя бы одно увлечение
+            related = np.zeros(len(self.row_of) + 1, dtype=bool)
+            for token_id in token_ids:
+                posting = self.postings[token_id]
+                related[np.fromiter(posting, dtype=np.int64, count=len(posting))] = True
+            mask = related[np.minimum(candidate_ids, len(self.row_of))]
+            rows = self.row_of[candidate_ids[mask]]
+            query = self.bits[self.row_of[user_id]]
+            other = self.bits[rows]
+            common = np.bitwise_count(other & query).sum(axis=1)
+            total = np.bitwise_count(other | query).sum(axis=1)
+        result[mask] = common / total
+        return result
+
+    def _related(self, user_id, rng):
+        """id всех, кто делит с пользователем хотя бы одно увлечение, и ключи сортировки.
+
+        Ключ - сходство плюс случайная добавка меньше половины наименьшего
+        зазора между разными дробями c / t (1 / t_max²): порядок по ключу -
+        порядок по сходству, равные идут в случайном порядке.
+        """
+        with self.lock:
+            if not self.tokens.get(user_id):
+                return np.zeros(0, dtype=np.int64), np.zeros(0)
+            row = self.row_of[user_id]
+            bits = self.bits[:self.used_rows]
+            query = bits[row]
+            # Проход по битовым строкам всех пользователей векторный и дешевле объединения списков индекса
+            common = np.bitwise_count(bits & query).sum(axis=1)
+            rows = np.flatnonzero(common)
+            rows = rows[rows != row]
+            total = np.bitwise_count(bits[rows] | query).sum(axis=1)
+            candidate_ids = self.user_of[rows]
+        if not len(rows):
+            return candidate_ids, np.zeros(0)
+        rng = rng or np.random.default_rng()
+        jitter = rng.random(len(rows)) * (0.5 / float(total.max()) ** 2)
+        return candidate_ids, common[rows] / total + jitter
+
+    def ranked_batches(self, user_id, batch_size, limit=None, rng=None):
+        """Кандидаты с общими увлечениями по убыванию сходства, пачками по batch_size.
+
+        Каждая пачка выбирается np.argpartition за линейное время, сортируется
+        только она; до следующей пачки вызывающий код может не дойти.
+        """
+        candidate_ids, keys = self._related(user_id, rng)
+        remaining = len(candidate_ids) if limit is None else min(limit, len(candidate_ids))
+        while remaining > 0:
+            size = min(batch_size, remaining)
+            if size < len(keys):
+                best = np.argpartition(-keys, size - 1)[:size]
+            else:
+                best = np.arange(len(keys))
+            best = best[np.argsort(-keys[best])]
+            yield candidate_ids[best]
+            candidate_ids = np.delete(candidate_ids, best)
+            keys = np.delete(keys, best)
+            remaining -= size
+
+    def ranked_related(self, user_id, limit=None, rng=None):
+        """До limit (по умолчанию всех) id с общими увлечениями по убыванию сходства"""
+        batches = self.ranked_batches(user_id, limit or len(self.user_of) or 1, limit, rng)
+        return next(batches, np.zeros(0, dtype=np.int64))
+
+    @classmethod
+    def build(cls, rows):
+        index = cls()
+        for user_id, hobbies in rows:
+            index.update(user_id, hobbies)
+        return index
+
+
+_index = None
+_built_at = 0.0
+_build_lock = threading.Lock()
+
+
+def build_index():
+    """Собрать индекс из БД и сделать его индексом процесса"""
+    global _index, _built_at
+    rows = User.objects.values_list('pk', 'hobbies').iterator(chunk_size=5000)
+    _index = HobbyIndex.build(rows)
+    _built_at = time.monotonic()
+    return _index
+
+
+def _build_in_background():
+    try:
+        build_index()
+    except Exception:
+        logger.exception('compatibility index build failed')
+    finally:
+        connection.close()
+        _build_lock.release()
+
+
+def start_build():
+    """Пересобрать индекс в фоновом потоке, если сборка еще не идет.
+
+    Вызывается из get_index при первом обращении процесса и по истечении TTL.
+    """
+    if _build_lock.acquire(blocking=False):
+        threading.Thread(target=_build_in_background, name='compatibility-index', daemon=True).start()
+
+
+def _after_fork():
+    # Поток сборки в дочерний процесс не переходит, а занятая им блокировка -
+    # переходит (gunicorn --preload); без новой блокировки индекс бы не собрался
+    global _build_lock
+    _build_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_index():
+    """Индекс процесса или None, пока первая сборка не закончилась.
+
+    Запрос никогда не ждет сборки: устаревший индекс отдается, пока новый
+    собирается в фоне. Изменения профилей в этом процессе попадают в
+    индекс сразу через сигналы, из других процессов - при пересборке.
+    """
+    if _index is None or time.monotonic() - _built_at > settings.COMPATIBILITY_INDEX_TTL:
+        start_build()
+    return _index
+
+
+def reset_index():
+    global _index
+    _index = None
+
+
+def rank_candidates(user, queryset, k):
+    """До k самых совместимых по увлечениям кандидатов из queryset; пусто, пока индекса нет.
+
+    Кандидаты с общими увлечениями идут из индекса по убыванию сходства и
+    проверяются фильтром queryset пачками по id, пока не наберется k или
+    не кончится COMPATIBILITY_SCAN_LIMIT; сам queryset целиком не читается,
+    а следующая пачка ранжируется, только если до нее дошло.
+    """
+    index = get_index()
+    if index is None:
+        return []
+    batches = index.ranked_batches(user.pk, max(k, _FILTER_BATCH), limit=settings.COMPATIBILITY_SCAN_LIMIT)
+    result = []
+    for batch in batches:
+        ids = batch.tolist()
+        allowed = set(queryset.filter(pk__in=ids).values_list('pk', flat=True))
+        result += [pk for pk in ids if pk in allowed]
+        if len(result) >= k:
+            break
+    return result[:k]
+
+
+@receiver(post_save, sender=User)
+def _update_index(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if _index is not None and (update_fields is None or 'hobbies' in update_fields):
+        _index.update(instance.pk, instance.hobbies)
+
+
+@receiver(post_delete, sender=User)
+def _remove_from_index(sender, instance, **kwargs):
+    if _index is not None:
+        _index.remove(instance.pk)
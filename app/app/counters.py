@@ -0,0 +1,69 @@
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import User, LikeCounterShard
+
+
+def increment_likes(user_ids, amount=1):
+    """Увеличить счетчик лайков пользователей, не трогая строки User.
+
+    Прирост пишется в случайный шард, поэтому одновременные лайки одному
+    популярному профилю расходятся по разным строкам. Недостающие строки
+    шарда создаются через INSERT ... ON CONFLICT DO NOTHING, затем вся
+    пачка атомарно увеличивается одним UPDATE.
+    """
+    if not user_ids:
+        return
+    shard = random.randrange(settings.LIKE_COUNTER_SHARDS)
+    shards = LikeCounterShard.objects.filter(user_id__in=user_ids, shard=shard)
+    # Обычно шард уже существует, и хватает одного UPDATE
+    if len(user_ids) == 1 and shards.update(count=F('count') + amount):
+        return
+    LikeCounterShard.objects.bulk_create(
+        [LikeCounterShard(user_id=user_id, shard=shard) for user_id in user_ids],
+        ignore_conflicts=True
+    )
+    shards.update(count=F('count') + amount)
+
+
+def flush_likes(batch_size=None):
+    """Перенести накопленные в шардах лайки в User.likes_count.
+
+    Шарды читаются в той же транзакции с блокировкой строк, а занятые
+    другим сбросом пропускаются (SKIP LOCKED), поэтому параллельные
+    сбросы не перенесут один прирост дважды. Из шардов вычитается ровно
+    прочитанное значение, поэтому лайки, пришедшие во время сброса, не
+    теряются. Возвращает число обработанных шардов.
+    """
+    batch_size = batch_size or settings.LIKE_COUNTER_FLUSH_BATCH
+    with transaction.atomic():
+        rows = list(LikeCounterShard.objects.select_for_update(skip_locked=True)
+                    .filter(count__gt=0).order_by('pk')
+                    .values_list('pk', 'user_id', 'count')[:batch_size])
+        if not rows:
+            return 0
+
+        shards_by_count = defaultdict(list)
+        totals = defaultdict(int)
+        for pk, user_id, count in rows:
+            shards_by_count[count].append(pk)
+            totals[user_id] += count
+
+        users_by_total = defaultdict(list)
+        for user_id, total in totals.items():
+            users_by_total[total].append(user_id)
+
+        # Пользователи блокируются в порядке pk, чтобы параллельные сбросы не взаимоблокировались
+        list(User.objects.select_for_update().filter(pk__in=totals).order_by('pk').values_list('pk'))
+        for count, pks in shards_by_count.items():
+            LikeCounterShard.objects.filter(pk__in=pks).update(count=F('count') - count)
+        for total, user_ids in users_by_total.items():
+            User.objects.filter(pk__in=user_ids).update(
+                likes_count=F('likes_count') + total,
+                profile_version=F('profile_version') + 1
+            )
+    return len(rows)
@@ -0,0 +1,120 @@
+import random
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+
+from .compatibility import rank_candidates
+from .models import Recommendation, User, UserInteraction
+
+CURSOR_SALT = 'app.deck'
+SORTS = ('compatibility', 'recommended')
+
+
+def parse_deck_size(value):
+    """Размер пачки из параметра запроса в пределах DECK_MAX_PAGE_SIZE; None - некорректный"""
+    if value is None:
+        return settings.DECK_PAGE_SIZE
+    try:
+        return max(1, min(int(value), settings.DECK_MAX_PAGE_SIZE))
+    except ValueError:
+        return None
+
+
+def parse_sort(value):
+    return value if value in SORTS else None
+
+
+def candidates_queryset(user, filters):
+    """Кандидаты для колоды: без самого пользователя и без тех, с кем уже было взаимодействие"""
+    seen = UserInteraction.objects.filter(from_user=user, to_user=OuterRef('pk'))
+    return User.objects.filter(**filters).exclude(pk=user.pk).filter(~Exists(seen))
+
+
+def _queue_key(user, token):
+    return f'deck:{user.pk}:{token}'
+
+
+def rank(user, queryset, sort, k):
+    """До k id из queryset в порядке сортировки sort.
+
+    compatibility - сходство увлечений, recommended - рекомендации
+    build_recommendations. Для неизвестной сортировки - пустой список.
+    """
+    if sort == 'compatibility':
+        return rank_candidates(user, queryset, k)
+    if sort == 'recommended':
+        return list(
+            Recommendation.objects.filter(user=user, recommended_user__in=queryset.values('pk'))
+                .order_by('-score').values_list('recommended_user_id', flat=True)[:k]
+        )
+    return []
+
+
+def build_queue(user, filters, sort=None, rng=random):
+    """Собрать очередь id кандидатов, начиная со случайной точки диапазона pk.
+
+    С сортировкой очередь начинается с лучших кандидатов по rank(),
+    остаток добирается случайными.
+    """
+    size = settings.DECK_QUEUE_SIZE
+    candidates = candidates_queryset(user, filters)
+    ranked = rank(user, candidates, sort, size) if sort else []
+    if len(ranked) >= size:
+        return ranked
+    pks = candidates.exclude(pk__in=ranked).order_by('pk').values_list('pk', flat=True)
+    size -= len(ranked)
+    lo = pks.first()
+    if lo is None:
+        return ranked
+    pivot = rng.randint(lo, pks.last())
+    queue = list(pks.filter(pk__gte=pivot)[:size])
+    if len(queue) < size:
+        queue += list(pks.filter(pk__lt=pivot)[:size - len(queue)])
+    rng.shuffle(queue)
+    return ranked + queue
+
+
+def encode_cursor(token, offset, filters, sort=None):
+    return signing.dumps({'t': token, 'o': offset, 'f': filters, 's': sort}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    """Разобрать курсор; для подделанного или устаревшего курсора вернуть None"""
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+    return data['t'], data['o'], data['f'], data.get('s')
+
+
+def get_deck(user, filters, size, cursor=None, sort=None):
+    """Вернуть пачку профилей и курсор следующей пачки.
+
+    Очередь кандидатов хранится в кеше короткое время; если она истекла
+    или закончилась, собирается новая с теми же фильтрами.
+    """
+    token, offset = None, 0
+    if cursor:
+        decoded = decode_cursor(cursor)
+        if decoded:
+            token, offset, filters, sort = decoded
+
+    queue = cache.get(_queue_key(user, token)) if token else None
+    if queue is None or offset >= len(queue):
+        queue = build_queue(user, filters, sort)
+        token, offset = secrets.token_hex(8), 0
+        cache.set(_queue_key(user, token), queue, settings.DECK_QUEUE_TTL)
+
+    profiles = []
+    while len(profiles) < size and offset < len(queue):
+        ids = queue[offset:offset + size - len(profiles)]
+        offset += len(ids)
+        # Пока очередь лежала в кеше, пользователь мог уже свайпнуть часть кандидатов
+        found = candidates_queryset(user, {}).filter(pk__in=ids).in_bulk()
+        profiles += [found[pk] for pk in ids if pk in found]
+
+    next_cursor = encode_cursor(token, offset, filters, sort) if queue else None
+    return profiles, next_cursor
@@ -0,0 +1,116 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyEngagement, Match, RollupWatermark, UserInteraction, ViewHistory
+
+COUNTERS = ['views_received', 'likes_received', 'likes_sent', 'matches']
+
+# Источник агрегатов: модель, поле времени, фильтр строк и [(поле пользователя, счетчик)]
+SOURCES = {
+    'views': (ViewHistory, 'viewed_at', {}, [('viewed_user', 'views_received')]),
+    'likes': (UserInteraction, 'created_at', {'interaction_type': 'like'},
+              [('to_user', 'likes_received'), ('from_user', 'likes_sent')]),
+    'matches': (Match, 'created_at', {}, [('user1', 'matches'), ('user2', 'matches')]),
+}
+
+
+def _deltas(source, after_id, last_id):
+    """Приросты счетчиков по строкам источника с id из (after_id, last_id]: {(user_id, день): {счетчик: n}}"""
+    model, time_field, filters, targets = SOURCES[source]
+    rows = model.objects.filter(pk__gt=after_id, pk__lte=last_id, **filters)\
+               .annotate(day=TruncDate(time_field)).order_by()
+    deltas = defaultdict(lambda: defaultdict(int))
+    for user_field, counter in targets:
+        for row in rows.values(user_field, 'day').annotate(total=Count('*')):
+            deltas[(row[user_field], row['day'])][counter] += row['total']
+    return deltas
+
+
+def _apply(deltas, batch_size=1000):
+    existing = {
+        (row.user_id, row.day): row
+        for row in DailyEngagement.objects.select_for_update().filter(
+            user_id__in={user_id for user_id, _ in deltas}, day__in={day for _, day in deltas}
+        )
+    }
+    created, updated = [], []
+    for (user_id, day), counts in deltas.items():
+        row = existing.get((user_id, day))
+        if row is None:
+            row = DailyEngagement(user_id=user_id, day=day)
+            created.append(row)
+        else:
+            updated.append(row)
+        for counter, total in counts.items():
+            setattr(row, counter, getattr(row, counter) + total)
+    DailyEngagement.objects.bulk_create(created, batch_size=batch_size)
+    DailyEngagement.objects.bulk_update(updated, COUNTERS, batch_size=batch_size)
+
+
+def rollup(chunk_size=None, now=None):
+    """Учесть в DailyEngagement строки источников, добавленные после водяной метки.
+
+    Каждая пачка из chunk_size строк прибавляется к агрегатам и сдвигает
+    метку источника в одной транзакции, поэтому повторный или прерванный
+    запуск не посчитает строки дважды. Конкурентные транзакции фиксируются
+    не в порядке id: строка с меньшим id может стать видна уже после
+    строки с большим. Поэтому метка сдвигается только по строкам старше
+    ENGAGEMENT_ROLLUP_LAG секунд - к этому времени транзакции, получившие
+    меньшие id, уже завершились. Возвращает {источник: учтено строк}.
+    """
+    chunk_size = chunk_size or settings.ENGAGEMENT_ROLLUP_CHUNK
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.ENGAGEMENT_ROLLUP_LAG)
+    processed = {}
+    for source, (model, time_field, _, _) in SOURCES.items():
+        processed[source] = 0
+        while True:
+            with transaction.atomic():
+                watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(source=source)
+                pending = model.objects.filter(pk__gt=watermark.last_id, **{f'{time_field}__lt': cutoff})\
+                              .order_by('pk')
+                chunk_end = list(pending.values_list('pk', flat=True)[chunk_size - 1:chunk_size])
+                last_id = chunk_end[0] if chunk_end else pending.aggregate(last=Max('pk'))['last']
+                if last_id is None:
+                    break
+                _apply(_deltas(source, watermark.last_id, last_id))
+                processed[source] += pending.filter(pk__lte=last_id).count()
+                watermark.last_id = last_id
+                watermark.save()
+    return processed
+
+
+def parse_days(value):
+    """Длина окна статистики в днях в пределах ENGAGEMENT_STATS_MAX_DAYS; None - некорректная"""
+    if value is None:
+        return settings.ENGAGEMENT_STATS_DAYS
+    try:
+        return max(1, min(int(value), settings.ENGAGEMENT_STATS_MAX_DAYS))
+    except ValueError:
+        return None
+
+
+def _today():
+    now = timezone.now()
+    return timezone.localdate(now) if timezone.is_aware(now) else now.date()
+
+
+def engagement_stats(user, days):
+    """Статистика за последние days дней одним чтением диапазона индекса (user, day)"""
+    end = _today()
+    start = end - timedelta(days=days - 1)
+    daily = list(
+        DailyEngagement.objects.filter(user=user, day__gte=start, day__lte=end)
+                               .order_by('day').values('day', *COUNTERS)
+    )
+    return {
+        'from': start,
+        'to': end,
+        'totals': {counter: sum(row[counter] for row in daily) for counter in COUNTERS},
+        'daily': daily,
+    }
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+@dataclass(frozen=True)
+class Event:
+    id: str
+    type: str
+    data: dict
+
+    def encode(self):
+        """Событие в формате text/event-stream"""
+        payload = json.dumps(self.data, ensure_ascii=False, separators=(',', ':'))
+        return f'id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n'
+
+
+# Последний id клиента старше сохраненной истории: часть событий потеряна,
+# клиент должен перечитать matches/ и date-invitations/
+RESYNC = 'resync'
+
+
+class Broker:
+    """Интерфейс брокера событий пользователей.
+
+    publish вызывается из синхронного кода, subscribe - асинхронный
+    генератор событий пользователя, начиная после last_event_id. Раз в
+    heartbeat секунд без событий генератор отдает None.
+    """
+
+    def publish(self, user_id, event_type, data):
+        raise NotImplementedError
+
+    def subscribe(self, user_id, last_event_id=None, heartbeat=None):
+        raise NotImplementedError
+
+
+class InMemoryBroker(Broker):
+    """Брокер в памяти процесса: для разработки и одного ASGI-процесса.
+
+    Для каждого пользователя хранятся последние history событий не старше
+    ttl секунд, чтобы переподключившийся клиент получил пропущенное по
+    Last-Event-ID. id событий - микросекунды времени публикации, поэтому
+    они растут и после перезапуска процесса.
+    """
+
+    def __init__(self, history=100, ttl=3600):
+        self.history_size = history
+        self.ttl = ttl
+        self.history = {}
+        # id последнего вытесненного из истории события пользователя
+        self.evicted = {}
+        # (id, пользователь) событий истории в порядке публикации: по ним истекает ttl
+        self.timeline = deque()
+        # id последнего события, удаленного из истории по ttl
+        self.expired = 0
+        self.subscribers = defaultdict(set)
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def publish(self, user_id, event_type, data):
+        with self.lock:
+            now = time.time_ns() // 1000
+            self._expire(now - self.ttl * 1000000)
+            self.last_id = max(self.last_id + 1, now)
+            event = Event(str(self.last_id), event_type, data)
+            history = self.history.setdefault(user_id, deque())
+            history.append(event)
+            self.timeline.append((self.last_id, user_id))
+            if len(history) > self.history_size:
+                self.evicted[user_id] = int(history.popleft().id)
+            subscribers = list(self.subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+        return event
+
+    def _expire(self, before):
+        """Удалить из истории события с id меньше before; пустые истории - целиком"""
+        while self.timeline and self.timeline[0][0] < before:
+            event_id, user_id = self.timeline.popleft()
+            self.expired = event_id
+            history = self.history[user_id]
+            if history and int(history[0].id) == event_id:
+                history.popleft()
+            if not history:
+                del self.history[user_id]
+                self.evicted.pop(user_id, None)
+
+    def _missed(self, user_id, last_event_id):
+        try:
+            last_event_id = int(last_event_id)
+        except (TypeError, ValueError):
+            return []
+        missed = [event for event in self.history.get(user_id, ()) if int(event.id) > last_event_id]
+        if last_event_id < max(self.evicted.get(user_id, 0), self.expired):
+            missed.insert(0, Event(str(last_event_id), RESYNC, {}))
+        return missed
+
+    async def subscribe(self, user_id, last_event_id=None, heartbeat=None):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self.lock:
+            missed = self._missed(user_id, last_event_id)
+            self.subscribers[user_id].add(subscriber)
+        try:
+            for event in missed:
+                yield event
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber[1].get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self.lock:
+                self.subscribers[user_id].discard(subscriber)
+                if not self.subscribers[user_id]:
+                    del self.subscribers[user_id]
+
+
+class RedisBroker(Broker):
+    """Брокер на Redis Streams для нескольких процессов и узлов.
+
+    У каждого пользователя свой поток events:<id> длиной до history
+    записей, который удаляется через ttl секунд после последнего события;
+    id событий - id записей потока, по ним и возобновляется чтение.
+    """
+
+    def __init__(self, url=None, history=100, ttl=3600):
+        import redis
+        import redis.asyncio
+
+        url = url or settings.EVENTS['REDIS_URL']
+        self.client = redis.Redis.from_url(url)
+        self.async_client = redis.asyncio.Redis.from_url(url)
+        self.history_size = history
+        self.ttl = ttl
+
+    def publish(self, user_id, event_type, data):
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        key = f'events:{user_id}'
+        pipeline = self.client.pipeline()
+        pipeline.xadd(key, {'type': event_type, 'data': payload}, maxlen=self.history_size, approximate=True)
+        pipeline.expire(key, self.ttl)
+        event_id, _ = pipeline.execute()
+        return Event(event_id.decode(), event_type, data)
+
+    async def subscribe(self, user_id, last_event_id=None, heartbeat=None):
+        key = f'events:{user_id}'
+        if last_event_id:
+            first = await self.async_client.xrange(key, count=1)
+            # Пустой поток при известном клиенту id - история истекла по ttl
+            if not first or self._older(last_event_id, first[0][0].decode()):
+                yield Event(last_event_id, RESYNC, {})
+        else:
+            last_event_id = '$'
+        block = int(heartbeat * 1000) if heartbeat else 0
+        while True:
+            response = await self.async_client.xread({key: last_event_id}, block=block)
+            if not response:
+                yield None
+                continue
+            for entry_id, fields in response[0][1]:
+                last_event_id = entry_id.decode()
+                yield Event(last_event_id, fields[b'type'].decode(), json.loads(fields[b'data']))
+
+    @staticmethod
+    def _older(event_id, other_id):
+        try:
+            return tuple(map(int, event_id.split('-'))) < tuple(map(int, other_id.split('-')))
+        except ValueError:
+            return True
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        options = settings.EVENTS
+        _broker = import_string(options['BROKER'])(history=options['HISTORY'], ttl=options['HISTORY_TTL'])
+    return _broker
+
+
+def publish(user_ids, event_type, data):
+    """Отправить событие пользователям после фиксации текущей транзакции"""
+    def send():
+        broker = get_broker()
+        for user_id in user_ids:
+            broker.publish(user_id, event_type, data)
+    transaction.on_commit(send)
+
+
+def publish_matches(matches):
+    for match in matches:
+        publish([match.user1_id, match.user2_id], 'match', {
+            'id': match.pk,
+            'user1': match.user1_id,
+            'user2': match.user2_id,
+            'created_at': match.created_at.isoformat(),
+        })
+
+
+def publish_invitation(invitation):
+    publish([invitation.from_user_id, invitation.to_user_id], 'invitation', {
+        'id': invitation.pk,
+        'match': invitation.match_id,
+        'from_user': invitation.from_user_id,
+        'to_user': invitation.to_user_id,
+        'status': invitation.status,
+    })
@@ -0,0 +1,111 @@
+import csv
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .models import DateInvitation, Match, User, UserInteraction, ViewHistory
+
+# Разделы выгрузки: модель, условие на строки пользователя, поля и порядок по индексу
+SECTIONS = {
+    'profile': (User, lambda user: Q(pk=user.pk), [
+        'id', 'email', 'username', 'first_name', 'last_name', 'gender', 'age', 'city', 'hobbies',
+        'status', 'privacy_settings', 'likes_count', 'date_joined'
+    ], ['pk']),
+    'view_history': (ViewHistory, lambda user: Q(viewer=user),
+                     ['id', 'viewed_user', 'viewed_at'], ['viewed_at', 'id']),
+    'swipes': (UserInteraction, lambda user: Q(from_user=user),
+               ['id', 'to_user', 'interaction_type', 'created_at'], ['created_at', 'id']),
+    'likes_received': (UserInteraction, lambda user: Q(to_user=user, interaction_type='like'),
+                       ['id', 'from_user', 'created_at'], ['created_at', 'id']),
+    'matches': (Match, lambda user: Q(participants__user=user),
+                ['id', 'user1', 'user2', 'created_at', 'is_active'], ['created_at', 'id']),
+    'date_invitations': (DateInvitation, lambda user: Q(match__participants__user=user), [
+        'id', 'match', 'from_user', 'to_user', 'message', 'proposed_date', 'status', 'created_at'
+    ], ['created_at', 'id']),
+}
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def parse_sections(value):
+    """Разделы из ?sections=a,b (по умолчанию все); None - есть неизвестный раздел"""
+    if not value:
+        return list(SECTIONS)
+    sections = list(dict.fromkeys(name.strip() for name in value.split(',')))
+    if any(name not in SECTIONS for name in sections):
+        return None
+    return sections
+
+
+def export_rows(user, sections, using=None, chunk_size=None):
+    """Пары (раздел, строка values()) по всем записям пользователя.
+
+    Строки читаются через iterator(chunk_size): на PostgreSQL это
+    серверный курсор, поэтому в памяти не больше одной пачки.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    for name in sections:
+        model, condition, fields, order = SECTIONS[name]
+        rows = model.objects.using(using).filter(condition(user)).order_by(*order).values(*fields)
+        for row in rows.iterator(chunk_size=chunk_size):
+            yield name, row
+
+
+def ndjson_lines(rows):
+    for name, row in rows:
+        yield json.dumps({'type': name, **row}, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+class _Echo:
+    """Псевдофайл для csv.writer: writerow возвращает готовую строку"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, sections):
+    """CSV со столбцом type и объединением полей выбранных разделов"""
+    columns = list(dict.fromkeys(field for name in sections for field in SECTIONS[name][2]))
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['type', *columns])
+    for name, row in rows:
+        values = [row.get(column) for column in columns]
+        yield writer.writerow([name, *(
+            '' if value is None else value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in values
+        )])
+
+
+def export_activity(user, sections, output, using=None, chunk_size=None):
+    """Выгрузка в формате output ('ndjson' или 'csv') кусками по chunk_size строк"""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    rows = export_rows(user, sections, using, chunk_size)
+    lines = ndjson_lines(rows) if output == 'ndjson' else csv_lines(rows, sections)
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+async def aiter_chunks(chunks):
+    """Асинхронный поток из синхронного: куски берутся по одному через sync_to_async.
+
+    Синхронный поток под ASGI Django собирает в список целиком; здесь в
+    памяти не больше одного куска, а ответ начинается с первого.
+    """
+    try:
+        while (chunk := await sync_to_async(next)(chunks, None)) is not None:
+            yield chunk
+    finally:
+        # Серверный курсор закрывается в том же потоке, где открывался
+        await sync_to_async(chunks.close)()
@@ -0,0 +1,36 @@
+import django_filters
+
+from .models import User
+
+
+class UserFilter(django_filters.FilterSet):
+    city = django_filters.CharFilter(method='filter_city')
+
+    class Meta:
+        model = User
+        fields = ['gender', 'city', 'status']
+
+    def filter_city(self, queryset, name, value):
+        return queryset.filter(city_key=User.normalize_city(value))
+
+
+def profile_filters(params):
+    """Фильтры кандидатов для колоды и случайного профиля из параметров запроса"""
+    filters = {}
+    gender = params.get('gender')
+    age_min = params.get('age_min')
+    age_max = params.get('age_max')
+    city = params.get('city')
+    status = params.get('status')
+    
+    if gender:
+        filters['gender'] = gender
+    if age_min:
+        filters['age__gte'] = age_min
+    if age_max:
+        filters['age__lte'] = age_max
+    if city:
+        filters['city_key'] = User.normalize_city(city)
+    if status:
+        filters['status'] = status
+    return filters
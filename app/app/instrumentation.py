@@ -0,0 +1,165 @@
+import json
+import logging
+import logging.handlers
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('app.requests')
+slow_logger = logging.getLogger('app.slow_requests')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler, который создает каталог файла при открытии, а не при импорте настроек"""
+
+    def _open(self):
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
+
+# Списки параметров разной длины (IN (%s, %s, ...)) приводятся к одной форме
+_PARAMS_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+class RequestMetrics:
+    """Счетчики одного запроса: SQL, время БД и сериализации"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.shapes = Counter()
+
+    def wrap_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.shapes[_PARAMS_LIST.sub('%s...', sql)] += 1
+
+    def n_plus_one_suspects(self):
+        threshold = settings.INSTRUMENTATION['N_PLUS_ONE_THRESHOLD']
+        return {shape: count for shape, count in self.shapes.items() if count >= threshold}
+
+
+def _wrap_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.wrap_query(execute, sql, params, many, context)
+
+
+def install_wrapper(connection, **kwargs):
+    """Подключить учет запросов к соединению (один раз на объект соединения)"""
+    if _wrap_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _wrap_query)
+
+
+# Соединения у каждого потока свои, а async-представления ходят в БД через
+# sync_to_async в другом потоке. Поэтому обертка ставится на каждое
+# открываемое соединение, а метрики запроса доходят до нее через contextvar
+connection_created.connect(install_wrapper)
+
+
+class InstrumentedSerializerMixin:
+    """Учитывает время сериализации верхнего уровня в метриках запроса.
+
+    Вложенные сериализаторы не суммируются повторно: считается только
+    самый внешний вызов to_representation.
+    """
+
+    def to_representation(self, instance):
+        metrics = _current.get()
+        if metrics is None:
+            return super().to_representation(instance)
+        metrics.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer_depth -= 1
+            if not metrics.serializer_depth:
+                metrics.serializer_time += time.perf_counter() - started
+
+
+class RequestInstrumentationMiddleware:
+    """Число SQL-запросов, время БД, сериализации и общее время запроса.
+
+    Добавляет заголовок Server-Timing, пишет структурированную строку лога,
+    отмечает повторяющиеся формы запросов как подозрение на N+1 и
+    отправляет медленные запросы в отдельный лог. Работает и в синхронной,
+    и в асинхронной цепочке, чтобы не переводить async-представления в поток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # Соединения потока могли открыться до импорта модуля
+        for connection in connections.all():
+            install_wrapper(connection)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, metrics, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, metrics, time.perf_counter() - started)
+
+    def report(self, request, response, metrics, total):
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+            f'ser;dur={metrics.serializer_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+        suspects = metrics.n_plus_one_suspects()
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'serializer_ms': round(metrics.serializer_time * 1000, 1),
+            'queries': metrics.queries,
+        }
+        if suspects:
+            record['n_plus_one'] = suspects
+        # Импорт здесь: buffers тянет модели, а модуль загружается вместе с сериализаторами
+        from .buffers import buffer_stats
+        view_buffer = buffer_stats()
+        if view_buffer is not None:
+            record['view_buffer'] = view_buffer
+        line = json.dumps(record, ensure_ascii=False)
+        logger.log(logging.WARNING if suspects else logging.INFO, line)
+        if total * 1000 >= settings.INSTRUMENTATION['SLOW_REQUEST_MS']:
+            slow_logger.warning(line)
+        return response
@@ -0,0 +1,76 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.contrib.auth import get_user_model
+from app import compatibility
+from app.deck import candidates_queryset
+from app.management.commands.generate_mock_data import HOBBIES
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк ранжирования колоды по совместимости увлечений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000, help='Количество пользователей')
+        parser.add_argument('--top', type=int, default=settings.DECK_QUEUE_SIZE, help='Размер топа')
+        parser.add_argument('--samples', type=int, default=50, help='Количество замеров')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Размер пачки при вставке')
+
+    def handle(self, *args, **options):
+        # Увлечения распределены как в generate_mock_data; данные откатываются в конце
+        with transaction.atomic():
+            self._create_users(options['users'], options['batch_size'])
+            started = time.perf_counter()
+            index = compatibility.build_index()
+            self.stdout.write(f'Индекс на {options["users"]} пользователей собран за {time.perf_counter() - started:.1f} с')
+            try:
+                self._measure(index, options['top'], options['samples'])
+            finally:
+                compatibility.reset_index()
+                transaction.set_rollback(True)
+
+    def _create_users(self, size, batch_size):
+        rng = random.Random(0)
+        for start in range(0, size, batch_size):
+            User.objects.bulk_create([
+                User(
+                    email=f'bench{i}@bench.local',
+                    username=f'bench{i}',
+                    password='!',
+                    gender='MF'[i % 2],
+                    age=18 + i % 47,
+                    hobbies=', '.join(rng.sample(HOBBIES, rng.randint(1, 5))),
+                    status='looking',
+                )
+                for i in range(start, min(size, start + batch_size))
+            ], batch_size=batch_size)
+
+    def _measure(self, index, top, samples):
+        users = list(User.objects.order_by('?')[:samples])
+        # Только индекс: первая пачка ranked_batches, как ее берет rank_candidates
+        self._report('индекс', [
+            self._time(lambda: next(index.ranked_batches(user.pk, max(top, compatibility._FILTER_BATCH)), None))
+            for user in users
+        ])
+        # Путь колоды целиком: индекс и проверка фильтра queryset пачками id
+        self._report('rank_candidates', [
+            self._time(lambda: compatibility.rank_candidates(user, candidates_queryset(user, {}), top))
+            for user in users
+        ])
+
+    def _time(self, call):
+        started = time.perf_counter()
+        call()
+        return (time.perf_counter() - started) * 1000
+
+    def _report(self, name, timings):
+        timings.sort()
+        p50 = statistics.median(timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(f'{name}: p50={p50:.2f} мс, p99={p99:.2f} мс')
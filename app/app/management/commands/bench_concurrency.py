@@ -0,0 +1,83 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Пропускная способность эндпоинтов под конкурентными соединениями (WSGI против ASGI)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True, metavar='ИМЯ=URL',
+                            help='Цель замера, например wsgi=http://127.0.0.1:8000/api/users/deck/')
+        parser.add_argument('--token', required=True, help='JWT access-токен для заголовка Authorization')
+        parser.add_argument('--connections', type=int, default=64, help='Одновременных соединений')
+        parser.add_argument('--duration', type=float, default=10, help='Длительность замера, секунд')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, sep, url = target.partition('=')
+            if not sep:
+                raise CommandError(f'Ожидается ИМЯ=URL: {target}')
+            targets.append((name, url))
+
+        for name, url in targets:
+            result = self._measure(url, options['token'], options['connections'], options['duration'])
+            self.stdout.write(
+                f"{name:<10} {result['rps']:8.1f} запр/с  p50={result['p50_ms']:7.2f} мс  "
+                f"p99={result['p99_ms']:7.2f} мс  ошибок={result['errors']}"
+            )
+
+    def _measure(self, url, token, connections, duration):
+        parts = urlsplit(url)
+        connection_class = HTTPSConnection if parts.scheme == 'https' else HTTPConnection
+        path = parts.path + (f'?{parts.query}' if parts.query else '')
+        headers = {'Authorization': f'Bearer {token}'}
+        deadline = time.perf_counter() + duration
+        lock = threading.Lock()
+        timings = []
+        errors = 0
+
+        def worker():
+            nonlocal errors
+            # Одно keep-alive соединение на поток, как у клиента с пулом соединений
+            connection = connection_class(parts.netloc, timeout=30)
+            local_timings, local_errors = [], 0
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status >= 400:
+                        local_errors += 1
+                except OSError:
+                    local_errors += 1
+                    connection.close()
+                    continue
+                local_timings.append((time.perf_counter() - started) * 1000)
+            connection.close()
+            with lock:
+                timings.extend(local_timings)
+                errors += local_errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            for _ in range(connections):
+                executor.submit(worker)
+        elapsed = time.perf_counter() - started
+
+        if not timings:
+            raise CommandError(f'{url}: ни одного успешного ответа')
+        timings.sort()
+        return {
+            'rps': len(timings) / elapsed,
+            'p50_ms': statistics.median(timings),
+            'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+            'errors': errors,
+        }
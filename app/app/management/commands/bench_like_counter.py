@@ -0,0 +1,76 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import F
+from app.counters import increment_likes, flush_likes
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк конкурентных лайков одному популярному пользователю'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Количество параллельных потоков')
+        parser.add_argument('--likes', type=int, default=500, help='Лайков на поток')
+
+    def handle(self, *args, **options):
+        hot_user = User.objects.create(
+            email='hot-user@bench.local',
+            username='hot-user-bench',
+            password='!',
+            first_name='Hot',
+            last_name='User',
+            gender='F',
+            age=25,
+            city='Москва'
+        )
+        try:
+            strategies = [
+                ('строка User (F-выражение)', self._row_update),
+                ('шардированный счетчик', self._sharded_update),
+            ]
+            for name, strategy in strategies:
+                User.objects.filter(pk=hot_user.pk).update(likes_count=0)
+                rate = self._run(strategy, hot_user.pk, options['threads'], options['likes'])
+                while flush_likes():
+                    pass
+                hot_user.refresh_from_db()
+                self.stdout.write(
+                    f'{name}: {rate:.0f} лайков/с, итоговый счетчик {hot_user.likes_count} '
+                    f'из {options["threads"] * options["likes"]}'
+                )
+        finally:
+            hot_user.delete()
+
+    def _row_update(self, user_id):
+        User.objects.filter(pk=user_id).update(likes_count=F('likes_count') + 1)
+
+    def _sharded_update(self, user_id):
+        increment_likes([user_id])
+
+    def _run(self, strategy, user_id, threads, likes):
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(likes):
+                    strategy(user_id)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            self.stderr.write(f'Ошибок в потоках: {len(errors)} (первая: {errors[0]})')
+        return threads * likes / elapsed
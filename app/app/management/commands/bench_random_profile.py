@@ -0,0 +1,75 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.contrib.auth import get_user_model
+from app.filters import profile_filters
+from app.sampling import sample_object
+
+User = get_user_model()
+
+CITIES = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань']
+# Каждый RARE_EVERY-й пользователь из редкого города: пробы по нему промахиваются
+RARE_CITY = 'Калининград'
+RARE_EVERY = 2000
+
+# Параметры запроса random_profile; город - в другом регистре, как его присылают клиенты
+SCENARIOS = {
+    'фильтр': {'gender': 'F', 'age_min': '25', 'age_max': '35', 'city': 'казань'},
+    'редкий город': {'city': 'КАЛИНИНГРАД'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк выбора случайного профиля на таблицах разного размера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                            help='Размеры таблицы пользователей')
+        parser.add_argument('--samples', type=int, default=200, help='Количество выборок на размер')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Размер пачки при вставке')
+
+    def handle(self, *args, **options):
+        # Все данные вставляются внутри транзакции и откатываются в конце
+        with transaction.atomic():
+            created = 0
+            for size in sorted(options['sizes']):
+                created = self._grow_to(created, size, options['batch_size'])
+                self._measure(size, options['samples'])
+            transaction.set_rollback(True)
+
+    def _grow_to(self, created, size, batch_size):
+        while created < size:
+            batch = []
+            for i in range(created, min(size, created + batch_size)):
+                city = RARE_CITY if i % RARE_EVERY == 0 else CITIES[i % len(CITIES)]
+                batch.append(User(
+                    email=f'bench{i}@bench.local',
+                    username=f'bench{i}',
+                    password='!',
+                    first_name='Bench',
+                    last_name=str(i),
+                    gender='MF'[i % 2],
+                    age=18 + i % 47,
+                    city=city,
+                    city_key=User.normalize_city(city),
+                    status='looking',
+                ))
+            User.objects.bulk_create(batch, batch_size=batch_size)
+            created += len(batch)
+        return created
+
+    def _measure(self, size, samples):
+        for name, params in SCENARIOS.items():
+            # Тот же путь, что у random_profile: фильтры запроса (city_key) и sample_object
+            queryset = User.objects.filter(**profile_filters(params)).prefetch_related('photos')
+            timings = []
+            for _ in range(samples):
+                started = time.perf_counter()
+                sample_object(queryset)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p50 = statistics.median(timings)
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            self.stdout.write(f'{size:>9} пользователей, {name}: p50={p50:.2f} мс, p99={p99:.2f} мс')
@@ -0,0 +1,147 @@
+import json
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework.test import APIClient
+from app.models import User
+
+# Бюджеты на один запрос: число SQL-запросов и p99 в миллисекундах
+DEFAULT_BUDGETS = {
+    'users-list': {'queries': 3, 'p99_ms': 250},
+    'random-profile': {'queries': 5, 'p99_ms': 100},
+    'users-deck': {'queries': 7, 'p99_ms': 250},
+    'interactions': {'queries': 2, 'p99_ms': 250},
+    'matches': {'queries': 3, 'p99_ms': 250},
+    'view-history': {'queries': 2, 'p99_ms': 250},
+    'like-history': {'queries': 2, 'p99_ms': 250},
+    'date-invitations': {'queries': 3, 'p99_ms': 250},
+}
+
+ENDPOINTS = {
+    'users-list': ('user-list', {}),
+    'random-profile': ('user-random-profile', {}),
+    'users-deck': ('user-deck', {}),
+    'interactions': ('interaction-list', {}),
+    'matches': ('match-list', {}),
+    'view-history': ('view-history-list', {}),
+    'like-history': ('like-history-list', {}),
+    'date-invitations': ('date-invitation-list', {}),
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+@contextmanager
+def isolated_database():
+    """Отдельная тестовая база на время замеров, удаляется после них"""
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк задержек и числа SQL-запросов API на сгенерированных данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Количество пользователей в наборе')
+        parser.add_argument('--interactions', type=int, default=5000, help='Количество взаимодействий в наборе')
+        parser.add_argument('--iterations', type=int, default=50, help='Запросов на эндпоинт')
+        parser.add_argument('--output', default='bench_results.json', help='Файл с результатами в JSON')
+        parser.add_argument('--budgets', help='JSON-файл с бюджетами вместо встроенных')
+        parser.add_argument('--baseline', help='Результаты прошлого запуска для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Допустимый рост p99 относительно baseline (доля)')
+
+    def handle(self, *args, **options):
+        budgets = DEFAULT_BUDGETS
+        if options['budgets']:
+            with open(options['budgets']) as f:
+                budgets = json.load(f)
+
+        with isolated_database():
+            call_command('generate_mock_data', users=options['users'],
+                         interactions=options['interactions'], stdout=self.stdout)
+            results = self._measure(options['iterations'])
+
+        report = {
+            'dataset': {'users': options['users'], 'interactions': options['interactions']},
+            'iterations': options['iterations'],
+            'endpoints': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['endpoints']
+
+        failures = self._check(results, budgets, baseline, options['tolerance'])
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<18} p50={result['p50_ms']:7.2f} мс  p99={result['p99_ms']:7.2f} мс  "
+                f"запросов={result['queries']}"
+            )
+        if failures:
+            raise CommandError('Регрессия производительности:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS(f'Бюджеты соблюдены, результаты в {options["output"]}'))
+
+    def _measure(self, iterations):
+        # Самый активный пользователь - худший случай для лент истории
+        user = User.objects.annotate(activity=Count('sent_interactions')).order_by('-activity').first()
+        if user is None:
+            raise CommandError('Набор данных пуст')
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        results = {}
+        for name, (url_name, params) in ENDPOINTS.items():
+            url = reverse(url_name)
+            client.get(url, params)
+            timings = []
+            queries = 0
+            for _ in range(iterations):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = client.get(url, params)
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries = max(queries, len(captured))
+                if response.status_code >= 500:
+                    raise CommandError(f'{name}: HTTP {response.status_code}')
+            results[name] = {
+                'p50_ms': round(statistics.median(timings), 3),
+                'p99_ms': round(percentile(timings, 0.99), 3),
+                'queries': queries,
+            }
+        return results
+
+    def _check(self, results, budgets, baseline, tolerance):
+        failures = []
+        for name, result in results.items():
+            budget = budgets.get(name)
+            if budget:
+                if result['queries'] > budget['queries']:
+                    failures.append(f"{name}: {result['queries']} запросов при бюджете {budget['queries']}")
+                if result['p99_ms'] > budget['p99_ms']:
+                    failures.append(f"{name}: p99 {result['p99_ms']} мс при бюджете {budget['p99_ms']} мс")
+            previous = (baseline or {}).get(name)
+            if previous:
+                if result['queries'] > previous['queries']:
+                    failures.append(f"{name}: запросов стало {result['queries']}, было {previous['queries']}")
+                if result['p99_ms'] > previous['p99_ms'] * (1 + tolerance):
+                    failures.append(f"{name}: p99 вырос с {previous['p99_ms']} до {result['p99_ms']} мс")
+        return failures
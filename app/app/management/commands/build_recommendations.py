@@ -0,0 +1,60 @@
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+from app.models import RollupWatermark, UserInteraction
+from app.recommendations import Recommender, store_recommendations
+
+WATERMARK = 'recommendations'
+
+
+class Command(BaseCommand):
+    help = 'Пересчет рекомендаций по истории лайков (коллаборативная фильтрация item-item)'
+
+    def add_arguments(self, parser):
+        options = settings.RECOMMENDER
+        parser.add_argument('--full', action='store_true',
+                            help='Пересчитать всех пользователей, а не только свайпнувших после прошлого запуска')
+        parser.add_argument('--top', type=int, default=options['TOP_K'], help='Рекомендаций на пользователя')
+        parser.add_argument('--neighbors', type=int, default=options['NEIGHBORS'],
+                            help='Похожих профилей на каждый лайкнутый')
+        parser.add_argument('--max-item-likers', type=int, default=options['MAX_ITEM_LIKERS'],
+                            help='Не искать похожие для профилей с большим числом лайков')
+        parser.add_argument('--chunk-size', type=int, default=options['CHUNK_SIZE'],
+                            help='Пользователей в одной пачке расчета')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        watermark, _ = RollupWatermark.objects.get_or_create(source=WATERMARK)
+
+        # Свежие строки ждут следующего запуска: транзакция с меньшим id могла еще не зафиксироваться
+        cutoff = timezone.now() - timedelta(seconds=settings.RECOMMENDER['LAG'])
+        new = UserInteraction.objects.filter(created_at__lt=cutoff)
+        if not options['full']:
+            new = new.filter(pk__gt=watermark.last_id)
+        last_id = new.aggregate(last=Max('pk'))['last']
+        if last_id is None:
+            self.stdout.write('Новых взаимодействий нет')
+            return
+
+        # Пересчитываются только пользователи с новыми свайпами; их id читаются курсором
+        users = new.filter(pk__lte=last_id).order_by('from_user_id')\
+                   .values_list('from_user_id', flat=True).distinct()\
+                   .iterator(chunk_size=options['chunk_size'])
+        recommender = Recommender(options['neighbors'], options['max_item_likers'])
+        total = stored = 0
+        while chunk := list(islice(users, options['chunk_size'])):
+            result = recommender.recommend(chunk, options['top'])
+            store_recommendations(chunk, *result)
+            total += len(chunk)
+            stored += len(result[0])
+
+        watermark.last_id = max(watermark.last_id, last_id)
+        watermark.save()
+        self.stdout.write(
+            f'Пользователей: {total}, рекомендаций: {stored}, {time.perf_counter() - started:.1f} с'
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from app.export import FORMATS, export_activity, parse_sections
+from app.models import User
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка всех записей пользователя в NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help='id или email пользователя')
+        parser.add_argument('--format', choices=list(FORMATS), default='ndjson')
+        parser.add_argument('--sections', default='', help='Разделы через запятую (по умолчанию все)')
+        parser.add_argument('--output', '-o', default='-', help='Файл выгрузки (по умолчанию stdout)')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Строк на одну выборку курсора')
+
+    def handle(self, *args, **options):
+        lookup = {'pk': options['user']} if options['user'].isdigit() else {'email': options['user']}
+        try:
+            user = User.objects.get(**lookup)
+        except User.DoesNotExist:
+            raise CommandError('Пользователь не найден')
+        sections = parse_sections(options['sections'])
+        if sections is None:
+            raise CommandError('Неизвестный раздел выгрузки')
+
+        chunks = export_activity(user, sections, options['format'], chunk_size=options['chunk_size'])
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(f'Выгрузка записана в {options["output"]}')
@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app.counters import flush_likes
+
+
+class Command(BaseCommand):
+    help = 'Перенос накопленных в шардах лайков в User.likes_count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять сброс каждые N секунд (0 - выполнить один раз)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Шардов за один проход')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or settings.LIKE_COUNTER_FLUSH_BATCH
+        while True:
+            flushed = batch_size
+            total = 0
+            # Под постоянной нагрузкой шарды не опустеют, поэтому проход
+            # заканчивается на первой неполной пачке
+            while flushed == batch_size:
+                flushed = flush_likes(batch_size)
+                total += flushed
+            if total:
+                self.stdout.write(f'Сброшено шардов: {total}')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
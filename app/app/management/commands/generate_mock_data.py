@@ -1,76 +1,327 @@
-from django.core.management.base import BaseCommand
-from django.contrib.auth import get_user_model
-from app.models import UserPhoto, UserInteraction, ViewHistory, Match, DateInvitation, UserLikeHistory
-from faker import Faker
 import random
+import time
+from contextlib import contextmanager
 from datetime import timedelta
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
+from app.models import (
+    UserPhoto, UserInteraction, ViewHistory, Match, MatchParticipant, DateInvitation, UserLikeHistory
+)
+from faker import Faker
 
 User = get_user_model()
 
+CITIES = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань']
+HOBBIES = [
+    'путешествия', 'фотография', 'музыка', 'спорт', 'книги', 'кино', 'программирование',
+    'видеоигры', 'искусство', 'театр', 'танцы', 'кулинария', 'вино', 'рестораны', 'йога',
+]
+STATUSES = (['looking', 'busy', 'complicated'], [60, 25, 15])
+PRIVACY = (['public', 'friends_only', 'private'], [70, 20, 10])
+PHOTOS_PER_USER = ([0, 1, 2, 3, 4, 5], [10, 25, 25, 20, 12, 8])
+INVITATION_STATUSES = (['pending', 'accepted', 'rejected', 'cancelled'], [40, 30, 20, 10])
+
+HISTORY_DAYS = 30
+LIKE_RATE = 0.4
+# Доля лайков, на которые отвечают встречным свайпом
+REPLY_RATE = 0.3
+# Просмотров без свайпа на один свайп
+EXTRA_VIEW_RATE = 0.5
+# Чем больше степень, тем сильнее внимание стягивается к популярным профилям
+POPULARITY_SKEW = 2.5
+INACTIVE_MATCH_RATE = 0.1
+INVITATION_RATE = 0.3
+
+
+@contextmanager
+def keep_timestamps(*models):
+    """Временно отключить auto_now_add, чтобы сохранить сгенерированное время"""
+    fields = [field for model in models for field in model._meta.fields if getattr(field, 'auto_now_add', False)]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _rng(ctx, phase, start):
+    # Отдельный генератор на каждую пачку: результат не зависит от числа процессов
+    return random.Random(f'{ctx["seed"]}:{phase}:{start}')
+
+
+def _choice(rng, options):
+    values, weights = options
+    return rng.choices(values, weights)[0]
+
+
+def _popular(rng, n):
+    return int(n * rng.random() ** POPULARITY_SKEW)
+
+
+def _ago(rng, ctx, days=HISTORY_DAYS):
+    return ctx['now'] - timedelta(seconds=rng.randrange(days * 86400))
+
+
+def create_users(start, stop, ctx):
+    """Пользователи с id base+start .. base+stop-1 и их фотографии"""
+    rng = _rng(ctx, 'users', start)
+    users, photos = [], []
+    for i in range(start, stop):
+        pk = ctx['base'] + i
+        gender = rng.choice('MF')
+        names = ctx['names'][gender]
+        city = rng.choice(CITIES)
+        joined = _ago(rng, ctx, days=365)
+        users.append(User(
+            pk=pk,
+            email=f'mock{pk}@mock.local',
+            username=f'mock{pk}',
+            password=ctx['password'],
+            first_name=rng.choice(names['first']),
+            last_name=rng.choice(names['last']),
+            gender=gender,
+            age=int(rng.triangular(18, 65, 27)),
+            city=city,
+            city_key=User.normalize_city(city),
+            hobbies=', '.join(rng.sample(HOBBIES, rng.randint(1, 5))),
+            status=_choice(rng, STATUSES),
+            privacy_settings=_choice(rng, PRIVACY),
+            date_joined=joined,
+        ))
+        for n in range(_choice(rng, PHOTOS_PER_USER)):
+            name = f'user_photos/mock/{rng.randrange(500)}.jpg'
+            photos.append(UserPhoto(
+                user_id=pk,
+                photo=name,
+                thumbnail=name,
+                medium=name,
+                processing_status='ready',
+                is_main=n == 0,
+                uploaded_at=joined + timedelta(minutes=n),
+            ))
+    with keep_timestamps(UserPhoto):
+        User.objects.bulk_create(users, batch_size=ctx['batch_size'])
+        UserPhoto.objects.bulk_create(photos, batch_size=ctx['batch_size'])
+    return len(users)
+
+
+def create_interactions(start, stop, ctx):
+    """Свайпы пользователей пачки вместе с просмотрами и историей лайков.
+
+    Число свайпов пачки пропорционально ее размеру; цели выбираются со
+    смещением к популярным профилям, на часть лайков приходит ответный свайп.
+    """
+    rng = _rng(ctx, 'interactions', start)
+    n, base = ctx['users'], ctx['base']
+    count = ctx['interactions'] * stop // n - ctx['interactions'] * start // n
+    viewed_at = {}
+    interactions, likes, views = [], [], []
+
+    def swipe(i, j, kind, created_at):
+        if (base + i, base + j) in viewed_at:
+            return
+        interactions.append(UserInteraction(
+            from_user_id=base + i, to_user_id=base + j, interaction_type=kind, created_at=created_at
+        ))
+        viewed_at[(base + i, base + j)] = created_at - timedelta(seconds=rng.randint(2, 60))
+
+    for _ in range(count):
+        i = start + rng.randrange(stop - start)
+        j = _popular(rng, n)
+        if j == i:
+            j = (j + 1) % n
+        created_at = _ago(rng, ctx)
+        kind = 'like' if rng.random() < LIKE_RATE else 'dislike'
+        swipe(i, j, kind, created_at)
+        if kind == 'like' and rng.random() < REPLY_RATE:
+            answered_at = min(ctx['now'], created_at + timedelta(seconds=rng.randrange(1, 3 * 86400)))
+            swipe(j, i, 'like' if rng.random() < 0.5 else 'dislike', answered_at)
+        if rng.random() < EXTRA_VIEW_RATE:
+            views.append(ViewHistory(
+                viewer_id=base + i, viewed_user_id=base + _popular(rng, n), viewed_at=_ago(rng, ctx)
+            ))
+
+    with keep_timestamps(UserInteraction, UserLikeHistory):
+        # Ответный свайп мог уже прийти из другой пачки
+        UserInteraction.objects.bulk_create(interactions, batch_size=ctx['batch_size'], ignore_conflicts=True)
+        inserted = _inserted(interactions, base + start, base + stop, ctx['batch_size'])
+        for interaction in inserted:
+            key = (interaction.from_user_id, interaction.to_user_id)
+            views.append(ViewHistory(viewer_id=key[0], viewed_user_id=key[1], viewed_at=viewed_at[key]))
+            if interaction.interaction_type == 'like' and settings.LIKE_HISTORY_WRITES:
+                likes.append(UserLikeHistory(
+                    user_id=key[1], liked_by_id=key[0], created_at=interaction.created_at
+                ))
+        UserLikeHistory.objects.bulk_create(likes, batch_size=ctx['batch_size'])
+        ViewHistory.objects.bulk_create(views, batch_size=ctx['batch_size'])
+    return len(inserted)
+
+
+def _inserted(interactions, lo, hi, chunk_size):
+    """Свайпы пачки, которые действительно записаны, а не отброшены как дубликат.
+
+    Все свайпы пачки идут от ее пользователей [lo, hi) или к ним (ответные),
+    поэтому сверка читает только такие строки. Строка пары, записанная
+    другой пачкой, отличается типом или временем свайпа.
+    """
+    wanted = {(x.from_user_id, x.to_user_id): x for x in interactions}
+    stored = UserInteraction.objects.filter(
+        Q(from_user_id__gte=lo, from_user_id__lt=hi) | Q(to_user_id__gte=lo, to_user_id__lt=hi)
+    ).values_list('from_user_id', 'to_user_id', 'interaction_type', 'created_at')
+    inserted = []
+    for from_user_id, to_user_id, interaction_type, created_at in stored.iterator(chunk_size=chunk_size):
+        interaction = wanted.get((from_user_id, to_user_id))
+        if interaction is not None and (interaction.interaction_type, interaction.created_at) == \
+                (interaction_type, created_at):
+            inserted.append(interaction)
+    return inserted
+
+
+def create_matches(start, stop, ctx):
+    """Матчи по взаимным лайкам пользователей пачки и приглашения на свидания"""
+    rng = _rng(ctx, 'matches', start)
+    answer = UserInteraction.objects.filter(
+        from_user=OuterRef('to_user'), to_user=OuterRef('from_user'), interaction_type='like'
+    )
+    pairs = UserInteraction.objects.filter(
+        from_user_id__gte=ctx['base'] + start,
+        from_user_id__lt=ctx['base'] + stop,
+        to_user_id__gt=F('from_user_id'),
+        interaction_type='like',
+    ).annotate(answered_at=Subquery(answer.values('created_at')[:1]))\
+        .filter(answered_at__isnull=False)\
+        .values_list('from_user_id', 'to_user_id', 'created_at', 'answered_at')
+
+    matches = []
+    for user_id, other_user_id, created_at, answered_at in pairs.iterator(chunk_size=ctx['batch_size']):
+        match = Match.between(user_id, other_user_id)
+        match.created_at = max(created_at, answered_at)
+        match.is_active = rng.random() >= INACTIVE_MATCH_RATE
+        matches.append(match)
+
+    with keep_timestamps(Match, DateInvitation):
+        Match.objects.bulk_create(matches, batch_size=ctx['batch_size'])
+        MatchParticipant.objects.bulk_create(MatchParticipant.for_matches(matches), batch_size=ctx['batch_size'])
+        invitations = []
+        for match in matches:
+            if rng.random() >= INVITATION_RATE:
+                continue
+            from_user_id, to_user_id = rng.sample([match.user1_id, match.user2_id], 2)
+            created_at = min(ctx['now'], match.created_at + timedelta(hours=rng.randint(1, 72)))
+            invitations.append(DateInvitation(
+                match_id=match.pk,
+                from_user_id=from_user_id,
+                to_user_id=to_user_id,
+                message=rng.choice(['Кофе?', 'Прогуляемся в выходные?', 'Кино в пятницу?', '']),
+                proposed_date=created_at + timedelta(days=rng.randint(1, 14)),
+                status=_choice(rng, INVITATION_STATUSES),
+                created_at=created_at,
+            ))
+        DateInvitation.objects.bulk_create(invitations, batch_size=ctx['batch_size'])
+    return len(matches)
+
+
+def count_likes(start, stop, ctx):
+    """Пересчитать likes_count пользователей пачки по взаимодействиям"""
+    likes = UserInteraction.objects.filter(to_user=OuterRef('pk'), interaction_type='like')\
+                .order_by().values('to_user').annotate(total=Count('*')).values('total')
+    return User.objects.filter(pk__gte=ctx['base'] + start, pk__lt=ctx['base'] + stop)\
+               .update(likes_count=Coalesce(Subquery(likes), 0))
+
+
+def _init_worker():
+    # Соединения родителя нельзя использовать после fork
+    connections.close_all()
+
+
+def _run_task(task):
+    func, start, stop, ctx = task
+    try:
+        return func(start, stop, ctx)
+    finally:
+        connections.close_all()
+
+
 class Command(BaseCommand):
     help = 'Генерация моковых данных для тестирования'
 
     def add_arguments(self, parser):
         parser.add_argument('--users', type=int, default=1000, help='Количество пользователей')
         parser.add_argument('--interactions', type=int, default=5000, help='Количество взаимодействий')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Пользователей в одной пачке')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Количество процессов (для SQLite оставьте 1)')
+        parser.add_argument('--seed', default='mock', help='Зерно генератора для воспроизводимых данных')
 
     def handle(self, *args, **options):
+        users = options['users']
+        if users < 2:
+            self.stdout.write('Нужно хотя бы два пользователя')
+            return
         fake = Faker('ru_RU')
-        
+        Faker.seed(options['seed'])
+
         self.stdout.write('Генерация моковых данных...')
-        
-        users_count = options['users']
-        interactions_count = options['interactions']
-        
-        cities = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань']
-        hobbies_list = [
-            'Путешествия, фотография, музыка',
-            'Спорт, книги, кино',
-            'Программирование, видеоигры',
-            'Искусство, театр, танцы',
-            'Кулинария, вино, рестораны'
-        ]
-        
-        users = []
-        for i in range(users_count):
-            user = User(
-                email=fake.unique.email(),
-                username=fake.unique.user_name(),
-                first_name=fake.first_name(),
-                last_name=fake.last_name(),
-                gender=random.choice(['M', 'F']),
-                age=random.randint(18, 65),
-                city=random.choice(cities),
-                hobbies=random.choice(hobbies_list),
-                status=random.choice(['looking', 'busy', 'complicated']),
-                privacy_settings=random.choice(['public', 'private', 'friends_only']),
-                is_active=True
-            )
-            user.set_password('password123')
-            users.append(user)
-        
-        User.objects.bulk_create(users, batch_size=100)
-        self.stdout.write(f'Создано {users_count} пользователей')
-        
-        created_users = User.objects.all()
-        
-        interactions = []
-        for i in range(interactions_count):
-            from_user = random.choice(created_users)
-            to_user = random.choice([u for u in created_users if u != from_user])
-            
-            interaction = UserInteraction(
-                from_user=from_user,
-                to_user=to_user,
-                interaction_type=random.choice(['like', 'dislike']),
-                created_at=fake.date_time_between(start_date='-30d', end_date='now', tzinfo=timezone.utc)
-            )
-            interactions.append(interaction)
-        
-        UserInteraction.objects.bulk_create(interactions, ignore_conflicts=True, batch_size=100)
-        self.stdout.write(f'Создано {interactions_count} взаимодействий')
-        
+
+        # Пароль хешируется один раз, имена берутся из небольших заранее сгенерированных списков
+        ctx = {
+            'base': (User.objects.aggregate(last=Max('pk'))['last'] or 0) + 1,
+            'users': users,
+            'interactions': options['interactions'],
+            'batch_size': options['batch_size'],
+            'seed': options['seed'],
+            'now': timezone.now(),
+            'password': make_password('password123'),
+            'names': {
+                'M': {'first': [fake.first_name_male() for _ in range(200)],
+                      'last': [fake.last_name_male() for _ in range(500)]},
+                'F': {'first': [fake.first_name_female() for _ in range(200)],
+                      'last': [fake.last_name_female() for _ in range(500)]},
+            },
+        }
+
+        # Открытое соединение иначе унаследуют процессы пула, и закрытие
+        # в них оборвет его и у родителя
+        connections.close_all()
+        pool = Pool(options['workers'], initializer=_init_worker) if options['workers'] > 1 else None
+        try:
+            for title, func in [
+                ('Создано пользователей', create_users),
+                ('Создано взаимодействий', create_interactions),
+                ('Создано матчей', create_matches),
+                ('Обновлено счетчиков лайков', count_likes),
+            ]:
+                started = time.perf_counter()
+                total = self._run(pool, func, ctx)
+                self.stdout.write(f'{title}: {total} ({time.perf_counter() - started:.1f} с)')
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        # id пользователей заданы явно, поэтому последовательность нужно догнать
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User]):
+                cursor.execute(sql)
+
         self.stdout.write(
             self.style.SUCCESS('Моковые данные успешно сгенерированы!')
-        )
\ No newline at end of file
+        )
+
+    def _run(self, pool, func, ctx):
+        step = ctx['batch_size']
+        tasks = [(func, start, min(start + step, ctx['users']), ctx) for start in range(0, ctx['users'], step)]
+        if pool is None:
+            return sum(func(start, stop, ctx) for _, start, stop, _ in tasks)
+        return sum(pool.imap_unordered(_run_task, tasks))
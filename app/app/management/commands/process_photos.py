@@ -0,0 +1,33 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from app.models import UserPhoto
+from app.photos import process_photo
+
+
+class Command(BaseCommand):
+    help = 'Генерация превью для фото, которые еще не обработаны (в том числе загруженных до появления превью)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Повторить фото с ошибкой обработки')
+        parser.add_argument('--older-than', type=float, default=0,
+                            help='Только фото, загруженные больше N секунд назад (свежие обрабатывает фоновая задача)')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд (0 - выполнить один раз)')
+
+    def handle(self, *args, **options):
+        statuses = ['pending', 'failed'] if options['retry_failed'] else ['pending']
+        while True:
+            cutoff = timezone.now() - timedelta(seconds=options['older_than'])
+            photo_ids = UserPhoto.objects.filter(processing_status__in=statuses, uploaded_at__lte=cutoff)\
+                            .order_by('pk').values_list('pk', flat=True).iterator(chunk_size=1000)
+            processed = 0
+            for photo_id in photo_ids:
+                process_photo(photo_id)
+                processed += 1
+            self.stdout.write(self.style.SUCCESS(f'Обработано фото: {processed}'))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
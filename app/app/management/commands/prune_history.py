@@ -0,0 +1,66 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from app.models import UserLikeHistory, ViewHistory
+from app.partitions import (
+    HISTORY_TABLES, create_partitions, drop_partition, is_partitioned, month_bound, month_start,
+    partitions, prune_default_partition, retention_cutoff, shift_month
+)
+
+
+def delete_before(model, column, cutoff, batch_size):
+    """Удаление пачками по id для таблиц без секций; возвращает число строк"""
+    total = 0
+    expired = model.objects.filter(**{f'{column}__lt': cutoff}).order_by('pk')
+    while True:
+        pks = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return total
+        total += model.objects.filter(pk__in=pks).delete()[0]
+
+
+class Command(BaseCommand):
+    help = 'Удаление истории просмотров и лайков старше срока хранения и создание секций на будущее'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archive', action='store_true',
+                            help='Не удалять истекшие секции, а оставить отдельными таблицами (PostgreSQL)')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Строк за один DELETE для таблиц без секций')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд (0 - выполнить один раз)')
+
+    def handle(self, *args, **options):
+        while True:
+            for model in [ViewHistory, UserLikeHistory]:
+                table = model._meta.db_table
+                if is_partitioned(connection, table):
+                    self.rotate(table, options['archive'])
+                elif options['archive']:
+                    raise CommandError('Архивировать можно только секционированные таблицы PostgreSQL')
+                else:
+                    column = HISTORY_TABLES[table][0]
+                    deleted = delete_before(model, column, month_bound(retention_cutoff(table)),
+                                            options['batch_size'])
+                    self.stdout.write(f'{table}: удалено строк: {deleted}')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def rotate(self, table, archive):
+        cutoff = retention_cutoff(table)
+        ahead = shift_month(month_start(timezone.now()), settings.HISTORY_RETENTION['PARTITIONS_AHEAD'])
+        created = create_partitions(connection, table, cutoff, ahead)
+        expired = sorted(month for month in partitions(connection, table) if month < cutoff)
+        for month in expired:
+            drop_partition(connection, table, month, archive=archive)
+        if not archive:
+            # Секция DEFAULT не отсоединяется; при --archive ее строки остаются как есть
+            prune_default_partition(connection, table, cutoff)
+        self.stdout.write(
+            f'{table}: создано секций: {len(created)}, '
+            f'{"в архиве" if archive else "удалено"} секций: {len(expired)}'
+        )
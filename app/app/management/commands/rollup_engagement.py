@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from app.engagement import rollup
+
+
+class Command(BaseCommand):
+    help = 'Пересчет дневных агрегатов активности (DailyEngagement) по новым строкам истории'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд (0 - выполнить один раз)')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Строк источника за одну транзакцию')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = rollup(options['chunk_size'])
+            if any(processed.values()):
+                self.stdout.write(', '.join(f'{source}: {total}' for source, total in processed.items()))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
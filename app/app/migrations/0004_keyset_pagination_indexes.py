@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_view_history_event_time'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='userlikehistory',
+            name='app_userlik_user_id_7d18bf_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='viewhistory',
+            name='app_viewhis_viewer__36b58b_idx',
+        ),
+        migrations.AddIndex(
+            model_name='userinteraction',
+            index=models.Index(fields=['from_user', 'created_at', 'id'], name='app_userint_from_us_3a1c17_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlikehistory',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='app_userlik_user_id_ef9058_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='viewhistory',
+            index=models.Index(fields=['viewer', 'viewed_at', 'id'], name='app_viewhis_viewer__878cd3_idx'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def canonicalize_matches(apps, schema_editor):
+    """Привести матчи к порядку user1 < user2 и слить дубликаты одной пары.
+
+    Из дубликатов остается самый ранний, активный - если активен любой;
+    приглашения переносятся на него.
+    """
+    Match = apps.get_model('app', 'Match')
+    DateInvitation = apps.get_model('app', 'DateInvitation')
+    reversed_pairs = Match.objects.filter(user1_id__gt=models.F('user2_id'))\
+        .values_list('user2_id', 'user1_id').distinct()
+    for user1_id, user2_id in list(reversed_pairs):
+        matches = list(Match.objects.filter(
+            models.Q(user1_id=user1_id, user2_id=user2_id) | models.Q(user1_id=user2_id, user2_id=user1_id)
+        ).order_by('created_at', 'pk'))
+        kept, duplicates = matches[0], [match.pk for match in matches[1:]]
+        if duplicates:
+            DateInvitation.objects.filter(match_id__in=duplicates).update(match_id=kept.pk)
+            Match.objects.filter(pk__in=duplicates).delete()
+        Match.objects.filter(pk=kept.pk).update(
+            user1_id=user1_id,
+            user2_id=user2_id,
+            is_active=any(match.is_active for match in matches)
+        )
+
+
+def backfill_participants(apps, schema_editor):
+    Match = apps.get_model('app', 'Match')
+    MatchParticipant = apps.get_model('app', 'MatchParticipant')
+    batch = []
+    for match in Match.objects.order_by('pk').iterator(chunk_size=2000):
+        for user_id, other_user_id in [(match.user1_id, match.user2_id), (match.user2_id, match.user1_id)]:
+            batch.append(MatchParticipant(
+                match_id=match.pk,
+                user_id=user_id,
+                other_user_id=other_user_id,
+                is_active=match.is_active,
+                created_at=match.created_at
+            ))
+        if len(batch) >= 2000:
+            MatchParticipant.objects.bulk_create(batch)
+            batch = []
+    MatchParticipant.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='app.match')),
+                ('other_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_participations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'is_active', 'created_at'], name='app_matchpa_user_id_6f313e_idx')],
+                'unique_together': {('match', 'user')},
+            },
+        ),
+        migrations.RunPython(canonicalize_matches, migrations.RunPython.noop),
+        migrations.RunPython(backfill_participants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_match_participants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userphoto',
+            name='medium',
+            field=models.ImageField(blank=True, upload_to='user_photos/renditions/'),
+        ),
+        # Уже загруженные фото получают pending и без превью не показываются, пока их
+        # не обработает process_photos (в docker-compose - сервис photos)
+        migrations.AddField(
+            model_name='userphoto',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'В обработке'), ('ready', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='userphoto',
+            name='thumbnail',
+            field=models.ImageField(blank=True, upload_to='user_photos/renditions/'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:20
+
+from itertools import islice
+
+from django.db import migrations, models
+
+
+def fill_city_key(apps, schema_editor):
+    User = apps.get_model('app', 'User')
+    # Курсором пачками по 1000: в памяти не больше одной пачки пользователей
+    users = User.objects.only('id', 'city').order_by('pk').iterator(chunk_size=1000)
+    while chunk := list(islice(users, 1000)):
+        for user in chunk:
+            user.city_key = ' '.join(user.city.split()).casefold().replace('ё', 'е')
+        User.objects.bulk_update(chunk, ['city_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_user_profile_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='city_key',
+            field=models.CharField(default='', editable=False, max_length=100),
+        ),
+        migrations.RunPython(fill_city_key, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['city_key', 'gender', 'age'], name='app_user_city_ke_ef59ff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['gender', 'age'], name='app_user_gender_c0bdba_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:05
+
+from django.db import migrations
+from django.conf import settings
+from django.utils import timezone
+
+from app.partitions import HISTORY_TABLES, month_start, partition_table, retention_cutoff, shift_month
+
+
+def partition_history(apps, schema_editor):
+    # На SQLite таблицы остаются обычными, срок хранения соблюдает prune_history
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    ahead = shift_month(month_start(timezone.now()), settings.HISTORY_RETENTION['PARTITIONS_AHEAD'])
+    for table, (column, _) in HISTORY_TABLES.items():
+        partition_table(connection, table, column, retention_cutoff(table), ahead)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_recommendation'),
+    ]
+
+    operations = [
+        # Обратно таблицы не собираются: секционированная таблица совместима с моделью
+        migrations.RunPython(partition_history, migrations.RunPython.noop),
+    ]
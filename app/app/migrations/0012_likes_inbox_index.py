@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_daily_engagement'),
+    ]
+
+    # Новый индекс создается до удаления старого, чтобы входящие лайки не остались без индекса
+    operations = [
+        migrations.AddIndex(
+            model_name='userinteraction',
+            index=models.Index(fields=['to_user', 'interaction_type', 'created_at', 'id'], name='app_userint_to_user_57d37e_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='userinteraction',
+            name='app_userint_to_user_5d56f8_idx',
+        ),
+    ]
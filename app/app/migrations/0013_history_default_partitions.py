@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:40
+
+from django.db import migrations
+
+from app.partitions import HISTORY_TABLES, create_default_partition, is_partitioned
+
+
+def add_default_partitions(apps, schema_editor):
+    # Если prune_history давно не запускался, вставка в месяц без секции
+    # попадет в DEFAULT, а не упадет с ошибкой
+    connection = schema_editor.connection
+    for table in HISTORY_TABLES:
+        if is_partitioned(connection, table):
+            create_default_partition(connection, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_likes_inbox_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_default_partitions, migrations.RunPython.noop),
+    ]
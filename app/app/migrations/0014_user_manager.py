@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:05
+
+import app.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_history_default_partitions'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', app.models.UserManager()),
+            ],
+        ),
+    ]
@@ -1,8 +1,23 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager as AuthUserManager
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 import uuid
 
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # Массовый update не шлет сигналов: кеш аутентификации сбрасывается здесь
+        if not User.AUTH_FIELDS & set(kwargs):
+            return super().update(**kwargs)
+        from .authentication import forget_users
+        user_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        forget_users(user_ids)
+        return rows
+
+class UserManager(AuthUserManager.from_queryset(UserQuerySet)):
+    pass
+
 class User(AbstractUser):
     GENDER_CHOICES = [
         ('M', 'Мужской'),
@@ -31,17 +46,65 @@ class User(AbstractUser):
         validators=[MinValueValidator(18), MaxValueValidator(100)]
     )
     city = models.CharField(max_length=100)
+    # Нормализованный город для поиска без учета регистра по обычному индексу
+    city_key = models.CharField(max_length=100, editable=False, default='')
     hobbies = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='looking')
     likes_count = models.PositiveIntegerField(default=0)
     privacy_settings = models.CharField(max_length=20, choices=PRIVACY_CHOICES, default='public')
+    # Меняется при каждом изменении данных профиля; входит в ключ кеша и ETag
+    profile_version = models.PositiveIntegerField(default=1)
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
+    
+    objects = UserManager()
+    
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['city_key', 'gender', 'age']),
+            models.Index(fields=['gender', 'age']),
+        ]
+    
+    PROFILE_FIELDS = {'email', 'first_name', 'last_name', 'gender', 'age', 'city',
+                      'hobbies', 'status', 'likes_count', 'privacy_settings'}
+    # Поля, от которых зависит аутентификация; их update() сбрасывает user_cache
+    AUTH_FIELDS = {'password', 'is_active'}
+    
+    @staticmethod
+    def normalize_city(city):
+        return ' '.join(city.split()).casefold().replace('ё', 'е')
+    
+    def save(self, *args, **kwargs):
+        self.city_key = self.normalize_city(self.city)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'city' in update_fields:
+            kwargs['update_fields'] = update_fields = set(update_fields) | {'city_key'}
+        bump = not self._state.adding and (update_fields is None or self.PROFILE_FIELDS & set(update_fields))
+        if bump:
+            self.profile_version = models.F('profile_version') + 1
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'profile_version'}
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['profile_version'])
+    
+    @classmethod
+    def bump_profile_versions(cls, user_ids):
+        cls.objects.filter(pk__in=user_ids).update(profile_version=models.F('profile_version') + 1)
 
 class UserPhoto(models.Model):
+    PROCESSING_CHOICES = [
+        ('pending', 'В обработке'),
+        ('ready', 'Готово'),
+        ('failed', 'Ошибка'),
+    ]
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='photos')
     photo = models.ImageField(upload_to='user_photos/')
+    thumbnail = models.ImageField(upload_to='user_photos/renditions/', blank=True)
+    medium = models.ImageField(upload_to='user_photos/renditions/', blank=True)
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_CHOICES, default='pending')
     is_main = models.BooleanField(default=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
@@ -49,6 +112,12 @@ class UserPhoto(models.Model):
         if self.is_main:
             UserPhoto.objects.filter(user=self.user, is_main=True).update(is_main=False)
         super().save(*args, **kwargs)
+        User.bump_profile_versions([self.user_id])
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        User.bump_profile_versions([self.user_id])
+        return result
 
 class UserInteraction(models.Model):
     INTERACTION_CHOICES = [
@@ -65,17 +134,34 @@ class UserInteraction(models.Model):
         unique_together = ['from_user', 'to_user']
         indexes = [
             models.Index(fields=['from_user', 'to_user']),
-            models.Index(fields=['to_user', 'interaction_type']),
+            # Входящие лайки пользователя от новых к старым (likes-me) - диапазон этого индекса
+            models.Index(fields=['to_user', 'interaction_type', 'created_at', 'id']),
+            models.Index(fields=['from_user', 'created_at', 'id']),
         ]
+    
+    @classmethod
+    def incoming_likes(cls, user):
+        """Лайки пользователю от новых к старым с отметками его ответа.
+
+        is_mutual - пользователь лайкнул в ответ, is_unanswered - еще не
+        свайпнул этого человека. Каждая отметка - поиск по уникальному
+        индексу (from_user, to_user).
+        """
+        replies = cls.objects.filter(from_user=user, to_user=models.OuterRef('from_user'))
+        return cls.objects.filter(to_user=user, interaction_type='like').annotate(
+            is_mutual=models.Exists(replies.filter(interaction_type='like')),
+            is_unanswered=~models.Exists(replies),
+        ).order_by('-created_at', '-id')
 
 class ViewHistory(models.Model):
     viewer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='viewed_profiles')
     viewed_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='viewed_by')
-    viewed_at = models.DateTimeField(auto_now_add=True)
+    # Не auto_now_add: буфер просмотров пишет записи позже и сохраняет время события
+    viewed_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         indexes = [
-            models.Index(fields=['viewer', 'viewed_at']),
+            models.Index(fields=['viewer', 'viewed_at', 'id']),
         ]
 
 class Match(models.Model):
@@ -86,6 +172,60 @@ class Match(models.Model):
     
     class Meta:
         unique_together = ['user1', 'user2']
+    
+    @classmethod
+    def for_user(cls, user):
+        """Активные матчи пользователя от новых к старым"""
+        return cls.objects.filter(participants__user=user, participants__is_active=True)\
+                   .order_by('-created_at', '-id')
+    
+    @classmethod
+    def between(cls, user_id, other_user_id):
+        """Несохраненный матч с каноническим порядком участников: user1 - меньший id"""
+        user1_id, user2_id = sorted([user_id, other_user_id])
+        return cls(user1_id=user1_id, user2_id=user2_id)
+    
+    def save(self, *args, **kwargs):
+        if self.user1_id > self.user2_id:
+            self.user1_id, self.user2_id = self.user2_id, self.user1_id
+        creating = self._state.adding
+        super().save(*args, **kwargs)
+        if creating:
+            MatchParticipant.objects.bulk_create(MatchParticipant.for_matches([self]))
+        else:
+            self.participants.update(is_active=self.is_active)
+
+class MatchParticipant(models.Model):
+    """Зеркальная запись матча для каждого участника.
+
+    Позволяет искать матчи пользователя одним диапазоном по индексу
+    (user, is_active, created_at) вместо OR по user1/user2.
+    """
+    match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name='participants')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='match_participations')
+    other_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['match', 'user']
+        indexes = [
+            models.Index(fields=['user', 'is_active', 'created_at']),
+        ]
+    
+    @classmethod
+    def for_matches(cls, matches):
+        participants = []
+        for match in matches:
+            for user_id, other_user_id in [(match.user1_id, match.user2_id), (match.user2_id, match.user1_id)]:
+                participants.append(cls(
+                    match_id=match.pk,
+                    user_id=user_id,
+                    other_user_id=other_user_id,
+                    is_active=match.is_active,
+                    created_at=match.created_at
+                ))
+        return participants
 
 class DateInvitation(models.Model):
     STATUS_CHOICES = [
@@ -115,5 +255,49 @@ class UserLikeHistory(models.Model):
     
     class Meta:
         indexes = [
-            models.Index(fields=['user', 'created_at']),
-        ]
\ No newline at end of file
+            models.Index(fields=['user', 'created_at', 'id']),
+        ]
+
+class LikeCounterShard(models.Model):
+    """Шард счетчика лайков: прирост likes_count, еще не перенесенный в User"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='like_counter_shards')
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['user', 'shard']
+
+
+class Recommendation(models.Model):
+    """Заранее посчитанная рекомендация по истории лайков, см. build_recommendations"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    recommended_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ['user', 'recommended_user']
+        indexes = [
+            models.Index(fields=['user', '-score']),
+        ]
+
+
+class DailyEngagement(models.Model):
+    """Счетчики активности пользователя за день, см. rollup_engagement"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_engagement')
+    day = models.DateField()
+    views_received = models.PositiveIntegerField(default=0)
+    likes_received = models.PositiveIntegerField(default=0)
+    likes_sent = models.PositiveIntegerField(default=0)
+    matches = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        # Уникальный индекс (user, day) обслуживает и чтение диапазона дней
+        unique_together = ['user', 'day']
+
+
+class RollupWatermark(models.Model):
+    """id последней строки источника, уже учтенной в агрегатах или рекомендациях"""
+    source = models.CharField(max_length=50, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
\ No newline at end of file
@@ -0,0 +1,208 @@
+import re
+from datetime import date, datetime, time, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+# Таблицы истории: поле времени и ключ срока хранения в HISTORY_RETENTION
+HISTORY_TABLES = {
+    'app_viewhistory': ('viewed_at', 'VIEW_HISTORY_MONTHS'),
+    'app_userlikehistory': ('created_at', 'LIKE_HISTORY_MONTHS'),
+}
+
+_PARTITION_SUFFIX = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def month_start(value):
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        value = value.astimezone(dt_timezone.utc)
+    return date(value.year, value.month, 1)
+
+
+def shift_month(month, months):
+    year, index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return date(year, index + 1, 1)
+
+
+def month_bound(month):
+    """Начало месяца: границы секций и срок хранения; при USE_TZ - в UTC"""
+    value = datetime.combine(month, time.min)
+    return value.replace(tzinfo=dt_timezone.utc) if settings.USE_TZ else value
+
+
+def retention_cutoff(table, now=None):
+    """Первый хранимый месяц таблицы: текущий месяц минус срок хранения"""
+    months = settings.HISTORY_RETENTION[HISTORY_TABLES[table][1]]
+    return shift_month(month_start(now or timezone.now()), -months)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y%m}'
+
+
+def archive_name(table, month):
+    return f'{table}_archive_{month:%Y%m}'
+
+
+def default_name(table):
+    return f'{table}_default'
+
+
+def is_partitioned(connection, table):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+            'WHERE c.relname = %s AND pg_table_is_visible(c.oid)', [table]
+        )
+        return cursor.fetchone() is not None
+
+
+def partitions(connection, table):
+    """Помесячные секции таблицы: {первое число месяца: имя секции}"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent '
+            'WHERE p.relname = %s AND pg_table_is_visible(p.oid)', [table]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    result = {}
+    for name in names:
+        match = _PARTITION_SUFFIX.search(name)
+        if match:
+            result[date(int(match[1]), int(match[2]), 1)] = name
+    return result
+
+
+def create_default_partition(connection, table):
+    """Секция DEFAULT: строки месяцев без своей секции пишутся в нее, а не падают с ошибкой"""
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {qn(default_name(table))} PARTITION OF {qn(table)} DEFAULT')
+
+
+def has_default_partition(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+            'WHERE c.relname = %s AND pg_table_is_visible(c.oid) AND p.partdefid <> 0', [table]
+        )
+        return cursor.fetchone() is not None
+
+
+def create_partitions(connection, table, first, last):
+    """Создать недостающие секции с месяца first по last включительно.
+
+    Строки месяца, успевшие попасть в секцию DEFAULT, переносятся в новую
+    секцию: иначе PostgreSQL не даст ее создать.
+    """
+    qn = connection.ops.quote_name
+    column = qn(HISTORY_TABLES[table][0])
+    default = qn(default_name(table))
+    has_default = has_default_partition(connection, table)
+    existing = partitions(connection, table)
+    created = []
+    month = first
+    while month <= last:
+        if month not in existing:
+            bounds = [month_bound(month), month_bound(shift_month(month, 1))]
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                stray = False
+                if has_default:
+                    cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {default} '
+                                   f'WHERE {column} >= %s AND {column} < %s)', bounds)
+                    stray = cursor.fetchone()[0]
+                if stray:
+                    cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {default}')
+                cursor.execute(
+                    f'CREATE TABLE {qn(partition_name(table, month))} PARTITION OF {qn(table)} '
+                    f'FOR VALUES FROM (%s) TO (%s)', bounds
+                )
+                if stray:
+                    cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {default} '
+                                   f'WHERE {column} >= %s AND {column} < %s', bounds)
+                    cursor.execute(f'DELETE FROM {default} WHERE {column} >= %s AND {column} < %s', bounds)
+                    cursor.execute(f'ALTER TABLE {qn(table)} ATTACH PARTITION {default} DEFAULT')
+            created.append(month)
+        month = shift_month(month, 1)
+    return created
+
+
+def prune_default_partition(connection, table, cutoff):
+    """Удалить из секции DEFAULT строки старше месяца cutoff; возвращает число строк"""
+    if not has_default_partition(connection, table):
+        return 0
+    qn = connection.ops.quote_name
+    column = qn(HISTORY_TABLES[table][0])
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {qn(default_name(table))} WHERE {column} < %s', [month_bound(cutoff)])
+        return cursor.rowcount
+
+
+def drop_partition(connection, table, month, archive=False):
+    """Отсоединить секцию месяца и удалить ее или оставить отдельной таблицей-архивом.
+
+    Обе операции меняют только каталог и не зависят от числа строк.
+    """
+    qn = connection.ops.quote_name
+    name = partition_name(table, month)
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+        if archive:
+            cursor.execute(f'ALTER TABLE {qn(name)} RENAME TO {qn(archive_name(table, month))}')
+        else:
+            cursor.execute(f'DROP TABLE {qn(name)}')
+
+
+def partition_table(connection, table, column, first, last):
+    """Перестроить обычную таблицу истории в секционированную по месяцам поля column.
+
+    Секции создаются с месяца самой старой строки (но не позже first) по last.
+    Первичный ключ секционированной таблицы обязан включать ключ
+    секционирования, поэтому он становится (id, column); id по-прежнему
+    берется из последовательности и уникален. Индексы и внешние ключи
+    переносятся со старой таблицы.
+    """
+    qn = connection.ops.quote_name
+    old = f'{table}_unpartitioned'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s "
+            "AND schemaname = current_schema()", [table, f'{table}_pkey']
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'", [table]
+        )
+        foreign_keys = cursor.fetchall()
+        # Месяц считается в часовом поясе соединения, как и границы секций
+        cursor.execute(f"SELECT date_trunc('month', MIN({qn(column)}))::date, MAX(id) FROM {qn(table)}")
+        oldest, last_id = cursor.fetchone()
+
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(old)}')
+        cursor.execute(f'CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING DEFAULTS) '
+                       f'PARTITION BY RANGE ({qn(column)})')
+    if oldest is not None:
+        first = min(first, oldest)
+    create_partitions(connection, table, first, last)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(old)}')
+        # Вместе со старой таблицей удаляются ее identity-последовательность, индексы и ограничения
+        cursor.execute(f'DROP TABLE {qn(old)}')
+
+        sequence = f'{table}_id_seq'
+        cursor.execute(f'CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.id')
+        if last_id is not None:
+            cursor.execute('SELECT setval(%s, %s)', [sequence, last_id])
+        cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+        cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(table + "_pkey")} '
+                       f'PRIMARY KEY (id, {qn(column)})')
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+        for definition in indexes:
+            cursor.execute(definition)
@@ -0,0 +1,78 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .models import User, UserPhoto
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.PHOTO_PROCESSING_WORKERS,
+            thread_name_prefix='photo-processing'
+        )
+    return _executor
+
+
+def render(image, size):
+    """Уменьшенная копия в JPEG; сохраняется без EXIF"""
+    copy = image.copy()
+    copy.thumbnail(size, Image.LANCZOS)
+    buffer = BytesIO()
+    copy.save(buffer, 'JPEG', quality=settings.PHOTO_RENDITION_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def process_photo(photo_id):
+    """Декодировать оригинал, повернуть по EXIF и сохранить превью всех размеров"""
+    photo = UserPhoto.objects.get(pk=photo_id)
+    try:
+        with photo.photo.open('rb') as source:
+            image = Image.open(source)
+            image = ImageOps.exif_transpose(image).convert('RGB')
+        for name, size in settings.PHOTO_RENDITIONS.items():
+            getattr(photo, name).save(f'{photo.pk}_{name}.jpg', ContentFile(render(image, size)), save=False)
+    # DecompressionBombError не наследует OSError: без него фото навсегда осталось бы pending
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.exception('Не удалось обработать фото %s', photo_id)
+        UserPhoto.objects.filter(pk=photo_id).update(processing_status='failed')
+        User.bump_profile_versions([photo.user_id])
+        return
+
+    # update() вместо save(): не трогаем логику is_main и не перезаписываем параллельные изменения
+    UserPhoto.objects.filter(pk=photo_id).update(
+        processing_status='ready',
+        **{name: getattr(photo, name).name for name in settings.PHOTO_RENDITIONS}
+    )
+    User.bump_profile_versions([photo.user_id])
+
+
+def _process_in_worker(photo_id):
+    try:
+        process_photo(photo_id)
+    except UserPhoto.DoesNotExist:
+        pass
+    except Exception:
+        # Иначе исключение осталось бы в Future, которую никто не читает
+        logger.exception('Ошибка обработки фото %s', photo_id)
+        UserPhoto.objects.filter(pk=photo_id).update(processing_status='failed')
+    finally:
+        close_old_connections()
+
+
+def schedule_photo_processing(photo_id):
+    """Поставить фото в очередь обработки после фиксации транзакции"""
+    if settings.PHOTO_PROCESSING_ASYNC:
+        transaction.on_commit(lambda: _get_executor().submit(_process_in_worker, photo_id))
+    else:
+        transaction.on_commit(lambda: process_photo(photo_id))
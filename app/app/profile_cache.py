@@ -0,0 +1,66 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+
+from .models import User
+
+
+def profile_key(pk, version, request=None):
+    """Ключ представления профиля: id, версия профиля и хост запроса.
+
+    Хост нужен потому, что ссылки на фото в представлении абсолютные.
+    """
+    origin = request.build_absolute_uri('/') if request is not None else ''
+    origin_hash = hashlib.md5(origin.encode()).hexdigest()[:8]
+    return f'profile:{pk}:{version}:{origin_hash}'
+
+
+def profile_cache_key(user, request=None):
+    return profile_key(user.pk, user.profile_version, request)
+
+
+def get_profiles(users, request, build):
+    """Представления профилей страницы одним get_many: {ключ: данные}.
+
+    Для промахов фото догружаются одним запросом, представления строятся
+    через build и кладутся в кеш одним set_many.
+    """
+    keys = {user.pk: profile_cache_key(user, request) for user in users}
+    found = cache.get_many(list(set(keys.values())))
+    missing = {user.pk: user for user in users if keys[user.pk] not in found}.values()
+    if missing:
+        prefetch_related_objects(list(missing), 'photos')
+        fresh = {keys[user.pk]: build(user) for user in missing}
+        cache.set_many(fresh, settings.PROFILE_CACHE_TTL)
+        found.update(fresh)
+    return found
+
+
+def get_profile(user, request, build):
+    key = profile_cache_key(user, request)
+    data = cache.get(key)
+    if data is None:
+        prefetch_related_objects([user], 'photos')
+        data = build(user)
+        cache.set(key, data, settings.PROFILE_CACHE_TTL)
+    return data
+
+
+def get_profiles_by_version(versions, request, build):
+    """Как get_profiles, но по {id: версия профиля}, прочитанным через values().
+
+    Пользователи загружаются только для промахов кеша. Возвращает {id: данные}.
+    """
+    keys = {pk: profile_key(pk, version, request) for pk, version in versions.items()}
+    found = cache.get_many(list(set(keys.values())))
+    result = {pk: found[key] for pk, key in keys.items() if key in found}
+    missing = [pk for pk in keys if pk not in result]
+    if missing:
+        fresh = {}
+        for user in User.objects.filter(pk__in=missing).prefetch_related('photos'):
+            # Версия могла измениться после чтения строк; ключ берется по загруженной
+            result[user.pk] = fresh[profile_cache_key(user, request)] = build(user)
+        cache.set_many(fresh, settings.PROFILE_CACHE_TTL)
+    return result
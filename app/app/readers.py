@@ -0,0 +1,94 @@
+from django.conf import settings
+from rest_framework import permissions, serializers
+from rest_framework.response import Response
+
+from .profile_cache import get_profiles_by_version
+from .serializers import UserProfileSerializer, selected_fields
+
+# Поля, которым нужно форматирование; остальные значения values() отдаются как есть
+_FORMATTED = (serializers.DateTimeField, serializers.DateField, serializers.TimeField,
+              serializers.DecimalField)
+
+
+class SparseFieldsMixin:
+    """Поддержка ?fields= и ?expand= при чтении: лишние поля убираются из сериализатора"""
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if self.request.method in permissions.SAFE_METHODS:
+            child = getattr(serializer, 'child', serializer)
+            names = selected_fields(child.fields, getattr(child.Meta, 'expandable', {}),
+                                    self.request.query_params)
+            for name in list(child.fields):
+                if name not in names:
+                    del child.fields[name]
+        return serializer
+
+
+class ValuesReader:
+    """Сериализация строк values() с тем же результатом, что у ModelSerializer.
+
+    Не создает экземпляры моделей и не проходит по DRF-полям каждой строки:
+    простые значения копируются, даты форматируются полем сериализатора,
+    вложенные профили берутся из кеша по id и версии профиля. Поддерживаются
+    поля модели и профили из Meta.expandable с одним источником.
+    """
+
+    def __init__(self, serializer):
+        expandable = getattr(serializer.Meta, 'expandable', {})
+        self.columns = []
+        self.profiles = []
+        for name, field in serializer.fields.items():
+            if name in expandable:
+                [source] = expandable[name]
+                self.profiles.append((name, source, f'{source}__profile_version'))
+            else:
+                formatted = isinstance(field, _FORMATTED)
+                self.columns.append((name, field.source, field.to_representation if formatted else None))
+        self.fields = list(serializer.fields)
+        self.context = serializer.context
+
+    def lookups(self, *extra):
+        names = [source for _, source, _ in self.columns]
+        for _, source, version in self.profiles:
+            names += [source, version]
+        return list(dict.fromkeys([*names, *extra]))
+
+    def serialize(self, rows):
+        request = self.context.get('request')
+        versions = {
+            row[source]: row[version]
+            for row in rows for _, source, version in self.profiles if row[source] is not None
+        }
+        profiles = get_profiles_by_version(
+            versions, request, UserProfileSerializer(context=self.context).build
+        ) if versions else {}
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, source, convert in self.columns:
+                value = row[source]
+                item[name] = convert(value) if convert is not None and value is not None else value
+            for name, source, _ in self.profiles:
+                item[name] = profiles.get(row[source])
+            # Порядок ключей как у сериализатора
+            data.append({name: item[name] for name in self.fields})
+        return data
+
+
+class ValuesListMixin:
+    """list() через ValuesReader; отключается настройкой FAST_LIST_SERIALIZATION"""
+
+    def list(self, request, *args, **kwargs):
+        if not settings.FAST_LIST_SERIALIZATION:
+            return super().list(request, *args, **kwargs)
+        reader = ValuesReader(self.get_serializer())
+        queryset = self.filter_queryset(self.get_queryset())
+        keyset_field = getattr(self, 'keyset_field', None)
+        queryset = queryset.values(*reader.lookups('pk', *filter(None, [keyset_field])))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.serialize(page))
+        return Response(reader.serialize(list(queryset)))
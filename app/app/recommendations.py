@@ -0,0 +1,146 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Recommendation, User, UserInteraction
+
+# Сколько id передается в одном условии __in
+_ID_BATCH = 5000
+
+
+def _interactions(field, ids, *columns, **filters):
+    """Столбцы взаимодействий, у которых field из ids, массивами int64; ids идут пачками"""
+    ids = np.unique(ids).tolist()
+    parts = [np.zeros((0, len(columns)), dtype=np.int64)]
+    for start in range(0, len(ids), _ID_BATCH):
+        rows = UserInteraction.objects.filter(**{f'{field}__in': ids[start:start + _ID_BATCH]}, **filters)\
+                   .values_list(*columns)
+        parts.append(np.array(list(rows), dtype=np.int64).reshape(-1, len(columns)))
+    return tuple(np.concatenate(parts).T)
+
+
+def _like_counts(field, ids):
+    """Число лайков по значению field для ids: (отсортированные id, количества)"""
+    ids = np.unique(ids).tolist()
+    parts = [np.zeros((0, 2), dtype=np.int64)]
+    for start in range(0, len(ids), _ID_BATCH):
+        rows = UserInteraction.objects.filter(**{f'{field}__in': ids[start:start + _ID_BATCH]},
+                                              interaction_type='like')\
+                   .values(field).annotate(total=Count('*')).values_list(field, 'total').order_by()
+        parts.append(np.array(list(rows), dtype=np.int64).reshape(-1, 2))
+    counts = np.concatenate(parts)
+    order = np.argsort(counts[:, 0])
+    return counts[order, 0], counts[order, 1]
+
+
+def _lookup(keys, values, ids):
+    """values для ids по отсортированным keys; для отсутствующих - 0"""
+    position = np.searchsorted(keys, ids)
+    found = position < len(keys)
+    found[found] = keys[position[found]] == ids[found]
+    result = np.zeros(len(ids), dtype=values.dtype)
+    result[found] = values[position[found]]
+    return result
+
+
+def _join(keys, right_keys, right_values):
+    """Все пары (позиция в keys, значение справа) с совпадающим ключом"""
+    order = np.argsort(right_keys, kind='stable')
+    right_keys, right_values = right_keys[order], right_values[order]
+    starts = np.searchsorted(right_keys, keys, 'left')
+    counts = np.searchsorted(right_keys, keys, 'right') - starts
+    owner = np.repeat(np.arange(len(keys)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, right_values[starts[owner] + offsets]
+
+
+def _top_per_group(groups, values, scores, k):
+    """Не более k пар с наибольшей оценкой в каждой группе"""
+    order = np.lexsort((-scores, groups))
+    groups, values, scores = groups[order], values[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    rank = np.arange(len(groups)) - np.repeat(starts, np.diff(np.r_[starts, len(groups)]))
+    keep = rank < k
+    return groups[keep], values[keep], scores[keep]
+
+
+class Recommender:
+    """Коллаборативная фильтрация item-item по лайкам.
+
+    Сходство двух профилей - косинус по векторам их лайкнувших: число
+    общих лайкнувших / sqrt(лайков первого * лайков второго). Для каждого
+    лайкнутого профиля берется до neighbors самых похожих, и профиль-
+    кандидат получает сумму сходств со всеми профилями, которые лайкнул
+    пользователь. Профили, которые лайкает больше max_item_likers
+    человек, не служат источником похожих: они почти ничего не говорят о
+    вкусе и раздувают промежуточные массивы.
+
+    Матрица взаимодействий целиком не загружается: для каждой пачки
+    пользователей из UserInteraction по индексам читаются только нужные
+    строки и столбцы - лайки пачки, лайкнувшие эти профили и их лайки.
+    """
+
+    def __init__(self, neighbors=50, max_item_likers=5000):
+        self.neighbors = neighbors
+        self.max_item_likers = max_item_likers
+
+    def similar_items(self, items, item_ids, popularity):
+        """До neighbors самых похожих на каждый профиль из items: массивы (профиль, похожий, сходство).
+
+        item_ids и popularity - отсортированные id и число лайков, в них
+        должны быть все items.
+        """
+        item, liker = _interactions('to_user', items, 'to_user_id', 'from_user_id', interaction_type='like')
+        position, other = _join(liker, *_interactions('from_user', liker, 'from_user_id', 'to_user_id',
+                                                       interaction_type='like'))
+        item = item[position]
+        keep = other != item
+        base = int(other.max(initial=0)) + 1
+        key, overlap = np.unique(item[keep] * base + other[keep], return_counts=True)
+        item, other = key // base, key % base
+        other_ids, other_popularity = _like_counts('to_user', other)
+        similarity = overlap / np.sqrt(
+            _lookup(item_ids, popularity, item) * _lookup(other_ids, other_popularity, other)
+        )
+        return _top_per_group(item, other, similarity, self.neighbors)
+
+    def recommend(self, users, k):
+        """Топ-k для пачки пользователей: массивы (пользователь, рекомендация, оценка).
+
+        Память ограничена размером пачки, числом похожих и max_item_likers.
+        """
+        users = np.unique(np.asarray(users, dtype=np.int64))
+        empty = np.zeros(0, dtype=np.int64)
+
+        liker, liked = _interactions('from_user', users, 'from_user_id', 'to_user_id', interaction_type='like')
+        owner = np.searchsorted(users, liker)
+        item_ids, popularity = _like_counts('to_user', liked)
+        keep = np.isin(liked, item_ids[popularity <= self.max_item_likers])
+        owner, liked = owner[keep], liked[keep]
+        if not len(liked):
+            return empty, empty, np.zeros(0)
+
+        items, similar, similarity = self.similar_items(np.unique(liked), item_ids, popularity)
+        position, index = _join(liked, items, np.arange(len(items)))
+        owner, targets, weights = owner[position], similar[index], similarity[index]
+        # Уже просмотренные свайпом профили и сам пользователь не рекомендуются
+        swiper, seen = _interactions('from_user', users, 'from_user_id', 'to_user_id')
+        base = int(max(targets.max(initial=0), seen.max(initial=0))) + 1
+        key, inverse = np.unique(owner * base + targets, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        keep = ~np.isin(key, np.searchsorted(users, swiper) * base + seen) & (key % base != users[key // base])
+        owner, targets, scores = _top_per_group(key[keep] // base, key[keep] % base, scores[keep], k)
+        return users[owner], targets, scores
+
+
+def store_recommendations(chunk, users, recommended, scores, batch_size=1000):
+    """Заменить рекомендации пользователей пачки chunk результатом recommend()"""
+    # Снимок матрицы может ссылаться на уже удаленных пользователей
+    existing = set(User.objects.filter(pk__in=np.unique(recommended).tolist()).values_list('pk', flat=True))
+    with transaction.atomic():
+        Recommendation.objects.filter(user_id__in=np.asarray(chunk).tolist()).delete()
+        Recommendation.objects.bulk_create([
+            Recommendation(user_id=user_id, recommended_user_id=recommended_id, score=score)
+            for user_id, recommended_id, score in zip(users.tolist(), recommended.tolist(), scores.tolist())
+            if recommended_id in existing
+        ], batch_size=batch_size)
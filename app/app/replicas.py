@@ -0,0 +1,131 @@
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework import permissions
+
+# Алиас реплики для чтения в текущем запросе; None - все читается с основной БД
+_read_alias = ContextVar('replica_read_alias', default=None)
+# Состояние запроса для ReplicaStickinessMiddleware: была ли запись
+_writes = ContextVar('replica_writes', default=None)
+
+
+def replica_alias():
+    return settings.DATABASE_REPLICA['ALIAS']
+
+
+def _pin_key(user_id):
+    return f'db:primary:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Читать данные пользователя с основной БД, пока реплика может отставать"""
+    cache.set(_pin_key(user_id), True, settings.DATABASE_REPLICA['STICKY_SECONDS'])
+
+
+def is_pinned(user_id):
+    return cache.get(_pin_key(user_id)) is not None
+
+
+class ReplicaRouter:
+    """Чтение из реплики там, где представление это разрешило, запись - в default.
+
+    Внутри транзакции на основной БД чтение тоже идет в default, чтобы
+    видеть только что записанное.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _writes.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика - копия default, объекты из обеих баз можно связывать
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica_alias():
+            return False
+        return None
+
+
+class ReplicaStickinessMiddleware:
+    """После запроса, который писал в БД, закрепляет пользователя за основной БД.
+
+    На DATABASE_REPLICA['STICKY_SECONDS'] его чтения не уходят в реплику,
+    поэтому клиент сразу видит свои изменения. Без реплики ничего не делает.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if replica_alias() is None:
+            return self.get_response(request)
+        state = {'wrote': False}
+        token = _writes.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _writes.reset(token)
+        self.pin(request, state)
+        return response
+
+    async def __acall__(self, request):
+        if replica_alias() is None:
+            return await self.get_response(request)
+        state = {'wrote': False}
+        token = _writes.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _writes.reset(token)
+        self.pin(request, state)
+        return response
+
+    def pin(self, request, state):
+        # DRF записывает аутентифицированного пользователя и в исходный запрос
+        user = getattr(request, 'user', None)
+        if state['wrote'] and user is not None and user.is_authenticated:
+            pin_to_primary(user.pk)
+
+
+class ReplicaReadMixin:
+    """Безопасные запросы viewset'а читают из реплики, если пользователь не закреплен.
+
+    replica_actions ограничивает действия, None - все.
+    """
+    replica_actions = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        alias = replica_alias()
+        if (
+            alias is not None
+            and request.method in permissions.SAFE_METHODS
+            and (self.replica_actions is None or self.action in self.replica_actions)
+            and not is_pinned(request.user.pk)
+        ):
+            self._replica_token = _read_alias.set(alias)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _read_alias.reset(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
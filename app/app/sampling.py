@@ -0,0 +1,79 @@
+import random
+from collections import Counter
+
+DEFAULT_PROBES = 32
+# Раунды проб: каждый следующий проверяет в PROBE_GROWTH раз больше случайных id
+PROBE_ROUNDS = 3
+PROBE_GROWTH = 4
+# Если все раунды промахнулись, совпадений мало: считаем их не дальше этого предела
+FALLBACK_COUNT_LIMIT = 10000
+
+
+def _probe_rounds(lo, hi, probes, rng):
+    for round_number in range(PROBE_ROUNDS):
+        yield Counter(rng.randint(lo, hi) for _ in range(probes * PROBE_GROWTH ** round_number))
+
+
+def _choose(candidates, hits, rng):
+    # Каждая проба равномерна по диапазону, поэтому попадание с учетом повторов равномерно по строкам
+    weights = [candidates[pk] for pk in hits]
+    return rng.choices(hits, weights=weights)[0]
+
+
+def sample_pk(queryset, probes=DEFAULT_PROBES, rng=random):
+    """Равномерно выбрать pk из отфильтрованного QuerySet за ограниченное число запросов.
+
+    Границы диапазона берутся проходом по индексу первичного ключа, затем
+    одним запросом проверяется пачка случайных id; при промахе - до
+    PROBE_ROUNDS раундов со все большими пачками. Если промахнулись все
+    (очень разреженный фильтр), берется строка по случайному OFFSET среди
+    совпадений - тоже равномерно; COUNT ограничен FALLBACK_COUNT_LIMIT и
+    считается целиком, только если совпадений больше.
+    """
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    lo = pks.first()
+    if lo is None:
+        return None
+    hi = pks.last()
+
+    for candidates in _probe_rounds(lo, hi, probes, rng):
+        hits = list(pks.filter(pk__in=candidates))
+        if hits:
+            return _choose(candidates, hits, rng)
+
+    total = pks[:FALLBACK_COUNT_LIMIT + 1].count()
+    if total > FALLBACK_COUNT_LIMIT:
+        total = pks.count()
+    offset = rng.randrange(total or 1)
+    found = list(pks[offset:offset + 1])
+    # Строки в конце могли удалить после подсчета
+    return found[0] if found else pks.first()
+
+
+async def asample_pk(queryset, probes=DEFAULT_PROBES, rng=random):
+    """То же, что sample_pk, через асинхронный ORM"""
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    lo = await pks.afirst()
+    if lo is None:
+        return None
+    hi = await pks.alast()
+
+    for candidates in _probe_rounds(lo, hi, probes, rng):
+        hits = [pk async for pk in pks.filter(pk__in=candidates)]
+        if hits:
+            return _choose(candidates, hits, rng)
+
+    total = await pks[:FALLBACK_COUNT_LIMIT + 1].acount()
+    if total > FALLBACK_COUNT_LIMIT:
+        total = await pks.acount()
+    offset = rng.randrange(total or 1)
+    found = [pk async for pk in pks[offset:offset + 1]]
+    return found[0] if found else await pks.afirst()
+
+
+def sample_object(queryset, probes=DEFAULT_PROBES, rng=random):
+    """Вернуть случайный объект из QuerySet или None, если выборка пуста"""
+    pk = sample_pk(queryset, probes=probes, rng=rng)
+    if pk is None:
+        return None
+    return queryset.filter(pk=pk).first()
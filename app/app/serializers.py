@@ -1,11 +1,17 @@
 from rest_framework import serializers
+from django.db import models
 from django.contrib.auth.password_validation import validate_password
+from django.conf import settings
 from .models import *
+from .instrumentation import InstrumentedSerializerMixin
+from .profile_cache import get_profile, get_profiles, profile_cache_key
 
-class UserPhotoSerializer(serializers.ModelSerializer):
+class UserPhotoSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = UserPhoto
-        fields = ['id', 'photo', 'is_main', 'uploaded_at']
+        # Оригинал с EXIF (в том числе GPS) наружу не отдается: пока превью
+        # не готовы или обработка не удалась, thumbnail и medium равны null
+        fields = ['id', 'thumbnail', 'medium', 'processing_status', 'is_main', 'uploaded_at']
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, validators=[validate_password])
@@ -26,7 +32,49 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         user = User.objects.create_user(**validated_data)
         return user
 
-class UserProfileSerializer(serializers.ModelSerializer):
+def selected_fields(field_names, expandable, params):
+    """Поля ответа с учетом ?fields= и ?expand=.
+
+    fields - нужные поля верхнего уровня (по умолчанию все), expand -
+    какие вложенные профили из Meta.expandable встраивать (по умолчанию все,
+    пустой expand - ни одного).
+    """
+    names = list(field_names)
+    if 'fields' in params:
+        wanted = {name.strip() for name in params['fields'].split(',')}
+        names = [name for name in names if name in wanted]
+    if 'expand' in params:
+        expand = {name.strip() for name in params['expand'].split(',')}
+        names = [name for name in names if name not in expandable or name in expand]
+    return names
+
+class ProfilePrefetchListSerializer(serializers.ListSerializer):
+    """Перед сериализацией страницы достает из кеша профили всех строк одним get_many.
+
+    Профили берутся из полей Meta.expandable дочернего сериализатора
+    ({поле ответа: [поля с пользователями]}), оставшихся после ?fields=/?expand=;
+    Meta.profile_sources = [None] означает, что строка сама является пользователем.
+    """
+    
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        meta = self.child.Meta
+        sources = list(getattr(meta, 'profile_sources', []))
+        for name, field_sources in getattr(meta, 'expandable', {}).items():
+            if name in self.child.fields:
+                sources += field_sources
+        users = []
+        for source in sources:
+            users += [item if source is None else getattr(item, source) for item in items]
+        profiles = get_profiles(
+            [user for user in users if user is not None],
+            self.context.get('request'),
+            UserProfileSerializer(context=self.context).build
+        )
+        self.context.setdefault('profiles', {}).update(profiles)
+        return super().to_representation(items)
+
+class UserProfileSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     photos = UserPhotoSerializer(many=True, read_only=True)
     main_photo = serializers.SerializerMethodField()
     
@@ -35,43 +83,93 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = ['id', 'email', 'first_name', 'last_name', 'gender', 'age', 'city', 
                  'hobbies', 'status', 'likes_count', 'privacy_settings', 'photos', 'main_photo']
         read_only_fields = ['email', 'likes_count']
+        list_serializer_class = ProfilePrefetchListSerializer
+        profile_sources = [None]
+    
+    def to_representation(self, instance):
+        request = self.context.get('request')
+        data = self.context.get('profiles', {}).get(profile_cache_key(instance, request))
+        # В кеше всегда полное представление; ?fields= применяется к нему
+        sparse = len(self.fields) < len(self.Meta.fields)
+        if data is None:
+            build = UserProfileSerializer(context=self.context).build if sparse else self.build
+            data = get_profile(instance, request, build)
+        if sparse:
+            data = {name: data[name] for name in self.fields}
+        return data
+    
+    def build(self, instance):
+        """Представление профиля без кеша"""
+        return super().to_representation(instance)
     
     def get_main_photo(self, obj):
-        main_photo = obj.photos.filter(is_main=True).first()
+        # Перебираем photos.all(), чтобы использовать prefetch_related вместо запроса на каждый профиль
+        main_photo = next((photo for photo in obj.photos.all() if photo.is_main), None)
         if main_photo:
-            return UserPhotoSerializer(main_photo).data
+            return UserPhotoSerializer(main_photo, context=self.context).data
         return None
 
-class UserInteractionSerializer(serializers.ModelSerializer):
+class UserInteractionSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     to_user_profile = UserProfileSerializer(source='to_user', read_only=True)
     
     class Meta:
         model = UserInteraction
         fields = ['id', 'to_user', 'to_user_profile', 'interaction_type', 'created_at']
         read_only_fields = ['from_user', 'created_at']
+        list_serializer_class = ProfilePrefetchListSerializer
+        expandable = {'to_user_profile': ['to_user']}
+
+class LikeInboxSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    from_user_profile = UserProfileSerializer(source='from_user', read_only=True)
+    is_mutual = serializers.BooleanField(read_only=True)
+    is_unanswered = serializers.BooleanField(read_only=True)
+    
+    class Meta:
+        model = UserInteraction
+        fields = ['id', 'from_user', 'from_user_profile', 'created_at', 'is_mutual', 'is_unanswered']
+        list_serializer_class = ProfilePrefetchListSerializer
+        expandable = {'from_user_profile': ['from_user']}
+
+class SwipeSerializer(serializers.Serializer):
+    to_user = serializers.IntegerField()
+    interaction_type = serializers.ChoiceField(choices=UserInteraction.INTERACTION_CHOICES)
+
+class BulkSwipeSerializer(serializers.Serializer):
+    swipes = SwipeSerializer(many=True, allow_empty=False)
+    
+    def validate_swipes(self, value):
+        if len(value) > settings.BULK_SWIPE_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f"Не больше {settings.BULK_SWIPE_MAX_ITEMS} свайпов за запрос"
+            )
+        return value
 
-class ViewHistorySerializer(serializers.ModelSerializer):
+class ViewHistorySerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     viewed_user_profile = UserProfileSerializer(source='viewed_user', read_only=True)
     
     class Meta:
         model = ViewHistory
         fields = ['id', 'viewed_user', 'viewed_user_profile', 'viewed_at']
+        list_serializer_class = ProfilePrefetchListSerializer
+        expandable = {'viewed_user_profile': ['viewed_user']}
 
-class MatchSerializer(serializers.ModelSerializer):
+class MatchSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     other_user = serializers.SerializerMethodField()
     
     class Meta:
         model = Match
         fields = ['id', 'user1', 'user2', 'other_user', 'created_at', 'is_active']
+        list_serializer_class = ProfilePrefetchListSerializer
+        expandable = {'other_user': ['user1', 'user2']}
     
     def get_other_user(self, obj):
         request = self.context.get('request')
         if request and request.user:
-            other_user = obj.user2 if obj.user1 == request.user else obj.user1
-            return UserProfileSerializer(other_user).data
+            other_user = obj.user2 if obj.user1_id == request.user.pk else obj.user1
+            return UserProfileSerializer(other_user, context=self.context).data
         return None
 
-class DateInvitationSerializer(serializers.ModelSerializer):
+class DateInvitationSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     from_user_profile = UserProfileSerializer(source='from_user', read_only=True)
     to_user_profile = UserProfileSerializer(source='to_user', read_only=True)
     
@@ -80,10 +178,25 @@ class DateInvitationSerializer(serializers.ModelSerializer):
         fields = ['id', 'match', 'from_user', 'from_user_profile', 'to_user', 'to_user_profile',
                  'message', 'proposed_date', 'status', 'created_at']
         read_only_fields = ['from_user', 'created_at']
+        list_serializer_class = ProfilePrefetchListSerializer
+        expandable = {'from_user_profile': ['from_user'], 'to_user_profile': ['to_user']}
 
-class UserLikeHistorySerializer(serializers.ModelSerializer):
+class UserLikeHistorySerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     liked_by_profile = UserProfileSerializer(source='liked_by', read_only=True)
     
     class Meta:
         model = UserLikeHistory
-        fields = ['id', 'liked_by', 'liked_by_profile', 'created_at']
\ No newline at end of file
+        fields = ['id', 'liked_by', 'liked_by_profile', 'created_at']
+        list_serializer_class = ProfilePrefetchListSerializer
+        expandable = {'liked_by_profile': ['liked_by']}
+
+class InteractionLikeHistorySerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    """Ответ like-history в прежнем формате по лайкам из UserInteraction"""
+    liked_by = serializers.PrimaryKeyRelatedField(source='from_user', read_only=True)
+    liked_by_profile = UserProfileSerializer(source='from_user', read_only=True)
+    
+    class Meta:
+        model = UserInteraction
+        fields = ['id', 'liked_by', 'liked_by_profile', 'created_at']
+        list_serializer_class = ProfilePrefetchListSerializer
+        expandable = {'liked_by_profile': ['from_user']}
\ No newline at end of file
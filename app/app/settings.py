@@ -27,6 +27,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.instrumentation.RequestInstrumentationMiddleware',
+    'app.replicas.ReplicaStickinessMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -66,6 +68,12 @@ if os.environ.get('DOCKER_CONTAINER'):
             'PORT': '5432',
         }
     }
+    if config('DB_REPLICA_HOST', default=''):
+        DATABASES['replica'] = dict(
+            DATABASES['default'],
+            HOST=config('DB_REPLICA_HOST'),
+            PORT=config('DB_REPLICA_PORT', default='5432'),
+        )
 else:
     DATABASES = {
         'default': {
@@ -73,10 +81,55 @@ else:
             'NAME': BASE_DIR / 'db.sqlite3',
         }
     }
+    # Для проверки маршрутизации локально подойдет копия db.sqlite3
+    if config('DB_REPLICA_NAME', default=''):
+        DATABASES['replica'] = dict(DATABASES['default'], NAME=config('DB_REPLICA_NAME'))
+
+# Постоянные соединения с проверкой перед повторным использованием.
+# Под ASGI соединения не переиспользуются между запросами, там нужен пулер (PgBouncer)
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=60, cast=int)
+    database['CONN_HEALTH_CHECKS'] = True
+
+# Чтение истории, матчей и списка пользователей идет в реплику (если она задана);
+# после записи пользователь STICKY_SECONDS читает с основной БД
+DATABASE_ROUTERS = ['app.replicas.ReplicaRouter']
+DATABASE_REPLICA = {
+    'ALIAS': 'replica' if 'replica' in DATABASES else None,
+    'STICKY_SECONDS': config('DB_REPLICA_STICKY_SECONDS', default=5, cast=int),
+}
+if 'replica' in DATABASES:
+    # В тестах реплика - та же тестовая база
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+# Локальный кеш процесса по умолчанию; при REDIS_URL - общий кеш для всех воркеров
+if config('REDIS_URL', default=''):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 50000},
+        }
+    }
+
+PROFILE_CACHE_TTL = 3600
+
+# Списки истории просмотров, лайков и свайпов читаются через values() без моделей
+FAST_LIST_SERIALIZATION = config('FAST_LIST_SERIALIZATION', default=True, cast=bool)
+
+# Дублирующая запись лайков в UserLikeHistory. Входящие лайки отдает likes-me из
+# UserInteraction; после выключения like-history тоже читает UserInteraction
+LIKE_HISTORY_WRITES = config('LIKE_HISTORY_WRITES', default=True, cast=bool)
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'app.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -102,4 +155,132 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
 }
 
-AUTH_USER_MODEL = 'app.User'
\ No newline at end of file
+# Пользователь из JWT кешируется в процессе, чтобы не читать его из БД на каждый запрос
+AUTH_USER_CACHE = {
+    'TTL': config('AUTH_USER_CACHE_TTL', default=60, cast=int),
+    'MAX_ENTRIES': 10000,
+}
+
+AUTH_USER_MODEL = 'app.User'
+
+DECK_PAGE_SIZE = 20
+DECK_MAX_PAGE_SIZE = 50
+DECK_QUEUE_SIZE = 200
+DECK_QUEUE_TTL = 300
+
+# Индекс совместимости по увлечениям пересобирается из БД раз в TTL секунд
+COMPATIBILITY_INDEX_TTL = 600
+# Сколько лучших кандидатов из индекса проверяется фильтром, дальше колода добирается случайными
+COMPATIBILITY_SCAN_LIMIT = 20000
+# random_profile с сортировкой выбирает случайный профиль из стольких лучших
+RANKED_TOP_K = 50
+
+# События для клиентов (SSE /api/fast/events/). Для нескольких процессов
+# или узлов - EVENTS_BROKER=app.events.RedisBroker и REDIS_URL
+EVENTS = {
+    'BROKER': config('EVENTS_BROKER', default='app.events.InMemoryBroker'),
+    'REDIS_URL': config('REDIS_URL', default=''),
+    'HISTORY': 100,
+    # Секунды, сколько история пользователя ждет переподключения клиента
+    'HISTORY_TTL': 3600,
+    'HEARTBEAT': 15,
+    'RETRY_MS': 3000,
+}
+
+# Офлайн-рекомендации (build_recommendations)
+RECOMMENDER = {
+    'TOP_K': 100,
+    # Похожих профилей на каждый лайкнутый
+    'NEIGHBORS': 50,
+    'MAX_ITEM_LIKERS': 5000,
+    'CHUNK_SIZE': 1000,
+    # Метка сдвигается только по взаимодействиям старше стольких секунд (как ENGAGEMENT_ROLLUP_LAG)
+    'LAG': 60,
+}
+
+BULK_SWIPE_MAX_ITEMS = 500
+
+# Дневные агрегаты активности (manage.py rollup_engagement) и окно users/me/stats
+ENGAGEMENT_ROLLUP_CHUNK = 10000
+# Строки моложе стольких секунд ждут следующего запуска: больше самой долгой пишущей
+# транзакции и задержки буфера просмотров (VIEW_HISTORY_BUFFER['FLUSH_INTERVAL'])
+ENGAGEMENT_ROLLUP_LAG = 60
+ENGAGEMENT_STATS_DAYS = 30
+ENGAGEMENT_STATS_MAX_DAYS = 365
+
+# Строк на одну выборку серверного курсора и на один кусок потока выгрузки (users/me/export)
+EXPORT_CHUNK_SIZE = 2000
+
+# Срок хранения истории в месяцах, не считая текущего (manage.py prune_history).
+# На PostgreSQL история разбита на помесячные секции, они создаются на
+# PARTITIONS_AHEAD месяцев вперед: строка вне существующих секций не вставится
+HISTORY_RETENTION = {
+    'VIEW_HISTORY_MONTHS': config('VIEW_HISTORY_RETENTION_MONTHS', default=6, cast=int),
+    'LIKE_HISTORY_MONTHS': config('LIKE_HISTORY_RETENTION_MONTHS', default=12, cast=int),
+    'PARTITIONS_AHEAD': 3,
+}
+
+LIKE_COUNTER_SHARDS = 16
+LIKE_COUNTER_FLUSH_BATCH = 1000
+
+VIEW_HISTORY_BUFFER = {
+    'ENABLED': config('VIEW_HISTORY_BUFFER_ENABLED', default=True, cast=bool),
+    'MAX_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+}
+
+PHOTO_PROCESSING_ASYNC = config('PHOTO_PROCESSING_ASYNC', default=True, cast=bool)
+PHOTO_PROCESSING_WORKERS = 4
+PHOTO_RENDITIONS = {
+    'thumbnail': (160, 160),
+    'medium': (640, 640),
+}
+PHOTO_RENDITION_QUALITY = 85
+
+INSTRUMENTATION = {
+    'SLOW_REQUEST_MS': config('SLOW_REQUEST_MS', default=500, cast=int),
+    'N_PLUS_ONE_THRESHOLD': 5,
+}
+
+# Медленные запросы пишутся в ротируемый файл (каталог создается при первой записи);
+# SLOW_REQUEST_LOG_FILE=- оставляет их в stdout
+SLOW_REQUEST_LOG_FILE = config('SLOW_REQUEST_LOG_FILE', default=str(BASE_DIR / 'logs' / 'slow_requests.log'))
+
+if SLOW_REQUEST_LOG_FILE not in ('', '-'):
+    SLOW_REQUEST_HANDLER = {
+        'class': 'app.instrumentation.RotatingFileHandler',
+        'filename': SLOW_REQUEST_LOG_FILE,
+        'maxBytes': 10 * 1024 * 1024,
+        'backupCount': 5,
+        'delay': True,
+    }
+else:
+    SLOW_REQUEST_HANDLER = {
+        'class': 'logging.StreamHandler',
+        'stream': 'ext://sys.stdout',
+    }
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+        'slow_requests': SLOW_REQUEST_HANDLER,
+    },
+    'loggers': {
+        'app.requests': {
+            'handlers': ['console'],
+            # INFO - строка на каждый запрос (с состоянием буфера просмотров), WARNING - только N+1
+            'level': config('REQUEST_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+        'app.slow_requests': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,16 @@
+"""Настройки для тестов: python manage.py test --settings=app.settings_test"""
+from .settings import *  # noqa: F401,F403
+
+# Зеркало основной тестовой базы для тестов маршрутизации в реплику.
+# DATABASE_REPLICA['ALIAS'] не меняется: чтение в реплику включают только эти тесты
+if 'replica' not in DATABASES:
+    DATABASES = {**DATABASES, 'replica': dict(DATABASES['default'], TEST={'MIRROR': 'default'})}
+
+# Без строки JSON на каждый запрос в выводе тестов; предупреждения о N+1 остаются
+LOGGING = {
+    **LOGGING,
+    'loggers': {
+        **LOGGING['loggers'],
+        'app.requests': {**LOGGING['loggers']['app.requests'], 'level': 'WARNING'},
+    },
+}
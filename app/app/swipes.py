@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from rest_framework import status
+
+from .counters import increment_likes
+from .events import publish_matches
+from .models import User, UserInteraction, UserLikeHistory, Match, MatchParticipant
+
+
+def register_likes(from_user, to_user_ids):
+    """Побочные эффекты новых лайков: счетчики, история лайков и матчи.
+
+    Работает пачкой: одно обновление шардов счетчика, одна вставка истории
+    (если LIKE_HISTORY_WRITES) и один запрос на встречные лайки, сколько бы
+    лайков ни пришло. Пары, у которых матч уже есть (взаимодействие
+    удалили и лайкнули снова) или появился параллельно, пропускаются.
+    Возвращает словарь {id пользователя: новый Match}.
+    """
+    if not to_user_ids:
+        return {}
+
+    increment_likes(to_user_ids)
+
+    if settings.LIKE_HISTORY_WRITES:
+        UserLikeHistory.objects.bulk_create([
+            UserLikeHistory(user_id=to_user_id, liked_by=from_user) for to_user_id in to_user_ids
+        ])
+
+    mutual = set(UserInteraction.objects.filter(
+        from_user_id__in=to_user_ids,
+        to_user=from_user,
+        interaction_type='like'
+    ).values_list('from_user_id', flat=True))
+    if not mutual:
+        return {}
+
+    stored = _stored_matches(from_user, mutual)
+    matches = {
+        to_user_id: Match.between(from_user.pk, to_user_id)
+        for to_user_id in to_user_ids if to_user_id in mutual and to_user_id not in stored
+    }
+    if not matches:
+        return {}
+
+    Match.objects.bulk_create(matches.values(), ignore_conflicts=True)
+    stored = _stored_matches(from_user, matches)
+    for to_user_id, match in list(matches.items()):
+        pk, created_at = stored[to_user_id]
+        # Свой матч узнается по created_at, который auto_now_add проставил при bulk_create
+        if created_at != match.created_at:
+            del matches[to_user_id]
+        else:
+            match.pk = pk
+    if not matches:
+        return {}
+
+    MatchParticipant.objects.bulk_create(MatchParticipant.for_matches(matches.values()))
+    publish_matches(matches.values())
+    return matches
+
+
+def _stored_matches(from_user, other_user_ids):
+    """Сохраненные матчи пользователя с other_user_ids: {id второго участника: (pk, created_at)}"""
+    rows = Match.objects.filter(
+        Q(user1=from_user, user2_id__in=other_user_ids) | Q(user2=from_user, user1_id__in=other_user_ids)
+    ).values_list('pk', 'user1_id', 'user2_id', 'created_at')
+    return {
+        user2_id if user1_id == from_user.pk else user1_id: (pk, created_at)
+        for pk, user1_id, user2_id, created_at in rows
+    }
+
+
+def _lost_to_concurrent(from_user, interactions):
+    """to_user свайпов, которые ignore_conflicts пропустил из-за параллельной вставки.
+
+    Своя строка узнается по типу и created_at, который auto_now_add
+    проставил объекту при bulk_create.
+    """
+    if not interactions:
+        return set()
+    stored = dict((to_user_id, row) for to_user_id, *row in UserInteraction.objects.filter(
+        from_user=from_user,
+        to_user_id__in=[interaction.to_user_id for interaction in interactions]
+    ).values_list('to_user_id', 'interaction_type', 'created_at'))
+    return {
+        interaction.to_user_id for interaction in interactions
+        if stored.get(interaction.to_user_id) != [interaction.interaction_type, interaction.created_at]
+    }
+
+
+def record_swipes(from_user, swipes):
+    """Сохранить пачку свайпов в одной транзакции.
+
+    swipes - список пар (to_user_id, interaction_type) в порядке поступления.
+    Возвращает результат по каждому элементу.
+    """
+    to_user_ids = {to_user_id for to_user_id, _ in swipes}
+    with transaction.atomic():
+        known = set(User.objects.filter(pk__in=to_user_ids).values_list('pk', flat=True))
+        existing = set(UserInteraction.objects.filter(
+            from_user=from_user,
+            to_user_id__in=to_user_ids
+        ).values_list('to_user_id', flat=True))
+
+        results = []
+        interactions = []
+        for to_user_id, interaction_type in swipes:
+            result = {'to_user': to_user_id, 'interaction_type': interaction_type, 'match': None}
+            if to_user_id == from_user.pk or to_user_id not in known:
+                result['status'] = 'invalid'
+            elif to_user_id in existing:
+                result['status'] = 'duplicate'
+            else:
+                result['status'] = 'created'
+                existing.add(to_user_id)
+                interactions.append(UserInteraction(
+                    from_user=from_user,
+                    to_user_id=to_user_id,
+                    interaction_type=interaction_type
+                ))
+            results.append(result)
+
+        UserInteraction.objects.bulk_create(interactions, ignore_conflicts=True)
+        lost = _lost_to_concurrent(from_user, interactions)
+        for result in results:
+            if result['status'] == 'created' and result['to_user'] in lost:
+                result['status'] = 'duplicate'
+        matches = register_likes(from_user, [
+            interaction.to_user_id for interaction in interactions
+            if interaction.interaction_type == 'like' and interaction.to_user_id not in lost
+        ])
+
+    for result in results:
+        if result['status'] == 'created' and result['to_user'] in matches:
+            result['match'] = matches[result['to_user']].pk
+    return results
+
+
+def record_swipe(from_user, to_user_id, interaction_type):
+    """Один свайп через record_swipes: результат и HTTP-код, общие для синхронного и асинхронного API"""
+    [result] = record_swipes(from_user, [(to_user_id, interaction_type)])
+    code = status.HTTP_201_CREATED if result['status'] == 'created' else status.HTTP_400_BAD_REQUEST
+    return result, code
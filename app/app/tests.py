@@ -1,11 +1,61 @@
-from django.test import TestCase
+import importlib
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+import numpy as np
+from PIL import Image
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 from rest_framework import status
-from .models import User, UserInteraction, Match
+from rest_framework_simplejwt.tokens import RefreshToken
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .models import (
+    User, UserPhoto, UserInteraction, Match, ViewHistory, LikeCounterShard, DateInvitation, Recommendation,
+    UserLikeHistory, DailyEngagement, MatchParticipant
+)
+from .counters import increment_likes, flush_likes
+from .engagement import rollup
+from . import events, settings as base_settings
+from .compatibility import HobbyIndex, build_index, reset_index
+from .buffers import ViewHistoryBuffer
+from .management.commands.benchmark_api import DEFAULT_BUDGETS
+from .instrumentation import RequestMetrics
+from .authentication import stamp_key, user_cache
+from .checks import (
+    IN_MEMORY_BROKER, REDIS_BROKER, REDIS_CACHE, check_events_broker, check_in_memory_broker, check_redis_cache,
+    check_history_partitions, check_replica_pins
+)
+from .serializers import UserPhotoSerializer
+from . import replicas
+from .replicas import ReplicaRouter
+from .partitions import (
+    HISTORY_TABLES, create_partitions, default_name, is_partitioned, month_bound, month_start, partition_name,
+    retention_cutoff, shift_month
+)
+
+SYNC_VIEW_HISTORY = override_settings(VIEW_HISTORY_BUFFER=dict(settings.VIEW_HISTORY_BUFFER, ENABLED=False))
 
 class UserInteractionTests(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user1 = User.objects.create_user(
             email='user1@test.com',
             username='user1',
@@ -45,6 +95,9 @@ class UserInteractionTests(APITestCase):
         self.assertEqual(interaction.interaction_type, 'like')
         self.assertEqual(interaction.from_user, self.user1)
         self.assertEqual(interaction.to_user, self.user2)
+        self.assertEqual(response.data['id'], interaction.id)
+        self.assertEqual(response.data['to_user_profile']['id'], self.user2.id)
+        self.assertIn('created_at', response.data)
 
     def test_dislike_user(self):
         url = reverse('interaction-list')
@@ -92,8 +145,122 @@ class UserInteractionTests(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_bulk_swipes(self):
+        user3 = User.objects.create_user(
+            email='user3@test.com',
+            username='user3',
+            password='password123',
+            first_name='Ann',
+            last_name='Doe',
+            gender='F',
+            age=24,
+            city='Moscow'
+        )
+        UserInteraction.objects.create(from_user=self.user2, to_user=self.user1, interaction_type='like')
+        UserInteraction.objects.create(from_user=self.user1, to_user=user3, interaction_type='dislike')
+        
+        url = reverse('interaction-bulk')
+        data = {'swipes': [
+            {'to_user': self.user2.id, 'interaction_type': 'like'},
+            {'to_user': user3.id, 'interaction_type': 'like'},
+            {'to_user': self.user1.id, 'interaction_type': 'like'},
+            {'to_user': 999999, 'interaction_type': 'dislike'},
+        ]}
+        
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'duplicate', 'invalid', 'invalid'])
+        
+        match = Match.objects.get(pk=results[0]['match'])
+        self.assertEqual({match.user1_id, match.user2_id}, {self.user1.id, self.user2.id})
+        flush_likes()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.likes_count, 1)
+        self.assertEqual(UserInteraction.objects.filter(from_user=self.user1).count(), 2)
+
+    def test_bulk_swipe_lost_to_concurrent_insert_is_not_counted(self):
+        bulk_create = UserInteraction.objects.bulk_create
+
+        def concurrent(objs, **kwargs):
+            # Параллельный запрос успел записать тот же лайк раньше
+            UserInteraction.objects.create(from_user=self.user1, to_user=self.user2, interaction_type='like')
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(UserInteraction.objects, 'bulk_create', side_effect=concurrent):
+            response = self.client.post(reverse('interaction-bulk'), {'swipes': [
+                {'to_user': self.user2.id, 'interaction_type': 'like'},
+            ]}, format='json')
+        self.assertEqual(response.data['results'][0]['status'], 'duplicate')
+        flush_likes()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.likes_count, 0)
+
+    def test_like_again_after_deleting_interaction_keeps_one_match(self):
+        UserInteraction.objects.create(from_user=self.user2, to_user=self.user1, interaction_type='like')
+        url = reverse('interaction-list')
+        response = self.client.post(url, {'to_user': self.user2.id, 'interaction_type': 'like'})
+        match = Match.objects.get()
+        
+        self.client.delete(reverse('interaction-detail', args=[response.data['id']]))
+        with mock.patch('app.swipes.publish_matches') as publish:
+            response = self.client.post(url, {'to_user': self.user2.id, 'interaction_type': 'like'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(Match.objects.all()), [match])
+        self.assertEqual(match.participants.count(), 2)
+        publish.assert_not_called()
+
+    def test_migration_merges_reversed_duplicate_matches(self):
+        from django.apps import apps
+        migration = importlib.import_module('app.migrations.0005_match_participants')
+        first = Match.objects.create(user1=self.user1, user2=self.user2, is_active=False)
+        Match.objects.filter(pk=first.pk).update(user1=self.user2, user2=self.user1)
+        second = Match.objects.create(user1=self.user1, user2=self.user2)
+        invitation = DateInvitation.objects.create(match=second, from_user=self.user1, to_user=self.user2)
+        
+        migration.canonicalize_matches(apps, None)
+        match = Match.objects.get()
+        self.assertEqual((match.pk, match.user1_id, match.user2_id), (first.pk, self.user1.id, self.user2.id))
+        self.assertTrue(match.is_active)
+        invitation.refresh_from_db()
+        self.assertEqual(invitation.match_id, first.pk)
+
+    def test_likes_count_is_sharded_and_flushed(self):
+        for _ in range(40):
+            increment_likes([self.user2.id])
+        increment_likes([self.user1.id, self.user2.id], amount=2)
+        
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.likes_count, 0)
+        self.assertGreater(LikeCounterShard.objects.filter(user=self.user2).count(), 1)
+        
+        while flush_likes(batch_size=3):
+            pass
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.likes_count, 2)
+        self.assertEqual(self.user2.likes_count, 42)
+
+    def test_matches_and_invitations_use_participants(self):
+        match = Match.objects.create(user1=self.user2, user2=self.user1)
+        self.assertEqual((match.user1_id, match.user2_id), (self.user1.id, self.user2.id))
+        self.assertEqual(match.participants.count(), 2)
+        DateInvitation.objects.create(match=match, from_user=self.user2, to_user=self.user1)
+        
+        response = self.client.get(reverse('match-list'))
+        self.assertEqual([m['id'] for m in response.data['results']], [match.id])
+        self.assertEqual(response.data['results'][0]['other_user']['id'], self.user2.id)
+        response = self.client.get(reverse('date-invitation-list'))
+        self.assertEqual(len(response.data['results']), 1)
+        
+        match.is_active = False
+        match.save()
+        response = self.client.get(reverse('match-list'))
+        self.assertEqual(response.data['results'], [])
+
 class UserProfileTests(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(
             email='test@test.com',
             username='testuser',
@@ -112,4 +279,1209 @@ class UserProfileTests(APITestCase):
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['email'], 'test@test.com')
-        self.assertEqual(response.data['first_name'], 'Test')
\ No newline at end of file
+        self.assertEqual(response.data['first_name'], 'Test')
+
+    def test_user_detail_etag(self):
+        url = reverse('user-detail', args=[self.user.id])
+        etag = self.client.get(url)['ETag']
+        
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        for header in [f'"other", W/{etag}', '*']:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=header)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, header)
+        # Совпадает только тег целиком, а не подстрока заголовка
+        for header in [f'"1{etag[1:]}', f'"0{etag}"', f'{etag[:-1]}0"']:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=header)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, header)
+        
+        self.user.city = 'Kazan'
+        self.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['city'], 'Kazan')
+        self.assertNotEqual(response['ETag'], etag)
+
+@SYNC_VIEW_HISTORY
+class RandomProfileTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='viewer@test.com',
+            username='viewer',
+            password='password123',
+            first_name='View',
+            last_name='Er',
+            gender='M',
+            age=30,
+            city='Moscow'
+        )
+        self.candidates = [
+            User.objects.create_user(
+                email=f'candidate{i}@test.com',
+                username=f'candidate{i}',
+                password='password123',
+                first_name='Candidate',
+                last_name=str(i),
+                gender='F',
+                age=20 + i,
+                city='Moscow' if i % 2 else 'Kazan'
+            )
+            for i in range(6)
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def test_random_profile_respects_filters(self):
+        url = reverse('user-random-profile')
+        for _ in range(10):
+            response = self.client.get(url, {'city': 'moscow', 'age_min': 22})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['city'], 'Moscow')
+            self.assertGreaterEqual(response.data['age'], 22)
+            self.assertNotEqual(response.data['id'], self.user.id)
+
+    def test_random_profile_not_found(self):
+        url = reverse('user-random-profile')
+        response = self.client.get(url, {'city': 'Omsk'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_city_filter_is_case_insensitive(self):
+        response = self.client.get(reverse('user-list'), {'city': ' KAZAN ', 'age_min': 21})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = {item['id'] for item in response.data['results']}
+        self.assertEqual(ids, {c.id for c in self.candidates if c.city == 'Kazan' and c.age >= 21})
+
+    def test_profile_filters_use_indexes(self):
+        querysets = [
+            User.objects.filter(city_key='moscow', gender='F', age__gte=22, age__lte=30),
+            User.objects.filter(gender='F', age__gte=22, age__lte=30),
+            User.objects.filter(city_key='moscow'),
+        ]
+        if connection.vendor == 'postgresql':
+            # На таблице из десятка строк seq scan дешевле любого индекса
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        for queryset in querysets:
+            plan = queryset.explain()
+            self.assertIn('index', plan.lower())
+            self.assertNotRegex(plan, r'SCAN app_user(?! USING)')
+
+    def test_sampler_covers_all_matches(self):
+        from .sampling import sample_pk
+        queryset = User.objects.filter(city='Moscow', gender='F')
+        expected = set(queryset.values_list('pk', flat=True))
+        seen = {sample_pk(queryset) for _ in range(200)}
+        self.assertEqual(seen, expected)
+
+    def test_sampler_is_uniform_over_gaps(self):
+        from .sampling import sample_pk
+        # Три совпадения, последнее - после большого разрыва в pk: пробы почти всегда промахиваются
+        User.objects.bulk_create([
+            User(email=f'gap{i}@test.com', username=f'gap{i}', gender='M', age=40, city='Omsk')
+            for i in range(200)
+        ])
+        gap = list(User.objects.filter(city='Omsk').order_by('pk').values_list('pk', flat=True))
+        User.objects.filter(pk__in=[gap[0], gap[1], gap[-1]]).update(city='Tver')
+        queryset = User.objects.filter(city='Tver')
+        rng = random.Random(1)
+        counts = Counter(sample_pk(queryset, probes=1, rng=rng) for _ in range(900))
+        self.assertEqual(set(counts), {gap[0], gap[1], gap[-1]})
+        for pk in counts:
+            self.assertTrue(240 <= counts[pk] <= 360, counts)
+        
+        # Все раунды промахнулись: строка по случайному OFFSET, частоты те же
+        with CaptureQueriesContext(connection) as queries:
+            counts = Counter(sample_pk(queryset, probes=0, rng=rng) for _ in range(900))
+        self.assertTrue([query for query in queries if 'OFFSET' in query['sql']])
+        self.assertEqual(set(counts), {gap[0], gap[1], gap[-1]})
+        for pk in counts:
+            self.assertTrue(240 <= counts[pk] <= 360, counts)
+
+    def test_view_history_buffer_flushes_in_batches(self):
+        buffer = ViewHistoryBuffer(max_size=4, batch_size=3, autostart=False)
+        for candidate in self.candidates[:5]:
+            buffer.record(self.user.id, candidate.id)
+        
+        self.assertEqual(buffer.stats(), {'depth': 4, 'dropped': 1, 'flushed': 0})
+        self.assertEqual(ViewHistory.objects.count(), 0)
+        
+        with self.assertNumQueries(2):
+            self.assertEqual(buffer.flush(), 4)
+        self.assertEqual(buffer.stats(), {'depth': 0, 'dropped': 1, 'flushed': 4})
+        self.assertEqual(ViewHistory.objects.filter(viewer=self.user).count(), 4)
+        
+        with self.assertLogs('app.buffers', 'WARNING'):
+            self.assertEqual(buffer.report_drops(), 1)
+        self.assertEqual(buffer.report_drops(), 0)
+        with mock.patch('app.buffers._buffer', buffer), self.assertLogs('app.requests', 'INFO') as logs:
+            self.client.get(reverse('user-list'))
+        self.assertEqual(json.loads(logs.records[-1].getMessage())['view_buffer'], buffer.stats())
+
+    def test_deck_excludes_interacted_and_paginates(self):
+        UserInteraction.objects.create(
+            from_user=self.user,
+            to_user=self.candidates[0],
+            interaction_type='dislike'
+        )
+        url = reverse('user-deck')
+        response = self.client.get(url, {'size': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first_ids = [profile['id'] for profile in response.data['results']]
+        self.assertEqual(len(first_ids), 3)
+        
+        response = self.client.get(url, {'size': 3, 'cursor': response.data['next']})
+        second_ids = [profile['id'] for profile in response.data['results']]
+        
+        served = first_ids + second_ids
+        self.assertEqual(sorted(served), sorted(c.id for c in self.candidates[1:]))
+        self.assertEqual(ViewHistory.objects.filter(viewer=self.user).count(), 5)
+
+    def test_hobby_index_updates_incrementally(self):
+        index = HobbyIndex()
+        index.update(1, 'Спорт, Путешествия')
+        index.update(2, 'спорт; кино')
+        index.update(3, 'Путешествия,  спорт')
+        self.assertEqual(index.ranked_related(1).tolist(), [3, 2])
+        self.assertEqual(index.ranked_related(1, limit=1).tolist(), [3])
+        # Без общих увлечений ранжировать некого, равные оценки идут в случайном порядке
+        index.update(5, 'Спорт, кино')
+        self.assertEqual(index.ranked_related(4).tolist(), [])
+        orders = {tuple(index.ranked_related(1).tolist()) for _ in range(50)}
+        self.assertEqual(orders, {(3, 2, 5), (3, 5, 2)})
+        batches = [batch.tolist() for batch in index.ranked_batches(1, 2)]
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertEqual(batches[0][0], 3)
+        index.remove(5)
+        self.assertEqual(list(index.scores(1, [2, 3, 4])), [1 / 3, 1.0, 0.0])
+        
+        index.update(3, 'Шахматы')
+        index.remove(2)
+        self.assertEqual(list(index.scores(1, [2, 3])), [0.0, 0.0])
+        self.assertEqual(index.postings[index.vocabulary['спорт']], {1})
+
+    def test_deck_sorted_by_compatibility(self):
+        hobbies = ['кино', 'спорт, кино', 'спорт', 'спорт, путешествия', 'чтение', '']
+        for candidate, text in zip(self.candidates, hobbies):
+            candidate.hobbies = text
+            candidate.save()
+        self.user.hobbies = 'Спорт, Путешествия'
+        self.user.save()
+        
+        # Пока индекс не собран, запрос его не ждет: сборка уходит в фон, колода случайная
+        reset_index()
+        with mock.patch('app.compatibility.start_build') as start_build:
+            response = self.client.get(reverse('user-deck'), {'size': 3, 'sort': 'compatibility'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 3)
+        start_build.assert_called_once()
+        
+        build_index()
+        response = self.client.get(reverse('user-deck'), {'size': 3, 'sort': 'compatibility'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [profile['id'] for profile in response.data['results']]
+        self.assertEqual(ids, [self.candidates[3].id, self.candidates[2].id, self.candidates[1].id])
+
+    def test_forked_process_gets_free_build_lock(self):
+        from . import compatibility
+        held = compatibility._build_lock
+        self.assertTrue(held.acquire(blocking=False))
+        try:
+            compatibility._after_fork()
+            self.assertFalse(compatibility._build_lock.locked())
+        finally:
+            held.release()
+        
+        response = self.client.get(reverse('user-random-profile'), {'sort': 'compatibility', 'city': 'kazan'})
+        self.assertIn(response.data['id'], {c.id for c in self.candidates if c.city == 'Kazan'})
+
+
+class ListQueryCountTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='owner@test.com',
+            username='owner',
+            password='password123',
+            first_name='Own',
+            last_name='Er',
+            gender='M',
+            age=30,
+            city='Moscow'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.created = 0
+
+    def _make_viewed_users(self, count):
+        for _ in range(count):
+            self.created += 1
+            i = self.created
+            other = User.objects.create_user(
+                email=f'viewed{i}@test.com',
+                username=f'viewed{i}',
+                password='password123',
+                first_name='Viewed',
+                last_name=str(i),
+                gender='F',
+                age=25,
+                city='Moscow'
+            )
+            UserPhoto.objects.create(user=other, photo='user_photos/main.jpg', is_main=True)
+            UserPhoto.objects.create(user=other, photo='user_photos/other.jpg')
+            ViewHistory.objects.create(viewer=self.user, viewed_user=other)
+            UserInteraction.objects.create(from_user=self.user, to_user=other, interaction_type='like')
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        for name in ['view-history-list', 'interaction-list']:
+            self._make_viewed_users(2)
+            small, _ = self._count_queries(reverse(name))
+            self._make_viewed_users(5)
+            large, response = self._count_queries(reverse(name))
+            self.assertEqual(small, large, name)
+            ViewHistory.objects.all().delete()
+            UserInteraction.objects.all().delete()
+
+    def test_main_photo_uses_prefetched_photos(self):
+        self._make_viewed_users(1)
+        _, response = self._count_queries(reverse('view-history-list'))
+        profile = response.data['results'][0]['viewed_user_profile']
+        self.assertTrue(profile['main_photo']['is_main'])
+        self.assertEqual(len(profile['photos']), 2)
+
+    def test_instrumentation_reports_timings_and_n_plus_one(self):
+        self._make_viewed_users(3)
+        # assertLogs сам понижает уровень, поэтому строка на запрос проверяется по основным
+        # настройкам (settings_test понижает ее до WARNING только для тестов)
+        self.assertEqual(base_settings.LOGGING['loggers']['app.requests']['level'], 'INFO')
+        with self.assertLogs('app.requests', 'INFO') as logs:
+            response = self.client.get(reverse('view-history-list'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('ser;dur=', response['Server-Timing'])
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertNotIn('n_plus_one', record)
+        
+        metrics = RequestMetrics()
+        execute = lambda sql, params, many, context: None
+        for user_id in range(settings.INSTRUMENTATION['N_PLUS_ONE_THRESHOLD']):
+            metrics.wrap_query(execute, 'SELECT * FROM app_userphoto WHERE user_id IN (%s, %s)', [user_id, 0], False, {})
+        metrics.wrap_query(execute, 'SELECT * FROM app_userphoto WHERE user_id IN (%s)', [1], False, {})
+        self.assertEqual(list(metrics.n_plus_one_suspects().values()), [settings.INSTRUMENTATION['N_PLUS_ONE_THRESHOLD']])
+
+    def test_profile_cache_is_filled_per_page_and_invalidated(self):
+        self._make_viewed_users(3)
+        url = reverse('view-history-list')
+        cold, first = self._count_queries(url)
+        warm, second = self._count_queries(url)
+        # С теплым кешем не загружаются ни пользователи, ни их фото
+        self.assertEqual(warm, cold - 2)
+        self.assertEqual(first.data['results'], second.data['results'])
+        
+        viewed = ViewHistory.objects.order_by('-viewed_at', '-id').first().viewed_user
+        viewed.first_name = 'Renamed'
+        viewed.save()
+        UserPhoto.objects.create(user=viewed, photo='user_photos/new.jpg')
+        _, response = self._count_queries(url)
+        profile = response.data['results'][0]['viewed_user_profile']
+        self.assertEqual(profile['first_name'], 'Renamed')
+        self.assertEqual(len(profile['photos']), 3)
+        
+        viewed.photos.first().delete()
+        _, response = self._count_queries(url)
+        self.assertEqual(len(response.data['results'][0]['viewed_user_profile']['photos']), 2)
+
+    def test_keyset_pagination_walks_all_rows(self):
+        self._make_viewed_users(5)
+        same_time = timezone.now()
+        ViewHistory.objects.filter(pk__in=ViewHistory.objects.order_by('pk')[:3].values('pk'))\
+            .update(viewed_at=same_time)
+        expected = list(ViewHistory.objects.order_by('-viewed_at', '-id').values_list('id', flat=True))
+        
+        url = reverse('view-history-list') + '?page_size=2'
+        served = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            served += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(served, expected)
+        
+        response = self.client.get(reverse('view-history-list'), {'count': 'true'})
+        self.assertEqual(response.data['count'], 5)
+        
+        response = self.client.get(reverse('view-history-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_fast_list_matches_serializer_output(self):
+        self._make_viewed_users(3)
+        UserLikeHistory.objects.create(user=self.user, liked_by=User.objects.exclude(pk=self.user.pk).first())
+        for name in ['view-history-list', 'interaction-list', 'like-history-list']:
+            for params in [{}, {'page_size': 2}, {'fields': 'id,viewed_at,created_at'}, {'expand': ''}]:
+                with override_settings(FAST_LIST_SERIALIZATION=False):
+                    expected = self.client.get(reverse(name), params).json()
+                fast = self.client.get(reverse(name), params).json()
+                self.assertEqual(fast, expected, (name, params))
+    
+    def test_sparse_fields_and_expand(self):
+        self._make_viewed_users(1)
+        response = self.client.get(reverse('view-history-list'), {'fields': 'id,viewed_user_profile'})
+        self.assertEqual(list(response.data['results'][0]), ['id', 'viewed_user_profile'])
+        response = self.client.get(reverse('interaction-list'), {'expand': ''})
+        self.assertEqual(list(response.data['results'][0]), ['id', 'to_user', 'interaction_type', 'created_at'])
+        
+        # Урезанный профиль не попадает в кеш вместо полного
+        viewed = ViewHistory.objects.get().viewed_user
+        response = self.client.get(reverse('user-detail', args=[viewed.pk]), {'fields': 'id,first_name'})
+        self.assertEqual(response.data, {'id': viewed.pk, 'first_name': 'Viewed'})
+        response = self.client.get(reverse('user-detail', args=[viewed.pk]))
+        self.assertIn('photos', response.data)
+
+
+class AuthUserCacheTests(APITestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(
+            email='auth@test.com',
+            username='auth',
+            password='password123',
+            first_name='Auth',
+            last_name='User',
+            gender='M',
+            age=30,
+            city='Moscow'
+        )
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def _get(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('match-list'))
+        return response, [query['sql'] for query in queries if 'FROM "app_user"' in query['sql']]
+
+    def test_user_is_loaded_once_and_invalidated_on_changes(self):
+        response, user_queries = self._get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(user_queries), 1)
+        response, user_queries = self._get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(user_queries, [])
+        
+        self.user.set_password('another-password123')
+        self.user.save()
+        self.assertIsNone(user_cache.get(self.user.pk))
+        _, user_queries = self._get()
+        self.assertEqual(len(user_queries), 1)
+        
+        self.user.is_active = False
+        self.user.save()
+        response, _ = self._get()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_bulk_deactivation_is_not_served_from_cache(self):
+        self._get()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response, _ = self._get()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_change_in_another_process_rejects_entry(self):
+        self._get()
+        # Другой процесс сохранил пользователя: его сигнал удаляет только метку в общем кеше
+        cache.delete(stamp_key(self.user.pk))
+        _, user_queries = self._get()
+        self.assertEqual(len(user_queries), 1)
+        _, user_queries = self._get()
+        self.assertEqual(user_queries, [])
+
+    @override_settings(AUTH_USER_CACHE=dict(settings.AUTH_USER_CACHE, TTL=0))
+    def test_cache_can_be_disabled(self):
+        self._get()
+        _, user_queries = self._get()
+        self.assertEqual(len(user_queries), 1)
+
+REPLICA = override_settings(DATABASE_REPLICA=dict(settings.DATABASE_REPLICA, ALIAS='replica'))
+
+@REPLICA
+class ReplicaRouterTests(SimpleTestCase):
+    def test_reads_go_to_replica_only_when_enabled(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(ViewHistory))
+        token = replicas._read_alias.set('replica')
+        try:
+            self.assertEqual(router.db_for_read(ViewHistory), 'replica')
+            self.assertEqual(router.db_for_write(ViewHistory), 'default')
+        finally:
+            replicas._read_alias.reset(token)
+        self.assertFalse(router.allow_migrate('replica', 'app'))
+        self.assertIsNone(router.allow_migrate('default', 'app'))
+
+    def test_replica_requires_shared_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([error.id for error in check_replica_pins(None)], ['app.E005'])
+        with override_settings(CACHES={'default': {'BACKEND': REDIS_CACHE, 'LOCATION': 'redis://localhost:6379/0'}}):
+            self.assertEqual(check_replica_pins(None), [])
+
+
+@REPLICA
+@skipUnless('replica' in settings.DATABASES, 'нужны настройки app.settings_test')
+class ReplicaStickinessTests(APITransactionTestCase):
+    # Транзакционный тест: внутри atomic роутер всегда читает из default
+    databases = {'default', 'replica'} & set(settings.DATABASES)
+
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(
+                email=f'sticky{i}@test.com',
+                username=f'sticky{i}',
+                password='password123',
+                first_name='Sticky',
+                last_name=str(i),
+                gender='MF'[i % 2],
+                age=25,
+                city='Moscow'
+            )
+            for i in range(2)
+        ]
+
+    def _list_aliases(self, url):
+        """Алиасы баз, в которых шли запросы к таблице url-списка"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        return {
+            alias for alias, context in [('default', primary), ('replica', replica)]
+            if any('app_match' in query['sql'] for query in context.captured_queries)
+        }
+
+    def test_user_is_pinned_to_primary_after_write(self):
+        Match.objects.create(user1=self.users[0], user2=self.users[1])
+        self.client.force_authenticate(user=self.users[0])
+        self.assertEqual(self._list_aliases(reverse('match-list')), {'replica'})
+        self.assertFalse(replicas.is_pinned(self.users[0].pk))
+        
+        response = self.client.post(reverse('interaction-bulk'), {
+            'swipes': [{'to_user': self.users[1].pk, 'interaction_type': 'like'}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(replicas.is_pinned(self.users[0].pk))
+        self.assertFalse(replicas.is_pinned(self.users[1].pk))
+        self.assertEqual(self._list_aliases(reverse('match-list')), {'default'})
+        
+        self.client.force_authenticate(user=self.users[1])
+        self.assertEqual(self._list_aliases(reverse('match-list')), {'replica'})
+
+
+class HistoryRetentionTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                email=f'history{i}@test.com',
+                username=f'history{i}',
+                password='password123',
+                first_name='History',
+                last_name=str(i),
+                gender='MF'[i % 2],
+                age=25,
+                city='Moscow'
+            )
+            for i in range(2)
+        ]
+
+    def test_retention_months(self):
+        self.assertEqual(shift_month(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(shift_month(date(2026, 11, 1), 3), date(2027, 2, 1))
+        now = datetime(2026, 10, 18, 12, tzinfo=dt_timezone.utc)
+        self.assertEqual(retention_cutoff('app_viewhistory', now), date(2026, 4, 1))
+        self.assertEqual(retention_cutoff('app_userlikehistory', now), date(2025, 10, 1))
+
+    def test_prune_history_deletes_expired_rows(self):
+        viewer, viewed = self.users
+        now = timezone.now()
+        for table in HISTORY_TABLES:
+            if is_partitioned(connection, table):
+                create_partitions(connection, table, month_start(now - timedelta(days=800)), month_start(now))
+        for days in [0, 20, 400, 500]:
+            ViewHistory.objects.create(viewer=viewer, viewed_user=viewed, viewed_at=now - timedelta(days=days))
+        old_like = UserLikeHistory.objects.create(user=viewed, liked_by=viewer)
+        UserLikeHistory.objects.filter(pk=old_like.pk).update(created_at=now - timedelta(days=800))
+        recent_like = UserLikeHistory.objects.create(user=viewed, liked_by=viewer)
+        if connection.vendor == 'postgresql':
+            # Секцию нельзя удалить, пока в транзакции теста ждут отложенные проверки FK
+            with connection.cursor() as cursor:
+                cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        
+        call_command('prune_history', batch_size=1, stdout=StringIO())
+        self.assertEqual(ViewHistory.objects.count(), 2)
+        self.assertEqual(list(UserLikeHistory.objects.values_list('pk', flat=True)), [recent_like.pk])
+        
+        if not is_partitioned(connection, ViewHistory._meta.db_table):
+            # Архив - отсоединенные секции, без них его не сделать
+            with self.assertRaises(CommandError):
+                call_command('prune_history', archive=True, stdout=StringIO())
+
+    def test_rows_beyond_partitions_go_to_default(self):
+        table = ViewHistory._meta.db_table
+        if not is_partitioned(connection, table):
+            self.skipTest('секции есть только на PostgreSQL')
+        self.assertEqual(check_history_partitions(None, databases=['default']), [])
+        viewer, viewed = self.users
+        future = shift_month(month_start(timezone.now()), 24)
+        row = ViewHistory.objects.create(viewer=viewer, viewed_user=viewed,
+                                         viewed_at=month_bound(future) + timedelta(days=1))
+        with mock.patch('app.checks.timezone.now', return_value=month_bound(future)):
+            self.assertEqual([warning.id for warning in check_history_partitions(None, databases=['default'])],
+                             ['app.W002', 'app.W002'])
+        
+        # Новая секция месяца забирает его строки из DEFAULT
+        self.assertEqual(create_partitions(connection, table, future, future), [future])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {partition_name(table, future)}')
+            self.assertEqual(cursor.fetchall(), [(row.pk,)])
+            cursor.execute(f'SELECT count(*) FROM {default_name(table)}')
+            self.assertEqual(cursor.fetchone(), (0,))
+
+
+class EngagementRollupTests(APITestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                email=f'rollup{i}@test.com',
+                username=f'rollup{i}',
+                password='password123',
+                first_name='Rollup',
+                last_name=str(i),
+                gender='MF'[i % 2],
+                age=25,
+                city='Moscow'
+            )
+            for i in range(3)
+        ]
+
+    @override_settings(ENGAGEMENT_ROLLUP_LAG=0)
+    def test_rollup_is_incremental_and_idempotent(self):
+        first, second, third = self.users
+        ViewHistory.objects.create(viewer=second, viewed_user=first)
+        ViewHistory.objects.create(viewer=third, viewed_user=first)
+        UserInteraction.objects.create(from_user=second, to_user=first, interaction_type='like')
+        UserInteraction.objects.create(from_user=third, to_user=first, interaction_type='dislike')
+        
+        processed = rollup(chunk_size=1)
+        self.assertEqual(processed, {'views': 2, 'likes': 2, 'matches': 0})
+        self.assertEqual(rollup(), {'views': 0, 'likes': 0, 'matches': 0})
+        
+        UserInteraction.objects.create(from_user=first, to_user=second, interaction_type='like')
+        Match.objects.create(user1=first, user2=second)
+        rollup()
+        row = DailyEngagement.objects.get(user=first)
+        self.assertEqual(
+            (row.views_received, row.likes_received, row.likes_sent, row.matches), (2, 1, 1, 1)
+        )
+        self.assertEqual(DailyEngagement.objects.get(user=second).matches, 1)
+        self.assertFalse(DailyEngagement.objects.filter(user=third).exists())
+
+    def test_rollup_waits_for_lag(self):
+        first, second, _ = self.users
+        view = ViewHistory.objects.create(viewer=second, viewed_user=first)
+        # Свежая строка могла получить id раньше еще не зафиксированной - метка ее не проходит
+        self.assertEqual(rollup()['views'], 0)
+        later = timezone.now() + timedelta(seconds=settings.ENGAGEMENT_ROLLUP_LAG + 1)
+        self.assertEqual(rollup(now=later)['views'], 1)
+        self.assertEqual(DailyEngagement.objects.get(user=first, day=view.viewed_at.date()).views_received, 1)
+
+    def test_stats_endpoint_reads_only_rollup(self):
+        first, second, _ = self.users
+        today = timezone.now().date()
+        DailyEngagement.objects.create(user=first, day=today, views_received=3, likes_received=1)
+        DailyEngagement.objects.create(user=first, day=today - timedelta(days=10), views_received=2)
+        DailyEngagement.objects.create(user=first, day=today - timedelta(days=100), views_received=7)
+        DailyEngagement.objects.create(user=second, day=today, views_received=5)
+        self.client.force_authenticate(user=first)
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user-stats'), {'days': 90})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('dailyengagement', queries[0]['sql'])
+        self.assertEqual(response.data['totals']['views_received'], 5)
+        self.assertEqual(response.data['totals']['likes_received'], 1)
+        self.assertEqual([row['day'] for row in response.data['daily']], [today - timedelta(days=10), today])
+        
+        response = self.client.get(reverse('user-stats'), {'days': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class LikeInboxTests(APITestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                email=f'inbox{i}@test.com',
+                username=f'inbox{i}',
+                password='password123',
+                first_name='Inbox',
+                last_name=str(i),
+                gender='MF'[i % 2],
+                age=25,
+                city='Moscow'
+            )
+            for i in range(4)
+        ]
+
+    def test_inbox_flags_mutual_and_unanswered(self):
+        me, mutual, waiting, rejected = self.users
+        for user in [rejected, waiting, mutual]:
+            UserInteraction.objects.create(from_user=user, to_user=me, interaction_type='like')
+        UserInteraction.objects.create(from_user=me, to_user=mutual, interaction_type='like')
+        UserInteraction.objects.create(from_user=me, to_user=rejected, interaction_type='dislike')
+        self.client.force_authenticate(user=me)
+        
+        response = self.client.get(reverse('likes-me-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        flags = [(row['from_user'], row['is_mutual'], row['is_unanswered']) for row in response.data['results']]
+        self.assertEqual(flags, [
+            (mutual.pk, True, False), (waiting.pk, False, True), (rejected.pk, False, False)
+        ])
+        self.assertEqual(response.data['results'][0]['from_user_profile']['id'], mutual.pk)
+        with override_settings(FAST_LIST_SERIALIZATION=False):
+            self.assertEqual(self.client.get(reverse('likes-me-list')).data, response.data)
+        
+        response = self.client.get(reverse('likes-me-list'), {'unanswered': 'true'})
+        self.assertEqual([row['from_user'] for row in response.data['results']], [waiting.pk])
+
+    @override_settings(LIKE_HISTORY_WRITES=False)
+    def test_like_history_is_served_from_interactions_when_writes_are_off(self):
+        me, liker = self.users[:2]
+        self.client.force_authenticate(user=liker)
+        response = self.client.post(reverse('interaction-list'), {'to_user': me.pk, 'interaction_type': 'like'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(UserLikeHistory.objects.exists())
+        
+        self.client.force_authenticate(user=me)
+        response = self.client.get(reverse('like-history-list'))
+        [row] = response.data['results']
+        self.assertEqual(row['liked_by'], liker.pk)
+        self.assertEqual(row['liked_by_profile']['id'], liker.pk)
+
+class ActivityExportTests(APITestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                email=f'export{i}@test.com',
+                username=f'export{i}',
+                password='password123',
+                first_name='Export',
+                last_name=str(i),
+                gender='MF'[i % 2],
+                age=25,
+                city='Moscow'
+            )
+            for i in range(3)
+        ]
+        me, other, third = self.users
+        for user in [other, third]:
+            ViewHistory.objects.create(viewer=me, viewed_user=user)
+        UserInteraction.objects.create(from_user=me, to_user=other, interaction_type='like')
+        UserInteraction.objects.create(from_user=other, to_user=me, interaction_type='like')
+        UserInteraction.objects.create(from_user=third, to_user=me, interaction_type='dislike')
+        Match.objects.create(user1=me, user2=other)
+        ViewHistory.objects.create(viewer=other, viewed_user=third)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_ndjson_export_streams_all_user_records(self):
+        me, other, _ = self.users
+        self.client.force_authenticate(user=me)
+        response = self.client.get(reverse('user-export'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+        self.assertEqual([row['type'] for row in rows], [
+            'profile', 'view_history', 'view_history', 'swipes', 'likes_received', 'matches'
+        ])
+        self.assertEqual(rows[0]['email'], me.email)
+        self.assertEqual(rows[4]['from_user'], other.pk)
+
+    def test_csv_export_and_command(self):
+        me = self.users[0]
+        self.client.force_authenticate(user=me)
+        response = self.client.get(reverse('user-export'), {'output': 'csv', 'sections': 'swipes,matches'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'type,id,to_user,interaction_type,created_at,user1,user2,is_active')
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['swipes', 'matches'])
+        
+        response = self.client.get(reverse('user-export'), {'sections': 'passwords'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        out = StringIO()
+        call_command('export_activity', me.email, format='csv', sections='swipes,matches', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), lines)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    async def test_export_streams_chunk_by_chunk_under_asgi(self):
+        me = self.users[0]
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(me).access_token))()
+        with mock.patch('app.export.sync_to_async', wraps=sync_to_async) as hops:
+            response = await AsyncClient().get(reverse('user-export'), headers={'authorization': f'Bearer {token}'})
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+        # По переходу в синхронный поток на кусок, плюс конец потока и закрытие
+        self.assertEqual(hops.call_count, len(chunks) + 2)
+        self.assertGreater(len(chunks), 1)
+        rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+        self.assertEqual([row['type'] for row in rows], [
+            'profile', 'view_history', 'view_history', 'swipes', 'likes_received', 'matches'
+        ])
+
+@SYNC_VIEW_HISTORY
+class AsyncEndpointTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(
+                email=f'fast{i}@test.com',
+                username=f'fast{i}',
+                password='password123',
+                first_name='Fast',
+                last_name=str(i),
+                gender='MF'[i % 2],
+                age=25,
+                city='Moscow'
+            )
+            for i in range(4)
+        ]
+        self.user = self.users[0]
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_swipe_shares_validation_and_creates_match(self):
+        url = reverse('fast-swipe')
+        UserInteraction.objects.create(from_user=self.users[1], to_user=self.user, interaction_type='like')
+        
+        response = self.client.post(url, {'to_user': self.users[1].id, 'interaction_type': 'like'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNotNone(response.json()['match'])
+        
+        response = self.client.post(url, {'to_user': self.users[1].id, 'interaction_type': 'like'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['status'], 'duplicate')
+        
+        response = self.client.post(url, {'to_user': self.users[2].id, 'interaction_type': 'wink'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('interaction_type', response.json())
+
+    def test_sync_swipe_accepts_and_rejects_the_same_input(self):
+        # Одни и те же свайпы от двух пользователей: в асинхронный и в синхронный эндпоинт
+        sync_client = APIClient()
+        sync_client.force_authenticate(user=self.users[1])
+        for payload in [
+            {'to_user': self.users[3].id, 'interaction_type': 'like'},
+            {'to_user': self.users[3].id, 'interaction_type': 'dislike'},
+            {'to_user': 999999, 'interaction_type': 'like'},
+            {'to_user': 'abc', 'interaction_type': 'like'},
+            {'interaction_type': 'like'},
+        ]:
+            fast = self.client.post(reverse('fast-swipe'), payload, format='json')
+            sync = sync_client.post(reverse('interaction-list'), payload, format='json')
+            self.assertEqual(fast.status_code, sync.status_code, payload)
+            if sync.status_code == status.HTTP_201_CREATED:
+                # Синхронный эндпоинт по-прежнему отвечает созданным взаимодействием
+                interaction = UserInteraction.objects.get(from_user=self.users[1], to_user=self.users[3])
+                self.assertEqual(sync.json()['id'], interaction.id)
+                self.assertIn('to_user_profile', sync.json())
+            else:
+                self.assertEqual(fast.json(), sync.json(), payload)
+        
+        fast = self.client.post(reverse('fast-swipe'), {'to_user': self.user.id, 'interaction_type': 'like'},
+                                format='json')
+        sync = sync_client.post(reverse('interaction-list'), {'to_user': self.users[1].id, 'interaction_type': 'like'},
+                                format='json')
+        self.assertEqual(sync.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(sync.json(), dict(fast.json(), to_user=self.users[1].id))
+        self.assertEqual(sync.json()['status'], 'invalid')
+
+    def test_responses_match_sync_endpoints(self):
+        for other in self.users[1:3]:
+            Match.objects.create(user1=self.user, user2=other)
+        self.assertEqual(self.client.get(reverse('fast-matches')).json(),
+                         self.client.get(reverse('match-list')).json())
+        
+        for page in ['0', '-1', '2', 'abc', '1.5', '1.0', 'last', '']:
+            fast = self.client.get(reverse('fast-matches'), {'page': page})
+            sync = self.client.get(reverse('match-list'), {'page': page})
+            self.assertEqual(fast.status_code, sync.status_code, page)
+            if sync.status_code == status.HTTP_200_OK:
+                self.assertEqual(fast.json()['results'], sync.json()['results'], page)
+        
+        response = self.client.get(reverse('fast-random-profile'), {'gender': 'F'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(response.json()['id'], {self.users[1].id, self.users[3].id})
+        
+        response = self.client.get(reverse('fast-deck'), {'size': 10})
+        ids = [profile['id'] for profile in response.json()['results']]
+        self.assertEqual(sorted(ids), [user.id for user in self.users[1:]])
+
+    async def test_served_through_asgi(self):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.user).access_token))()
+        response = await AsyncClient().get(reverse('fast-deck'), headers={'authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 3)
+        # Запросы из потока sync_to_async тоже учитываются
+        queries = re.search(r'desc="(\d+) queries"', response['Server-Timing'])
+        self.assertGreater(int(queries.group(1)), 0)
+
+    def test_requires_token(self):
+        self.client.credentials()
+        response = self.client.get(reverse('fast-deck'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class EventTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.broker = events.InMemoryBroker(history=3)
+        events._broker = self.broker
+        self.users = [
+            User.objects.create_user(
+                email=f'events{i}@test.com',
+                username=f'events{i}',
+                password='password123',
+                first_name='Events',
+                last_name=str(i),
+                gender='MF'[i % 2],
+                age=25,
+                city='Moscow'
+            )
+            for i in range(2)
+        ]
+
+    def tearDown(self):
+        events._broker = None
+
+    def test_match_and_invitation_are_published_to_both_users(self):
+        UserInteraction.objects.create(from_user=self.users[1], to_user=self.users[0], interaction_type='like')
+        self.client.force_authenticate(user=self.users[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('interaction-list'), {'to_user': self.users[1].id, 'interaction_type': 'like'})
+        match = Match.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('date-invitation-list'),
+                                        {'match': match.id, 'to_user': self.users[1].id})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(user=self.users[1])
+            self.client.patch(reverse('date-invitation-detail', args=[response.data['id']]), {'status': 'accepted'})
+        
+        for user in self.users:
+            history = [(event.type, event.data.get('status')) for event in self.broker.history[user.pk]]
+            self.assertEqual(history, [('match', None), ('invitation', 'pending'), ('invitation', 'accepted')])
+
+    async def test_stream_resumes_after_last_event_id(self):
+        user_id = self.users[0].pk
+        first = self.broker.publish(user_id, 'match', {'id': 1})
+        self.broker.publish(user_id, 'match', {'id': 2})
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.users[0]).access_token))()
+        response = await AsyncClient().get(reverse('fast-events'), {'token': token},
+                                           headers={'last-event-id': first.id})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+        self.assertIn(b'data: {"id":2}', await anext(chunks))
+        
+        self.broker.publish(user_id, 'invitation', {'id': 3})
+        self.assertIn(b'event: invitation', await anext(chunks))
+        await chunks.aclose()
+
+    async def test_resync_when_history_was_evicted(self):
+        user_id = self.users[0].pk
+        for i in range(5):
+            self.broker.publish(user_id, 'match', {'id': i})
+        stream = self.broker.subscribe(user_id, last_event_id='1')
+        self.assertEqual((await anext(stream)).type, events.RESYNC)
+        self.assertEqual([(await anext(stream)).data['id'] for _ in range(3)], [2, 3, 4])
+        await stream.aclose()
+
+    async def test_history_expires_and_subscribers_are_dropped(self):
+        user_id, other_id = self.users[0].pk, self.users[1].pk
+        with mock.patch('app.events.time.time_ns', return_value=10 ** 12):
+            seen = self.broker.publish(user_id, 'match', {'id': 1})
+            self.broker.publish(user_id, 'match', {'id': 2})
+        stream = self.broker.subscribe(user_id, last_event_id=seen.id)
+        self.assertEqual((await anext(stream)).data['id'], 2)
+        self.assertIn(user_id, self.broker.subscribers)
+        await stream.aclose()
+        self.assertNotIn(user_id, self.broker.subscribers)
+        
+        with mock.patch('app.events.time.time_ns', return_value=10 ** 12 + (self.broker.ttl + 1) * 10 ** 9):
+            self.broker.publish(other_id, 'match', {'id': 3})
+        self.assertEqual(list(self.broker.history), [other_id])
+        self.assertEqual(len(self.broker.timeline), 1)
+        stream = self.broker.subscribe(user_id, last_event_id=seen.id)
+        self.assertEqual((await anext(stream)).type, events.RESYNC)
+        await stream.aclose()
+
+
+@SYNC_VIEW_HISTORY
+@override_settings(RECOMMENDER=dict(settings.RECOMMENDER, LAG=0))
+class RecommendationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(
+                email=f'rec{i}@test.com',
+                username=f'rec{i}',
+                password='password123',
+                first_name='Rec',
+                last_name=str(i),
+                gender='MF'[i % 2],
+                age=25,
+                city='Moscow'
+            )
+            for i in range(6)
+        ]
+
+    def _like(self, a, b):
+        UserInteraction.objects.create(from_user=self.users[a], to_user=self.users[b], interaction_type='like')
+
+    def _recommended(self, a):
+        return list(Recommendation.objects.filter(user=self.users[a]).order_by('-score')
+                    .values_list('recommended_user_id', flat=True))
+
+    def test_recommends_profiles_liked_by_neighbors(self):
+        for a, b in [(1, 3), (1, 5), (2, 3), (0, 3)]:
+            self._like(a, b)
+        call_command('build_recommendations', '--full', stdout=StringIO())
+        self.assertEqual(self._recommended(0), [self.users[5].id])
+        self.assertEqual(self._recommended(2), [self.users[5].id])
+        self.assertEqual(self._recommended(1), [])
+        
+        # Повторный запуск пересчитывает только пользователей с новыми свайпами
+        UserInteraction.objects.create(from_user=self.users[0], to_user=self.users[5], interaction_type='dislike')
+        Recommendation.objects.filter(user=self.users[2]).update(score=42)
+        call_command('build_recommendations', stdout=StringIO())
+        self.assertEqual(self._recommended(0), [])
+        self.assertEqual(Recommendation.objects.get(user=self.users[2]).score, 42)
+
+    def test_item_similarity_is_cosine_over_likers(self):
+        from .recommendations import Recommender
+        for a, b in [(0, 3), (1, 3), (1, 4), (2, 4), (2, 5)]:
+            self._like(a, b)
+        ids = [self.users[i].id for i in (3, 4, 5)]
+        items, similar, similarity = Recommender().similar_items(
+            np.array(ids[:1]), np.array(ids), np.array([2, 2, 1])
+        )
+        self.assertEqual(list(zip(items.tolist(), similar.tolist())), [(ids[0], ids[1])])
+        self.assertAlmostEqual(similarity[0], 1 / 2)
+        
+        # Профиль 5 похож на лайкнутый пользователем 1 профиль 4, но не на 3
+        call_command('build_recommendations', '--full', stdout=StringIO())
+        scores = dict(Recommendation.objects.filter(user=self.users[1])
+                      .values_list('recommended_user_id', 'score'))
+        self.assertEqual(list(scores), [ids[2]])
+        self.assertAlmostEqual(scores[ids[2]], 1 / 2 ** 0.5)
+
+    def test_deck_starts_with_recommendations(self):
+        Recommendation.objects.create(user=self.users[0], recommended_user=self.users[4], score=0.5)
+        Recommendation.objects.create(user=self.users[0], recommended_user=self.users[2], score=0.9)
+        self.client.force_authenticate(user=self.users[0])
+        response = self.client.get(reverse('user-deck'), {'sort': 'recommended', 'size': 5})
+        ids = [profile['id'] for profile in response.data['results']]
+        self.assertEqual(ids[:2], [self.users[2].id, self.users[4].id])
+        self.assertEqual(sorted(ids), sorted(user.id for user in self.users[1:]))
+
+
+MEDIA_TMP = tempfile.mkdtemp()
+
+
+@override_settings(PHOTO_PROCESSING_ASYNC=False, MEDIA_ROOT=MEDIA_TMP)
+class PhotoUploadTests(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_TMP, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        # pk откатанных фото переиспользуются: без очистки имена превью получили бы суффикс
+        shutil.rmtree(MEDIA_TMP, ignore_errors=True)
+        self.user = User.objects.create_user(
+            email='photo@test.com',
+            username='photo',
+            password='password123',
+            first_name='Photo',
+            last_name='Owner',
+            gender='F',
+            age=27,
+            city='Moscow'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def _jpeg_with_exif(self):
+        image = Image.new('RGB', (2000, 1000), 'red')
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Camera'
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_generates_renditions_without_exif(self):
+        url = reverse('user-upload-photo', args=[self.user.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'photo': self._jpeg_with_exif(), 'is_main': True}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['processing_status'], 'pending')
+        self.assertNotIn('photo', response.data)
+        
+        photo = UserPhoto.objects.get(pk=response.data['id'])
+        self.assertEqual(photo.processing_status, 'ready')
+        for name, size in settings.PHOTO_RENDITIONS.items():
+            with getattr(photo, name).open('rb') as rendition:
+                image = Image.open(rendition)
+                self.assertLessEqual(max(image.size), max(size))
+                # Фото повернуто по EXIF-ориентации, а сами EXIF-данные удалены
+                self.assertGreater(image.size[1], image.size[0])
+                self.assertEqual(len(image.getexif()), 0)
+        
+        response = self.client.get(reverse('user-detail', args=[self.user.id]))
+        self.assertTrue(response.data['main_photo']['thumbnail'].endswith(f'{photo.pk}_thumbnail.jpg'))
+
+    def test_pending_photo_hides_original_and_bomb_is_marked_failed(self):
+        url = reverse('user-upload-photo', args=[self.user.id])
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(url, {'photo': self._jpeg_with_exif()}, format='multipart')
+        photo = UserPhoto.objects.get(pk=response.data['id'])
+        # Пока превью нет, ссылок нет: оригинал с EXIF не отдается
+        self.assertEqual((response.data['thumbnail'], response.data['medium']), (None, None))
+        
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000), self.assertLogs('app.photos', 'ERROR'):
+            for callback in callbacks:
+                callback()
+        photo.refresh_from_db()
+        self.assertEqual(photo.processing_status, 'failed')
+        self.assertEqual(UserPhotoSerializer(photo).data['thumbnail'], None)
+
+    def test_process_photos_picks_up_photos_uploaded_before_renditions(self):
+        # Фото до миграции 0006: оригинал есть, превью нет, статус pending
+        old = UserPhoto.objects.create(user=self.user, photo=self._jpeg_with_exif(), is_main=True)
+        fresh = UserPhoto.objects.create(user=self.user, photo=self._jpeg_with_exif())
+        UserPhoto.objects.filter(pk=old.pk).update(uploaded_at=timezone.now() - timedelta(hours=1))
+        
+        call_command('process_photos', older_than=300, stdout=StringIO())
+        old.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((old.processing_status, fresh.processing_status), ('ready', 'pending'))
+        response = self.client.get(reverse('user-detail', args=[self.user.id]))
+        self.assertTrue(response.data['main_photo']['thumbnail'].endswith(f'{old.pk}_thumbnail.jpg'))
+
+
+@SYNC_VIEW_HISTORY
+class MockDataTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def test_generate_mock_data_is_consistent(self):
+        out = StringIO()
+        call_command('generate_mock_data', users=40, interactions=300, batch_size=15, seed='test', stdout=out)
+        reported = dict(re.findall(r'^(.+): (\d+) \(', out.getvalue(), re.M))
+        self.assertEqual(User.objects.count(), 40)
+        swipes = UserInteraction.objects.count()
+        self.assertEqual(int(reported['Создано взаимодействий']), swipes)
+        # Дубликаты пар отбрасываются, ответные свайпы добавляются
+        self.assertTrue(200 <= swipes <= 400, swipes)
+        
+        likes = set(UserInteraction.objects.filter(interaction_type='like').values_list('from_user_id', 'to_user_id'))
+        mutual = {pair for pair in likes if pair[0] < pair[1] and pair[::-1] in likes}
+        self.assertTrue(mutual)
+        self.assertEqual(set(Match.objects.values_list('user1_id', 'user2_id')), mutual)
+        self.assertEqual(Match.objects.count(), len(mutual))
+        self.assertEqual(MatchParticipant.objects.count(), 2 * len(mutual))
+        
+        received = Counter(to_user_id for _, to_user_id in likes)
+        for user_id, likes_count in User.objects.values_list('pk', 'likes_count'):
+            self.assertEqual(likes_count, received[user_id], user_id)
+        # Последовательность догнала явно заданные id
+        self.assertGreater(User.objects.create_user(email='next@test.com', username='next', gender='F', age=30).pk, 40)
+
+    def test_benchmark_api_reports_and_enforces_budgets(self):
+        output = os.path.join(self.tmp, 'bench.json')
+        # Тесты уже идут в тестовой базе: вторая не нужна
+        with mock.patch('app.management.commands.benchmark_api.isolated_database', nullcontext):
+            call_command('benchmark_api', users=3, interactions=6, iterations=2, output=output, stdout=StringIO())
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(report['dataset'], {'users': 3, 'interactions': 6})
+        self.assertEqual(report['iterations'], 2)
+        self.assertEqual(set(report['endpoints']), set(DEFAULT_BUDGETS))
+        for result in report['endpoints'].values():
+            self.assertEqual(set(result), {'p50_ms', 'p99_ms', 'queries'})
+        
+        budgets = os.path.join(self.tmp, 'budgets.json')
+        with open(budgets, 'w') as f:
+            json.dump({'users-list': {'queries': 0, 'p99_ms': 1000}}, f)
+        with mock.patch('app.management.commands.benchmark_api.isolated_database', nullcontext):
+            with self.assertRaisesMessage(CommandError, 'users-list'):
+                call_command('benchmark_api', users=3, interactions=6, iterations=2, output=output,
+                             budgets=budgets, stdout=StringIO())
+
+# Проверки с настоящим Redis: TEST_REDIS_URL=redis://localhost:6379/15
+TEST_REDIS_URL = os.environ.get('TEST_REDIS_URL', '')
+
+
+class RedisConfigTests(SimpleTestCase):
+    def test_redis_cache_requires_package_and_location(self):
+        caches = {'default': {'BACKEND': REDIS_CACHE, 'LOCATION': 'redis://localhost:6379/0'}}
+        with override_settings(CACHES=caches):
+            self.assertEqual(check_redis_cache(None), [])
+            with mock.patch.dict(sys.modules, {'redis': None}):
+                self.assertEqual([error.id for error in check_redis_cache(None)], ['app.E001'])
+        with override_settings(CACHES={'default': {'BACKEND': REDIS_CACHE}}):
+            self.assertEqual([error.id for error in check_redis_cache(None)], ['app.E002'])
+
+    def test_events_broker_checks(self):
+        with override_settings(EVENTS=dict(settings.EVENTS, BROKER=REDIS_BROKER, REDIS_URL='')):
+            self.assertEqual([error.id for error in check_events_broker(None)], ['app.E004'])
+            self.assertEqual(check_in_memory_broker(None), [])
+        with override_settings(EVENTS=dict(settings.EVENTS, BROKER=IN_MEMORY_BROKER)):
+            self.assertEqual(check_events_broker(None), [])
+            self.assertEqual([warning.id for warning in check_in_memory_broker(None)], ['app.W001'])
+
+    @skipUnless(TEST_REDIS_URL, 'TEST_REDIS_URL не задан')
+    def test_redis_cache_round_trip(self):
+        caches = {'default': {'BACKEND': REDIS_CACHE, 'LOCATION': TEST_REDIS_URL}}
+        with override_settings(CACHES=caches):
+            cache.set('redis-config-test', {'id': 1}, 10)
+            self.assertEqual(cache.get('redis-config-test'), {'id': 1})
+            cache.delete('redis-config-test')
+
+
+@skipUnless(TEST_REDIS_URL, 'TEST_REDIS_URL не задан')
+class RedisBrokerTests(SimpleTestCase):
+    def setUp(self):
+        self.broker = events.RedisBroker(TEST_REDIS_URL, history=3, ttl=60)
+        self.user_id = random.randrange(10 ** 9, 10 ** 10)
+        self.addCleanup(self.broker.client.delete, f'events:{self.user_id}')
+
+    async def test_stream_resumes_and_expires(self):
+        first = self.broker.publish(self.user_id, 'match', {'id': 1})
+        self.broker.publish(self.user_id, 'match', {'id': 2})
+        self.assertLessEqual(self.broker.client.ttl(f'events:{self.user_id}'), 60)
+        stream = self.broker.subscribe(self.user_id, last_event_id=first.id, heartbeat=1)
+        self.assertEqual((await anext(stream)).data, {'id': 2})
+        self.broker.publish(self.user_id, 'invitation', {'id': 3})
+        self.assertEqual((await anext(stream)).type, 'invitation')
+        await stream.aclose()
+        
+        # Поток удален по ttl: клиент с известным id должен перечитать данные
+        self.broker.client.delete(f'events:{self.user_id}')
+        stream = self.broker.subscribe(self.user_id, last_event_id=first.id, heartbeat=1)
+        self.assertEqual((await anext(stream)).type, events.RESYNC)
+        await stream.aclose()
+        await self.broker.async_client.aclose()
@@ -1,10 +1,11 @@
+from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
-from . import views
+from . import views, async_views
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -23,12 +24,20 @@ router.register(r'view-history', views.ViewHistoryViewSet, basename='view-histor
 router.register(r'matches', views.MatchViewSet, basename='match')
 router.register(r'date-invitations', views.DateInvitationViewSet, basename='date-invitation')
 router.register(r'like-history', views.UserLikeHistoryViewSet, basename='like-history')
+router.register(r'likes-me', views.LikeInboxViewSet, basename='likes-me')
 router.register(r'auth', views.UserRegistrationViewSet, basename='auth')
 
 urlpatterns = [
+    # Асинхронные версии самых нагруженных эндпоинтов для запуска через ASGI
+    path('api/fast/swipe/', async_views.swipe, name='fast-swipe'),
+    path('api/fast/users/deck/', async_views.deck, name='fast-deck'),
+    path('api/fast/users/random_profile/', async_views.random_profile, name='fast-random-profile'),
+    path('api/fast/matches/', async_views.matches, name='fast-matches'),
+    path('api/fast/events/', async_views.events, name='fast-events'),
     path('api/', include(router.urls)),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('admin/', admin.site.urls),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
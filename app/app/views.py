@@ -1,18 +1,37 @@
+import random
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db import router
 from django.db.models import Q, Count
 from django.utils import timezone
+from django.utils.http import parse_etags
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import *
 from .serializers import *
-import random
+from .sampling import sample_object
+from .deck import get_deck, rank, parse_deck_size, parse_sort
+from .swipes import record_swipe, record_swipes
+from .buffers import record_views
+from .pagination import KeysetPagination
+from .photos import schedule_photo_processing
+from .filters import UserFilter, profile_filters
+from .events import publish_invitation
+from .readers import SparseFieldsMixin, ValuesListMixin
+from .replicas import ReplicaReadMixin
+from .engagement import engagement_stats, parse_days
+from .export import FORMATS, aiter_chunks, export_activity, parse_sections
 
-class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all().prefetch_related('photos')
+class UserViewSet(ReplicaReadMixin, SparseFieldsMixin, viewsets.ModelViewSet):
+    queryset = User.objects.all()
     serializer_class = UserProfileSerializer
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['gender', 'city', 'status']
+    filterset_class = UserFilter
+    # Из реплики читаются список, статистика и выгрузка; deck и random_profile пишут просмотры
+    replica_actions = {'list', 'stats', 'export'}
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -26,46 +45,104 @@ class UserViewSet(viewsets.ModelViewSet):
             if age_max:
                 queryset = queryset.filter(age__lte=age_max)
         
-        return queryset.exclude(id=self.request.user.id)
+        if self.action in ('list', 'random_profile', 'deck'):
+            queryset = queryset.exclude(id=self.request.user.id)
+        return queryset
+    
+    def get_profile_filters(self):
+        return profile_filters(self.request.query_params)
+    
+    def get_sort(self):
+        return parse_sort(self.request.query_params.get('sort'))
+    
+    def retrieve(self, request, *args, **kwargs):
+        # Версию профиля проверяем до загрузки пользователя и сериализации
+        version = self.get_queryset().filter(pk=kwargs['pk'])\
+                      .values_list('profile_version', flat=True).first()
+        if version is None:
+            raise Http404
+        etag = f'"{kwargs["pk"]}-{version}"'
+        # If-None-Match сравнивается слабо: W/ не учитывается, '*' совпадает с любым
+        etags = {tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))}
+        if etag in etags or '*' in etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        
+        response = super().retrieve(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
     
     @action(detail=False, methods=['get'])
     def random_profile(self, request):
         """Получить случайный профиль с фильтрацией"""
-        queryset = self.get_queryset()
-        
-        filters = {}
-        gender = request.query_params.get('gender')
-        age_min = request.query_params.get('age_min')
-        age_max = request.query_params.get('age_max')
-        city = request.query_params.get('city')
-        status = request.query_params.get('status')
-        
-        if gender:
-            filters['gender'] = gender
-        if age_min:
-            filters['age__gte'] = age_min
-        if age_max:
-            filters['age__lte'] = age_max
-        if city:
-            filters['city__iexact'] = city
-        if status:
-            filters['status'] = status
-        
-        filtered_users = queryset.filter(**filters)
-        
-        if not filtered_users.exists():
+        queryset = self.get_queryset().filter(**self.get_profile_filters())
+        sort = self.get_sort()
+        # С сортировкой - случайный профиль среди лучших кандидатов
+        top = rank(request.user, queryset, sort, settings.RANKED_TOP_K) if sort else []
+        if top:
+            random_user = queryset.filter(pk=random.choice(top)).first()
+        else:
+            random_user = sample_object(queryset)
+        
+        if random_user is None:
             return Response({"detail": "Нет пользователей, соответствующих фильтрам"}, 
                           status=status.HTTP_404_NOT_FOUND)
         
-        random_user = random.choice(list(filtered_users))
         serializer = self.get_serializer(random_user)
+        record_views(request.user, [random_user])
+        
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def deck(self, request):
+        """Получить пачку кандидатов для свайпов и курсор следующей пачки"""
+        size = parse_deck_size(request.query_params.get('size'))
+        if size is None:
+            return Response({"detail": "Некорректный размер пачки"}, 
+                          status=status.HTTP_400_BAD_REQUEST)
         
-        ViewHistory.objects.create(
-            viewer=request.user,
-            viewed_user=random_user
+        profiles, next_cursor = get_deck(
+            request.user,
+            self.get_profile_filters(),
+            size,
+            cursor=request.query_params.get('cursor'),
+            sort=self.get_sort()
         )
         
-        return Response(serializer.data)
+        record_views(request.user, profiles)
+        
+        return Response({
+            "results": self.get_serializer(profiles, many=True).data,
+            "next": next_cursor
+        })
+    
+    @action(detail=False, methods=['get'], url_path='me/stats')
+    def stats(self, request):
+        """Просмотры, лайки и матчи текущего пользователя по дням из дневных агрегатов"""
+        days = parse_days(request.query_params.get('days'))
+        if days is None:
+            return Response({"detail": "Некорректное число дней"}, 
+                          status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(engagement_stats(request.user, days))
+    
+    @action(detail=False, methods=['get'], url_path='me/export')
+    def export(self, request):
+        """Все записи текущего пользователя одним потоком NDJSON или CSV (?output=csv)"""
+        output = request.query_params.get('output', 'ndjson')
+        sections = parse_sections(request.query_params.get('sections'))
+        if output not in FORMATS or sections is None:
+            return Response({"detail": "Некорректный формат или раздел выгрузки"}, 
+                          status=status.HTTP_400_BAD_REQUEST)
+        
+        # Строки читаются уже после выхода из представления, поэтому база выбирается сейчас
+        using = router.db_for_read(User)
+        chunks = export_activity(request.user, sections, output, using=using)
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiter_chunks(chunks)
+        response = StreamingHttpResponse(chunks, content_type=FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="activity-{request.user.pk}.{output}"'
+        response['X-Accel-Buffering'] = 'no'
+        return response
     
     @action(detail=True, methods=['post'])
     def upload_photo(self, request, pk=None):
@@ -81,103 +158,139 @@ class UserViewSet(viewsets.ModelViewSet):
             return Response({"detail": "Фото не предоставлено"}, 
                           status=status.HTTP_400_BAD_REQUEST)
         
+        # Файл только сохраняется в хранилище; декодирование и превью - в фоне
         user_photo = UserPhoto.objects.create(
             user=user,
             photo=photo,
             is_main=is_main
         )
+        schedule_photo_processing(user_photo.pk)
         
-        return Response(UserPhotoSerializer(user_photo).data, 
+        return Response(UserPhotoSerializer(user_photo, context=self.get_serializer_context()).data, 
                       status=status.HTTP_201_CREATED)
 
-class UserInteractionViewSet(viewsets.ModelViewSet):
+class UserInteractionViewSet(ValuesListMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     queryset = UserInteraction.objects.all()
     serializer_class = UserInteractionSerializer
+    pagination_class = KeysetPagination
+    keyset_field = 'created_at'
     
     def get_queryset(self):
         return UserInteraction.objects.filter(from_user=self.request.user)\
-                   .select_related('to_user', 'to_user__photos')
+                   .select_related('to_user')
     
-    def perform_create(self, serializer):
-        to_user_id = self.request.data.get('to_user')
-        interaction_type = self.request.data.get('interaction_type')
+    def create(self, request, *args, **kwargs):
+        """Свайп с теми же проверками, что у асинхронного /api/fast/swipe/; в ответе - созданное взаимодействие"""
+        serializer = SwipeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
         
-        if UserInteraction.objects.filter(from_user=self.request.user, to_user_id=to_user_id).exists():
-            raise serializers.ValidationError("Взаимодействие уже существует")
+        result, code = record_swipe(
+            request.user, serializer.validated_data['to_user'], serializer.validated_data['interaction_type']
+        )
+        if result['status'] != 'created':
+            return Response(result, status=code)
         
-        interaction = serializer.save(from_user=self.request.user)
+        interaction = self.get_queryset().get(to_user_id=result['to_user'])
+        return Response(self.get_serializer(interaction).data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Сохранить пачку свайпов, накопленных клиентом офлайн"""
+        serializer = BulkSwipeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
         
-        if interaction_type == 'like':
-            to_user = User.objects.get(id=to_user_id)
-            to_user.likes_count += 1
-            to_user.save()
-            
-            UserLikeHistory.objects.create(
-                user=to_user,
-                liked_by=self.request.user
-            )
-            
-            if UserInteraction.objects.filter(
-                from_user=to_user, 
-                to_user=self.request.user, 
-                interaction_type='like'
-            ).exists():
-                Match.objects.create(
-                    user1=self.request.user,
-                    user2=to_user
-                )
+        results = record_swipes(request.user, [
+            (swipe['to_user'], swipe['interaction_type'])
+            for swipe in serializer.validated_data['swipes']
+        ])
+        
+        return Response({"results": results}, status=status.HTTP_200_OK)
 
-class ViewHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+class ViewHistoryViewSet(ReplicaReadMixin, ValuesListMixin, SparseFieldsMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = ViewHistorySerializer
+    pagination_class = KeysetPagination
+    keyset_field = 'viewed_at'
     
     def get_queryset(self):
         return ViewHistory.objects.filter(viewer=self.request.user)\
-                   .select_related('viewed_user', 'viewed_user__photos')\
+                   .select_related('viewed_user')\
                    .order_by('-viewed_at')
 
-class MatchViewSet(viewsets.ReadOnlyModelViewSet):
+class MatchViewSet(ReplicaReadMixin, SparseFieldsMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = MatchSerializer
     
     def get_queryset(self):
-        return Match.objects.filter(
-            Q(user1=self.request.user) | Q(user2=self.request.user),
-            is_active=True
-        ).select_related('user1', 'user2', 'user1__photos', 'user2__photos')
+        return Match.for_user(self.request.user).select_related('user1', 'user2')
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
         return context
 
-class DateInvitationViewSet(viewsets.ModelViewSet):
+class DateInvitationViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     queryset = DateInvitation.objects.all()
     serializer_class = DateInvitationSerializer
     
     def get_queryset(self):
+        # Отправитель и получатель приглашения - всегда участники его матча
         return DateInvitation.objects.filter(
-            Q(from_user=self.request.user) | Q(to_user=self.request.user)
-        ).select_related('from_user', 'to_user', 'match')
+            match__participants__user=self.request.user
+        ).select_related('from_user', 'to_user', 'match')\
+         .order_by('-created_at', '-id')
     
     def perform_create(self, serializer):
         match_id = self.request.data.get('match')
         try:
             match = Match.objects.get(id=match_id)
-            if self.request.user not in [match.user1, match.user2]:
+            if self.request.user.pk not in (match.user1_id, match.user2_id):
                 raise serializers.ValidationError("Вы не участник этого матча")
             
-            to_user = match.user2 if match.user1 == self.request.user else match.user1
-            serializer.save(from_user=self.request.user, to_user=to_user, match=match)
+            to_user = match.user2 if match.user1_id == self.request.user.pk else match.user1
+            invitation = serializer.save(from_user=self.request.user, to_user=to_user, match=match)
         except Match.DoesNotExist:
             raise serializers.ValidationError("Матч не найден")
+        publish_invitation(invitation)
+    
+    def perform_update(self, serializer):
+        previous_status = serializer.instance.status
+        invitation = serializer.save()
+        if invitation.status != previous_status:
+            publish_invitation(invitation)
 
-class UserLikeHistoryViewSet(viewsets.ReadOnlyModelViewSet):
-    serializer_class = UserLikeHistorySerializer
+class UserLikeHistoryViewSet(ReplicaReadMixin, ValuesListMixin, SparseFieldsMixin, viewsets.ReadOnlyModelViewSet):
+    """Устаревший список лайков; при LIKE_HISTORY_WRITES=False читает UserInteraction"""
+    pagination_class = KeysetPagination
+    keyset_field = 'created_at'
+    
+    def get_serializer_class(self):
+        if settings.LIKE_HISTORY_WRITES:
+            return UserLikeHistorySerializer
+        return InteractionLikeHistorySerializer
     
     def get_queryset(self):
+        if not settings.LIKE_HISTORY_WRITES:
+            return UserInteraction.objects.filter(to_user=self.request.user, interaction_type='like')\
+                       .select_related('from_user')\
+                       .order_by('-created_at')
         return UserLikeHistory.objects.filter(user=self.request.user)\
-                   .select_related('liked_by', 'liked_by__photos')\
+                   .select_related('liked_by')\
                    .order_by('-created_at')
 
+class LikeInboxViewSet(ReplicaReadMixin, ValuesListMixin, SparseFieldsMixin, viewsets.ReadOnlyModelViewSet):
+    """Кто меня лайкнул: входящие лайки с отметками взаимности и ответа.
+
+    ?unanswered=true оставляет только тех, кому пользователь еще не ответил.
+    """
+    serializer_class = LikeInboxSerializer
+    pagination_class = KeysetPagination
+    keyset_field = 'created_at'
+    
+    def get_queryset(self):
+        queryset = UserInteraction.incoming_likes(self.request.user).select_related('from_user')
+        if self.request.query_params.get('unanswered') in ('1', 'true'):
+            queryset = queryset.filter(is_unanswered=True)
+        return queryset
+
 class UserRegistrationViewSet(viewsets.GenericViewSet):
     serializer_class = UserRegistrationSerializer
     permission_classes = [permissions.AllowAny]